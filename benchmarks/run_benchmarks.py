@@ -0,0 +1,450 @@
+"""
+Benchmark suite for the Python side of the project
+Measures each layer of the ingest pipeline and writes machine-readable JSON:
+
+    dispatch  - on_message cost of the Step 1 listener, the Step 2 client and
+                the Step 4 MQTT core (used by the Qt worker and the gateway)
+    logger    - cost of one log entry at growing session lengths, for the
+                original rewrite-the-whole-.xlsx logger and the streaming logger
+    qt        - offscreen ESP32Widget updates and a full 20-device GUI refresh
+    liveness  - cost of recording a device's traffic and of one timer wheel tick
+                while every device of a fleet is kept online
+    startup   - cold import time of each entry point in a fresh interpreter,
+                checked against STARTUP_BUDGET_MS, and the heavy modules
+                (Qt, pandas, numpy...) each one loads without needing them
+    loopback  - end-to-end publish -> broker -> MQTT core (needs a local broker)
+
+Every result is "lower is better". Compare against a saved baseline to see
+regressions before they ship:
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --threshold 0.25
+
+Exit code is 1 when a result is slower than baseline * (1 + threshold), or
+when an entry point is over its startup budget.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+STEP4_DIR = os.path.join(ROOT, "snippets", "step4")
+for path in (STEP4_DIR, os.path.join(ROOT, "src"), os.path.join(ROOT, "src", "step2")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Benchmark Configuration
+DISPATCH_MESSAGES = 20000
+DISPATCH_DEVICES = 20
+LOGGER_SESSION_LENGTHS = [10, 100, 500]     # Entries already logged when the cost is measured
+LOGGER_SAMPLES = 5                          # Entries timed at each session length
+FLEET_DEVICES = 200                         # Devices logging at once, one file each or one SQLite store
+FLEET_ROUNDS = 20                           # Rounds of one entry per device
+QT_UPDATES = 2000
+LIVENESS_DEVICES = [200, 2000]              # Fleet sizes kept online by the liveness monitor
+LIVENESS_SECONDS = 3.0                      # Wall time per fleet size (longer than the stale deadline)
+STARTUP_RUNS = 3                            # Fresh interpreters per entry point (best run is kept)
+STARTUP_BUDGET_MS = {"cli": 400, "gateway": 400, "gui": 800}
+# Entry point -> (module, modules it must not import at startup)
+STARTUP_ENTRY_POINTS = {
+    "cli": ("mqtt_console", ("PyQt6", "pandas", "numpy", "openpyxl")),
+    "gateway": ("mqtt_gateway", ("PyQt6", "pandas", "numpy", "openpyxl")),
+    "gui": ("main_window", ("pandas", "numpy", "openpyxl")),
+}
+LOOPBACK_MESSAGES = 2000
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+
+
+def fake_message(topic, payload):
+    """Object with the attributes of a paho MQTTMessage used by the handlers"""
+    return SimpleNamespace(topic=topic, payload=payload, timestamp=time.monotonic())
+
+
+def time_per_op(func, count):
+    """Microseconds per call of func(i) for i in range(count)"""
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the handlers' console output (the snippets print every message)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def in_temp_dir():
+    """Run with a temporary working directory so logs/ does not land in the repo"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+
+# ─── dispatch ─────────────────────────────────────────
+def bench_dispatch(results):
+    import mqtt_listener
+    topics = [f"{mqtt_listener.MQTT_NAMESPACE}/esp32_{i}/data" for i in range(DISPATCH_DEVICES)]
+    messages = [fake_message(topics[i % DISPATCH_DEVICES], b"L1") for i in range(DISPATCH_MESSAGES)]
+    with quiet():
+        results["dispatch.listener_us"] = time_per_op(
+            lambda i: mqtt_listener.on_message(None, None, messages[i]), DISPATCH_MESSAGES)
+
+    import mqtt_bidirectional
+    manager = mqtt_bidirectional.MQTTManager()
+    topics = [f"{mqtt_bidirectional.MQTT_NAMESPACE}/esp32_{i}/data" for i in range(DISPATCH_DEVICES)]
+    messages = [fake_message(topics[i % DISPATCH_DEVICES], b"L1") for i in range(DISPATCH_MESSAGES)]
+    with quiet():
+        results["dispatch.bidirectional_us"] = time_per_op(
+            lambda i: manager.on_message(messages[i]), DISPATCH_MESSAGES)
+
+    from log_rotation import segment_store
+    from log_writer import LogWriter
+    from mqtt_core import MQTTCore
+    from mqtt_logger import LOGS_DIR
+    from wire_protocol import encode_frame
+    with in_temp_dir(), quiet():
+        writer = LogWriter(queue_size=2 * DISPATCH_MESSAGES + 1)
+        writer.start()
+        core = MQTTCore(writer)
+        messages = [fake_message(f"mosquito/esp32_{i % DISPATCH_DEVICES}/data", b"L1")
+                    for i in range(DISPATCH_MESSAGES)]
+        results["dispatch.core_us"] = time_per_op(lambda i: core.on_message(messages[i]), DISPATCH_MESSAGES)
+        messages = [fake_message(f"mosquito/esp32_{i % DISPATCH_DEVICES}/data", encode_frame("L1", i, i))
+                    for i in range(DISPATCH_MESSAGES)]
+        results["dispatch.core_binary_us"] = time_per_op(lambda i: core.on_message(messages[i]),
+                                                         DISPATCH_MESSAGES)
+        core.close_logs()
+        writer.stop()
+        # Let the closed segments be compressed before the temporary folder is removed
+        segment_store(LOGS_DIR).wait_idle()
+
+
+# ─── logger ───────────────────────────────────────────
+class RewriteExcelLogger:
+    """The original Step 4 logger: rebuilds a DataFrame and rewrites the .xlsx per entry"""
+
+    def __init__(self, path):
+        self.path = path
+        self.log_data = []
+
+    def log_entry(self, message):
+        import pandas as pd
+        self.log_data.append({'Timestamp': time.strftime("%Y-%m-%d %H:%M:%S"), 'ESP32_Name': "ESP32_1",
+                              'Direction': 'Received', 'Message_Type': 'Data', 'Message': message,
+                              'Notes': 'Data from ESP32'})
+        pd.DataFrame(self.log_data).to_excel(self.path, index=False)
+
+
+def bench_logger(results):
+    from log_rotation import segment_store
+    from log_writer import LogWriter
+    from mqtt_logger import LOGS_DIR, Logger
+    with in_temp_dir() as tmp:
+        try:
+            import pandas  # noqa: F401
+            legacy = RewriteExcelLogger(os.path.join(tmp, "legacy.xlsx"))
+        except ImportError:
+            legacy = None
+            print("pandas not installed, skipping the legacy Excel logger")
+
+        writer = LogWriter()
+        writer.start()
+        logger = Logger("ESP32_1", writer)
+        for length in LOGGER_SESSION_LENGTHS:
+            if legacy:
+                while len(legacy.log_data) < length:
+                    legacy.log_entry("L1")
+                results[f"logger.excel_rewrite_at_{length}_us"] = time_per_op(
+                    lambda i: legacy.log_entry("L1"), LOGGER_SAMPLES)
+            while logger.entry_count < length:
+                logger.log_received_data("L1")
+            logger.flush()
+            # Timed including the write to disk, to compare like with like
+            results[f"logger.streaming_at_{length}_us"] = time_per_op(
+                lambda i: (logger.log_received_data("L1"), logger.flush()), LOGGER_SAMPLES)
+        logger.close()
+
+        # A large fleet: one log file per device versus the consolidated SQLite store
+        for log_format in ("csv", "sqlite"):
+            loggers = [Logger(f"ESP32_{d}", writer, log_format=log_format) for d in range(FLEET_DEVICES)]
+
+            def log_round(i):
+                for fleet_logger in loggers:
+                    fleet_logger.log_received_data("L1")
+                writer.flush()
+            results[f"logger.{log_format}_{FLEET_DEVICES}_devices_us"] = time_per_op(
+                log_round, FLEET_ROUNDS) / FLEET_DEVICES
+            for fleet_logger in loggers:
+                fleet_logger.close()
+            # Closed segments are compressed in the background; keep that out of the next measurement
+            writer.flush()
+            segment_store(LOGS_DIR).wait_idle()
+        writer.stop()
+
+
+# ─── qt ───────────────────────────────────────────────
+def bench_qt(results):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        print("PyQt6 not installed, skipping Qt benchmarks")
+        return
+    import main_window as gui
+    from update_coalescer import DeviceUpdate
+
+    app = QApplication.instance() or QApplication([])
+    with in_temp_dir(), quiet():
+        gui.METRICS_SUMMARY_INTERVAL = 0
+        gui.EXPORT_EXCEL_ON_EXIT = False
+        window = gui.MainWindow(gateway_address=("127.0.0.1", 9))   # never reaches a broker
+        window.mqtt_worker.stop()
+        model = window.device_model
+        now = time.time()
+        results["qt.row_update_us"] = time_per_op(
+            lambda i: model.apply_update(DeviceUpdate("ESP32_1", "L1", now, i, 0), i), QT_UPDATES)
+
+        coalescer = window.mqtt_worker.coalescer
+        for devices in (DISPATCH_DEVICES, 200):
+            def refresh_all(i):
+                for d in range(devices):
+                    coalescer.update(f"ESP32_{d + 2}", f"L{i}")
+                window.refresh_devices()
+            results[f"qt.refresh_{devices}_devices_us"] = time_per_op(refresh_all, QT_UPDATES // 10)
+        window.close()
+        app.processEvents()
+
+
+# ─── loopback ─────────────────────────────────────────
+def broker_available(host, port):
+    try:
+        with socket.create_connection((host, port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def bench_loopback(results, host, port):
+    if not broker_available(host, port):
+        print(f"No MQTT broker on {host}:{port}, skipping loopback benchmark")
+        return
+    import asyncio
+    from async_mqtt import AsyncMQTTClient
+    from log_rotation import segment_store
+    from log_writer import LogWriter
+    from mqtt_core import MQTTCore
+    from mqtt_logger import LOGS_DIR
+
+    async def run():
+        writer = LogWriter()
+        writer.start()
+        core = MQTTCore(writer, host, port)
+        runner = asyncio.create_task(core.run_async())
+        publisher = AsyncMQTTClient()
+        await publisher.connect(host, port)
+        while not core.connected:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)    # Let the wildcard subscription complete
+        start = time.perf_counter()
+        await asyncio.gather(*(publisher.publish_nowait(f"mosquito/bench_{i % DISPATCH_DEVICES}/data", "L1")
+                               for i in range(LOOPBACK_MESSAGES)))
+        deadline = time.monotonic() + 30
+        while core.metrics.stats()["messages"] < LOOPBACK_MESSAGES and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        stats = core.metrics.stats()
+        core.stop()
+        await runner
+        await publisher.disconnect()
+        core.close_logs()
+        writer.stop()
+        return elapsed, stats
+
+    with in_temp_dir(), quiet():
+        elapsed, stats = asyncio.run(run())
+        segment_store(LOGS_DIR).wait_idle()
+    received = stats["messages"]
+    if received < LOOPBACK_MESSAGES:
+        print(f"Loopback: only {received}/{LOOPBACK_MESSAGES} messages arrived")
+    results["loopback.us_per_message"] = elapsed / max(received, 1) * 1e6
+    results["loopback.dispatch_p99_ms"] = stats["latency"]["dispatch"]["p99_ms"]
+
+
+# ─── liveness ─────────────────────────────────────────
+def bench_liveness(results):
+    from liveness import LivenessMonitor
+    from timer_wheel import TimerWheel
+    for devices in LIVENESS_DEVICES:
+        wheel = TimerWheel()
+        monitor = LivenessMonitor(wheel)
+        names = [f"ESP32_{i}" for i in range(devices)]
+        results[f"liveness.seen_{devices}_devices_us"] = time_per_op(
+            lambda i: monitor.seen(names[i % devices]), devices * 10)
+        # Every device sends about once per second; time the ticks that re-arm their deadlines
+        tick_seconds = 0.0
+        ticks = 0
+        start = time.monotonic()
+        next_device = 0
+        while time.monotonic() - start < LIVENESS_SECONDS:
+            time.sleep(wheel.tick)
+            for _ in range(int(devices * wheel.tick) + 1):
+                monitor.seen(names[next_device])
+                next_device = (next_device + 1) % devices
+            tick_start = time.perf_counter()
+            wheel.advance()
+            tick_seconds += time.perf_counter() - tick_start
+            ticks += 1
+        results[f"liveness.tick_{devices}_devices_us"] = tick_seconds / ticks * 1e6
+        assert monitor.counts()["online"] == devices, "devices went stale during the benchmark"
+
+
+# ─── startup ──────────────────────────────────────────
+STARTUP_PROBE = """
+import sys, time
+sys.path.insert(0, {step4!r})
+start = time.perf_counter()
+import {module}
+print((time.perf_counter() - start) * 1000)
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def bench_startup(results):
+    for entry, (module, heavy) in STARTUP_ENTRY_POINTS.items():
+        probe = STARTUP_PROBE.format(step4=STEP4_DIR, module=module, heavy=heavy)
+        times = []
+        for _ in range(STARTUP_RUNS):
+            run = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                                 env={**os.environ, "QT_QPA_PLATFORM": "offscreen"})
+            if run.returncode != 0:
+                print(f"Cannot import {module}, skipping the {entry} startup benchmark:\n{run.stderr.strip()}")
+                break
+            import_ms, _, heavy_loaded = run.stdout.partition("\n")
+            times.append(float(import_ms))
+        if times:
+            heavy_loaded = heavy_loaded.split()
+            if heavy_loaded:
+                print(f"{module} imports {heavy_loaded[0]} at startup")
+            results[f"startup.{entry}_import_ms"] = min(times)
+            results[f"startup.{entry}_heavy_modules"] = len(heavy_loaded[0].split(",")) if heavy_loaded else 0
+
+
+def startup_over_budget(results):
+    """Entry points slower than their budget or loading heavy modules at startup"""
+    problems = []
+    for entry, budget in STARTUP_BUDGET_MS.items():
+        import_ms = results.get(f"startup.{entry}_import_ms")
+        if import_ms is not None and import_ms > budget:
+            problems.append(f"{entry} imports in {import_ms:.0f} ms (budget {budget} ms)")
+        if results.get(f"startup.{entry}_heavy_modules"):
+            problems.append(f"{entry} imports {results[f'startup.{entry}_heavy_modules']} heavy module(s) at startup")
+    return problems
+
+
+# ─── runner ───────────────────────────────────────────
+BENCHMARKS = {
+    "dispatch": bench_dispatch,
+    "logger": bench_logger,
+    "qt": bench_qt,
+    "liveness": bench_liveness,
+    "startup": bench_startup,
+    "loopback": None,   # needs broker arguments, see run()
+}
+
+
+def run(selected, host, port):
+    results = {}
+    for name in selected:
+        print(f"Running {name} benchmarks...")
+        if name == "loopback":
+            bench_loopback(results, host, port)
+        else:
+            BENCHMARKS[name](results)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison table; returns the names of regressed results"""
+    regressions = []
+    print(f"\n{'benchmark':42} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, value in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None or old == 0:
+            print(f"{name:42} {'-':>12} {value:12.3f} {'new':>8}")
+            continue
+        change = (value - old) / old
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:42} {old:12.3f} {value:12.3f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    """Main function to run the benchmark suite"""
+    parser = argparse.ArgumentParser(description="Benchmark the ingest, log and GUI pipeline")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a JSON file written by --save-baseline/--output")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--broker", default=MQTT_BROKER, help="MQTT broker for the loopback benchmark")
+    parser.add_argument("--port", type=int, default=MQTT_PORT, help="MQTT broker port")
+    args = parser.parse_args()
+
+    results = run(args.only or list(BENCHMARKS), args.broker, args.port)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            failed = True
+        else:
+            print("\nNo regressions")
+    problems = startup_over_budget(results)
+    for problem in problems:
+        print(f"Startup budget: {problem}")
+    if failed or problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
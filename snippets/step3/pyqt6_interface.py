@@ -9,9 +9,8 @@ Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
 import sys
 import time
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
-                            QWidget, QLabel, QLineEdit, QGroupBox, QPushButton,
-                            QTextEdit, QGridLayout)
-from PyQt6.QtCore import QTimer, QThread, pyqtSignal
+                            QWidget, QLabel, QLineEdit, QGroupBox, QPushButton)
+from PyQt6.QtCore import QThread, pyqtSignal
 from PyQt6.QtGui import QFont
 import paho.mqtt.client as mqtt
 
@@ -0,0 +1,263 @@
+"""
+asyncio MQTT client
+Runs paho's socket on an asyncio event loop instead of paho's own network
+thread (loop_start/loop_forever). Reads and writes are driven by the loop's
+reader/writer callbacks, so publishes never block the receive path and
+thousands of messages can be in flight at once.
+
+stay_connected() supervises the connection: it reconnects with jittered
+exponential backoff whenever the broker goes away. The blocking part of a
+connection attempt (DNS lookup, TCP handshake) runs in a worker thread, so a
+broker that is down or slow to answer never stalls the event loop. QoS 1 publishes made while
+disconnected (or still unacknowledged when the connection dropped) are kept
+by paho and re-sent after the reconnect, so their futures resolve then.
+
+    client = AsyncMQTTClient()
+    await client.connect("localhost", 1883)
+    await client.subscribe("mosquito/+/data", qos=1)
+    async for msg in client.messages():
+        await client.publish("mosquito/esp32_1/command", "4", qos=1)
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import asyncio
+import random
+import threading
+import paho.mqtt.client as mqtt
+
+# Client Configuration
+MESSAGE_QUEUE_SIZE = 10000    # Received messages waiting for the consumer (0 = unbounded)
+MISC_INTERVAL = 1.0           # Seconds between paho housekeeping calls (keepalive, retries)
+CONNECT_TIMEOUT = 10.0        # Seconds to wait for the broker's CONNACK
+RECONNECT_MIN_DELAY = 1.0     # Backoff before the first reconnect attempt (seconds)
+RECONNECT_MAX_DELAY = 60.0    # Upper bound of the reconnect backoff (seconds)
+
+
+class MQTTError(Exception):
+    """Raised when paho reports an error for a request"""
+
+
+class Backoff:
+    """Exponential backoff with jitter, so clients do not all retry at the same moment"""
+
+    def __init__(self, min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+
+    def next_delay(self):
+        """Delay before the next attempt: a random value in the upper half of the current step"""
+        step = min(self.max_delay, self.min_delay * 2 ** self.attempts)
+        self.attempts += 1
+        return random.uniform(step / 2, step)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class AsyncMQTTClient:
+    """paho client driven by an asyncio event loop"""
+
+    def __init__(self, client_id="", clean_session=True, queue_size=MESSAGE_QUEUE_SIZE):
+        self.client = mqtt.Client(client_id, clean_session=clean_session)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        self.loop = None
+        self._loop_thread = None
+        self.connected = False
+        self.dropped_messages = 0
+
+        # Optional hooks, called on the event loop
+        self.on_connect = None          # on_connect(rc)
+        self.on_disconnect = None       # on_disconnect(rc)
+        self.on_message = None          # on_message(msg); replaces the messages() queue
+
+        self._queue_size = queue_size
+        self._messages = None
+        self._connect_future = None
+        self._disconnected = None       # Set when the connection is lost
+        self._pending_publishes = {}    # mid -> future resolved on PUBACK
+        self._acked_mids = set()        # PUBACKs seen before their future was registered
+        self._pending_subscribes = {}   # mid -> future resolved on SUBACK
+        self._misc_task = None
+
+    # ─── paho socket callbacks ─────────────────────────
+    # During connect() paho calls these from the thread that opens the socket
+    def _on_loop(self, callback, *args):
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self._socket_opened, client, sock)
+
+    def _socket_opened(self, client, sock):
+        self.loop.add_reader(sock, client.loop_read)
+        if self._misc_task is None:
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(MISC_INTERVAL)
+            except asyncio.CancelledError:
+                break
+        self._misc_task = None
+
+    # ─── paho protocol callbacks ───────────────────────
+    def _on_connect(self, client, userdata, flags, rc):
+        self.connected = rc == 0
+        if self._connect_future and not self._connect_future.done():
+            if rc == 0:
+                self._connect_future.set_result(True)
+            else:
+                self._connect_future.set_exception(MQTTError(mqtt.connack_string(rc)))
+        if self.on_connect:
+            self.on_connect(rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        if self._disconnected:
+            self._disconnected.set()
+        if self._connect_future and not self._connect_future.done():
+            self._connect_future.set_exception(MQTTError("Connection closed before CONNACK"))
+        # paho re-sends unacknowledged publishes after a reconnect, so only subscribes fail
+        for future in self._pending_subscribes.values():
+            if not future.done():
+                future.set_exception(MQTTError("Disconnected"))
+        self._pending_subscribes.clear()
+        if self.on_disconnect:
+            self.on_disconnect(rc)
+
+    def _on_message(self, client, userdata, msg):
+        if self.on_message:
+            self.on_message(msg)
+            return
+        try:
+            self._messages.put_nowait(msg)
+        except asyncio.QueueFull:
+            self.dropped_messages += 1
+
+    def _on_publish(self, client, userdata, mid):
+        future = self._pending_publishes.pop(mid, None)
+        if future is None:
+            self._acked_mids.add(mid)
+        elif not future.done():
+            future.set_result(mid)
+
+    def _on_subscribe(self, client, userdata, mid, granted_qos):
+        future = self._pending_subscribes.pop(mid, None)
+        if future and not future.done():
+            future.set_result(granted_qos)
+
+    # ─── Public API ────────────────────────────────────
+    def will_set(self, topic, payload, qos=1, retain=True):
+        """Last Will published by the broker if the connection drops without a DISCONNECT
+        (call before connect)"""
+        self.client.will_set(topic, payload, qos=qos, retain=retain)
+
+    async def connect(self, host, port=1883, keepalive=60):
+        """Connect and wait for the broker's CONNACK"""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._message_queue()
+        self._disconnected = asyncio.Event()
+        self._connect_future = self.loop.create_future()
+        # DNS lookup and TCP handshake block; keep them off the event loop
+        await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+        try:
+            await asyncio.wait_for(self._connect_future, CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.client.disconnect()
+            raise MQTTError("No CONNACK from the broker") from None
+
+    async def stay_connected(self, host, port=1883, keepalive=60):
+        """Connect, and reconnect with backoff whenever the connection is lost (runs until cancelled).
+        The on_connect hook runs after every reconnect, e.g. to subscribe again."""
+        backoff = Backoff()
+        while True:
+            try:
+                await self.connect(host, port, keepalive)
+            except (OSError, MQTTError) as e:
+                delay = backoff.next_delay()
+                print(f"MQTT connection error: {e}, retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+                continue
+            backoff.reset()
+            await self._disconnected.wait()
+            delay = backoff.next_delay()
+            print(f"MQTT connection lost, reconnecting in {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+    def publish_nowait(self, topic, payload, qos=1, retain=False):
+        """Queue a publish; returns a future resolved with the mid on PUBACK"""
+        return self.publish_message(topic, payload, qos, retain)[1]
+
+    def publish_message(self, topic, payload, qos=1, retain=False):
+        """Queue a publish; returns (mid, future resolved with the mid on PUBACK)"""
+        future = self.loop.create_future()
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0:
+            self._pending_publishes[info.mid] = future  # paho sends it after the reconnect
+        elif info.rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_exception(MQTTError(mqtt.error_string(info.rc)))
+        elif info.mid in self._acked_mids:
+            self._acked_mids.discard(info.mid)
+            future.set_result(info.mid)
+        else:
+            self._pending_publishes[info.mid] = future
+        return info.mid, future
+
+    async def publish(self, topic, payload, qos=1, retain=False):
+        """Publish and wait until the broker has acknowledged it"""
+        return await self.publish_nowait(topic, payload, qos, retain)
+
+    async def subscribe(self, topic, qos=1):
+        """Subscribe and wait for the SUBACK; returns the granted QoS"""
+        rc, mid = self.client.subscribe(topic, qos=qos)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            raise MQTTError(mqtt.error_string(rc))
+        future = self.loop.create_future()
+        self._pending_subscribes[mid] = future
+        return await future
+
+    async def messages(self):
+        """Async iterator over received messages"""
+        messages = self._message_queue()
+        while True:
+            yield await messages.get()
+
+    def _message_queue(self):
+        if self._messages is None:
+            self._messages = asyncio.Queue(maxsize=self._queue_size)
+        return self._messages
+
+    def pending_messages(self):
+        """Number of received messages waiting for the consumer"""
+        return self._messages.qsize() if self._messages else 0
+
+    async def disconnect(self):
+        """Disconnect cleanly and stop the housekeeping task"""
+        self.client.disconnect()
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
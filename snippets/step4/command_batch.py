@@ -0,0 +1,157 @@
+"""
+Step 4: Group and broadcast commands
+One command sent to many ESP32s at once. A target addresses the devices:
+
+    all (or *)              every known device
+    group:<name>            a group from DEVICE_GROUPS
+    mosquito/+/command      an MQTT topic filter, matched against command topics
+    ESP32_1*                a device name pattern (fnmatch, case-insensitive)
+
+Every publish of a batch is handed to the socket in one go; each PUBACK (paho
+mid) is recorded as it arrives and the batch completes once every device has
+acknowledged or failed. A CommandBatch is the single completion object: it can
+be waited on from any thread, or given callbacks, and reports how long the
+whole fleet took.
+"""
+
+import fnmatch
+import itertools
+import threading
+import time
+from paho.mqtt.client import topic_matches_sub
+
+# Batch Configuration
+DEVICE_GROUPS = {}          # group name -> ESP32 names, e.g. {"rack_a": ["ESP32_1", "ESP32_2"]}
+BATCH_TIMEOUT = 10.0        # Seconds before unacknowledged devices are counted as failed
+
+ALL_DEVICES = ("all", "*")
+GROUP_PREFIX = "group:"
+
+
+def select_targets(target, names, command_topic, groups=None):
+    """Names of the devices addressed by a target (see the module docstring)"""
+    if groups is None:
+        groups = DEVICE_GROUPS
+    target = target.strip()
+    if target.lower() in ALL_DEVICES:
+        return list(names)
+    if target.lower().startswith(GROUP_PREFIX):
+        group = target[len(GROUP_PREFIX):].lower()
+        for group_name, members in groups.items():
+            if group_name.lower() == group:
+                return list(members)
+        return []
+    if "/" in target:
+        return [name for name in names
+                if command_topic(name) and topic_matches_sub(target, command_topic(name))]
+    pattern = target.upper()
+    return [name for name in names if fnmatch.fnmatchcase(name.upper(), pattern)]
+
+
+class CommandBatch:
+    """Completion object of one command sent to a set of devices (thread-safe)"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, command, targets, target=""):
+        self.batch_id = next(self._ids)
+        self.command = str(command)
+        self.target = target
+        self.targets = list(dict.fromkeys(targets))
+        self.results = {}           # esp_name -> True (acknowledged) / False (failed)
+        self.mids = {}              # esp_name -> paho message id of the publish
+        self.started_ns = time.monotonic_ns()
+        self.published_ns = None    # Every publish handed to the socket
+        self.completed_ns = None    # Every device acknowledged or failed
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        if not self.targets:
+            self._finish()
+
+    def track(self, esp_name, future):
+        """Record the outcome of a device's publish future (resolved with the mid on PUBACK,
+        or None if the command failed)"""
+        future.add_done_callback(lambda f: self._on_publish_done(esp_name, f))
+
+    def _on_publish_done(self, esp_name, future):
+        if future.cancelled() or future.exception() or future.result() is None:
+            self.set_result(esp_name, False)
+        else:
+            self.mids[esp_name] = future.result()
+            self.set_result(esp_name, True)
+
+    def set_result(self, esp_name, ok):
+        with self._lock:
+            if esp_name in self.results or self._done.is_set():
+                return
+            self.results[esp_name] = ok
+            finished = len(self.results) == len(self.targets)
+        if finished:
+            self._finish()
+
+    def mark_published(self):
+        self.published_ns = time.monotonic_ns()
+
+    def expire(self):
+        """Count every device that has not answered yet as failed"""
+        for esp_name in self.targets:
+            self.set_result(esp_name, False)
+
+    def _finish(self):
+        self.completed_ns = time.monotonic_ns()
+        self._done.set()
+        with self._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(batch) once complete (immediately if it already is)"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        """Block until complete; returns False on timeout"""
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def acknowledged(self):
+        return [name for name in self.targets if self.results.get(name) is True]
+
+    @property
+    def failed(self):
+        return [name for name in self.targets if self.results.get(name) is False]
+
+    def summary(self):
+        """Plain dict of the outcome, for display and the gateway protocol"""
+        def elapsed_ms(end_ns):
+            return (end_ns - self.started_ns) / 1e6 if end_ns else None
+        return {
+            "batch": self.batch_id,
+            "target": self.target,
+            "command": self.command,
+            "devices": len(self.targets),
+            "acknowledged": len(self.acknowledged),
+            "failed": self.failed,
+            "published_ms": elapsed_ms(self.published_ns),
+            "completed_ms": elapsed_ms(self.completed_ns),
+        }
+
+
+def format_batch_summary(summary):
+    """One line describing a batch summary dict"""
+    text = (f"Command {summary['command']} to {summary['target'] or 'devices'}: "
+            f"{summary['acknowledged']}/{summary['devices']} acknowledged")
+    if summary["completed_ms"] is not None:
+        text += f" in {summary['completed_ms']:.1f} ms"
+    if summary["failed"]:
+        text += f", failed: {', '.join(summary['failed'])}"
+    return text
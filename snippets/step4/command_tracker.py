@@ -0,0 +1,208 @@
+"""
+Step 4: Command acknowledgement tracking
+Every command is followed until it is known to have arrived:
+
+    sent        published, waiting for the broker's PUBACK (looked up by mid)
+    delivered   PUBACK received; blink commands to a device known to publish
+                acks then wait for it to report the finished blink on
+                mosquito/<id>/ack
+    completed   acknowledged (by the device, or by the broker when no device
+                ack is expected)
+    failed      no acknowledgement after COMMAND_MAX_RETRIES re-sends
+
+Not every firmware publishes acks, so a device is only expected to ack once
+it has sent one: until then a PUBACK completes its commands. Otherwise every
+blink command to it would be re-sent (and blink again) until it failed.
+
+A command is only published again when the device's ack is missing after the
+PUBACK, or when its publish failed. While the first publish is still in
+flight, paho re-sends it itself after a reconnect, so a second publish (with
+a new mid) could reach the device twice; the tracker waits instead, and fails
+the command if the PUBACK has not come after COMMAND_MAX_RETRIES more
+timeouts.
+
+Timeouts live on a timer wheel (timer_wheel.py), so thousands of outstanding
+commands cost a few dictionary entries and one periodic tick. Timeouts are
+put off while the connection is down. PUBACK latency and device round-trip
+time are recorded per device in the metrics.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+# Command tracking Configuration
+PUBACK_TIMEOUT = 5.0        # Seconds to wait for the broker's PUBACK before re-sending
+DEVICE_ACK_ENABLED = True   # Wait for mosquito/<id>/ack after blink commands, once the device sent one
+DEVICE_ACK_TIMEOUT = 5.0    # Seconds to wait for the device's ack, on top of the blink time
+BLINK_SECONDS = 0.5         # Duration of one blink (on + off) on the ESP32
+COMMAND_MAX_RETRIES = 2     # Re-sends after a timeout before the command is failed
+
+SENT = "sent"
+DELIVERED = "delivered"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class PendingCommand:
+    """One tracked command"""
+
+    __slots__ = ("esp_name", "topic", "command", "payload", "mid", "attempts", "waits", "state",
+                 "first_sent_ns", "sent_ns", "completed_ns", "timer", "delivered")
+
+    def __init__(self, esp_name, topic, command, payload, delivered):
+        self.esp_name = esp_name
+        self.topic = topic
+        self.command = command
+        self.payload = payload
+        self.mid = None
+        self.attempts = 0
+        self.waits = 0                        # PUBACK timeouts of the publish in flight
+        self.state = SENT
+        self.first_sent_ns = time.monotonic_ns()
+        self.sent_ns = self.first_sent_ns     # Latest attempt
+        self.completed_ns = None
+        self.timer = None
+        self.delivered = delivered            # Future: mid on the first PUBACK, None if the command failed
+
+    @property
+    def latency_ms(self):
+        """First send to completion (or failure)"""
+        if self.completed_ns is None:
+            return None
+        return (self.completed_ns - self.first_sent_ns) / 1e6
+
+
+class CommandTracker:
+    """Pending-command table keyed by mid, with timeouts and bounded retries"""
+
+    def __init__(self, publish, wheel, metrics=None, max_retries=COMMAND_MAX_RETRIES):
+        self.publish = publish          # publish(topic, payload) -> (mid, PUBACK future)
+        self.wheel = wheel
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.by_mid = {}                # mid -> PendingCommand waiting for its PUBACK
+        self.awaiting_device = {}       # esp_name -> deque of PendingCommand waiting for the device ack
+        self.ack_devices = set()        # Devices that have published an ack: their blinks wait for one
+
+        # Hooks, called on the event loop
+        self.on_result = None           # on_result(pending) once completed or failed
+        self.on_retry = None            # on_retry(pending) before a re-send
+        self.can_send = None            # can_send() -> False while offline: timeouts wait for the reconnect
+
+        self.sent = 0
+        self.delivered = 0
+        self.completed = 0
+        self.retries = 0
+        self.failed = 0
+        self.unmatched_acks = 0
+
+    def send(self, esp_name, topic, command, payload):
+        """Publish and track a command (call on the event loop); returns the PendingCommand"""
+        pending = PendingCommand(esp_name, topic, str(command), payload,
+                                 asyncio.get_running_loop().create_future())
+        self.sent += 1
+        self._attempt(pending)
+        return pending
+
+    def _attempt(self, pending):
+        pending.attempts += 1
+        pending.waits = 0
+        pending.state = SENT
+        pending.sent_ns = time.monotonic_ns()
+        try:
+            mid, future = self.publish(pending.topic, pending.payload)
+        except Exception as e:
+            print(f"Error sending command to {pending.esp_name}: {e}")
+        else:
+            pending.mid = mid
+            self.by_mid[mid] = pending
+            future.add_done_callback(lambda f: self._on_puback(pending, mid, f))
+        # A publish that fails right away (e.g. disconnected) is retried on timeout too
+        pending.timer = self.wheel.schedule(PUBACK_TIMEOUT, self._on_timeout, pending, pending.attempts)
+
+    def _on_puback(self, pending, mid, future):
+        if self.by_mid.get(mid) is pending:
+            del self.by_mid[mid]
+        if pending.state != SENT or pending.mid != mid or future.cancelled() or future.exception():
+            return
+        pending.timer.cancel()
+        self.delivered += 1
+        if self.metrics:
+            self.metrics.record("command_puback", pending.esp_name, pending.sent_ns)
+        if not pending.delivered.done():
+            pending.delivered.set_result(mid)
+        if self.expects_device_ack(pending):
+            pending.state = DELIVERED
+            self.awaiting_device.setdefault(pending.esp_name, deque()).append(pending)
+            timeout = DEVICE_ACK_TIMEOUT + int(pending.command) * BLINK_SECONDS
+            pending.timer = self.wheel.schedule(timeout, self._on_timeout, pending, pending.attempts)
+        else:
+            self._finish(pending, COMPLETED)
+
+    def _on_timeout(self, pending, attempt):
+        if pending.attempts != attempt or pending.state in (COMPLETED, FAILED):
+            return
+        if self.can_send and not self.can_send():
+            # paho re-sends the publish after the reconnect, and the broker keeps the device's ack
+            pending.timer = self.wheel.schedule(PUBACK_TIMEOUT, self._on_timeout, pending, attempt)
+            return
+        if self.by_mid.get(pending.mid) is pending:
+            if pending.waits < self.max_retries:
+                # Still in flight: paho re-sends it, publishing it again could blink the device twice
+                pending.waits += 1
+                pending.timer = self.wheel.schedule(PUBACK_TIMEOUT, self._on_timeout, pending, attempt)
+                return
+            del self.by_mid[pending.mid]
+            self._finish(pending, FAILED)
+            return
+        if pending.state == DELIVERED:
+            self.awaiting_device[pending.esp_name].remove(pending)
+        if pending.attempts <= self.max_retries:
+            self.retries += 1
+            if self.on_retry:
+                self.on_retry(pending)
+            self._attempt(pending)
+        else:
+            self._finish(pending, FAILED)
+
+    def expects_device_ack(self, pending):
+        """Whether a delivered command waits for the device's ack"""
+        return DEVICE_ACK_ENABLED and pending.command.isdigit() and pending.esp_name in self.ack_devices
+
+    def device_ack(self, esp_name, message):
+        """Complete the oldest delivered command of a device matching its ack; False if none does"""
+        self.ack_devices.add(esp_name)
+        queue = self.awaiting_device.get(esp_name)
+        message = message.strip()
+        if queue:
+            for pending in queue:
+                if pending.command == message:
+                    queue.remove(pending)
+                    pending.timer.cancel()
+                    if self.metrics:
+                        self.metrics.record("command_rtt", esp_name, pending.first_sent_ns)
+                    self._finish(pending, COMPLETED)
+                    return True
+        self.unmatched_acks += 1
+        return False
+
+    def _finish(self, pending, state):
+        pending.state = state
+        pending.completed_ns = time.monotonic_ns()
+        if state == COMPLETED:
+            self.completed += 1
+        else:
+            self.failed += 1
+        if not pending.delivered.done():
+            pending.delivered.set_result(None)
+        if self.on_result:
+            self.on_result(pending)
+
+    def outstanding(self):
+        """Commands neither completed nor failed"""
+        return self.sent - self.completed - self.failed
+
+    def counters(self):
+        return {"sent": self.sent, "delivered": self.delivered, "completed": self.completed,
+                "retries": self.retries, "failed": self.failed, "unmatched_acks": self.unmatched_acks}
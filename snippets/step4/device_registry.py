@@ -0,0 +1,91 @@
+"""
+Step 4: Device registry
+Keeps track of the ESP32 devices seen on the broker. The PC subscribes once to
+mosquito/+/data and every device is registered the first time it publishes
+(or when its Last Will status is seen), so routing a message is a single
+dictionary lookup however many devices exist.
+"""
+
+import threading
+
+# MQTT Topics
+TOPIC_PREFIX = "mosquito"
+DATA_SUFFIX = "data"
+COMMAND_SUFFIX = "command"
+ACK_SUFFIX = "ack"          # Devices report finished blink commands here
+STATUS_SUFFIX = "status"    # Retained "online", or "offline" from the device's MQTT Last Will
+
+
+def device_name_from_id(device_id):
+    """Topic id to display name, e.g. esp32_1 -> ESP32_1"""
+    return device_id.upper()
+
+
+def device_id_from_name(esp_name):
+    """Display name to topic id, e.g. ESP32_1 -> esp32_1"""
+    return esp_name.lower()
+
+
+class DeviceRegistry:
+    """Topic-to-device lookup table filled as devices are discovered"""
+
+    def __init__(self, prefix=TOPIC_PREFIX):
+        self.prefix = prefix
+        self.data_wildcard = f"{prefix}/+/{DATA_SUFFIX}"
+        self.ack_wildcard = f"{prefix}/+/{ACK_SUFFIX}"
+        self.status_wildcard = f"{prefix}/+/{STATUS_SUFFIX}"
+        self._devices_by_topic = {}     # data topic -> ESP32 name
+        self._command_topics = {}       # ESP32 name -> command topic
+        self._lock = threading.Lock()
+
+    def lookup(self, topic):
+        """Return (esp_name, is_new) for a data topic, or (None, False) if it is not one"""
+        esp_name = self._devices_by_topic.get(topic)
+        if esp_name is not None:
+            return esp_name, False
+        return self._discover(topic)
+
+    def _discover(self, topic):
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[0] != self.prefix or parts[2] != DATA_SUFFIX or not parts[1]:
+            return None, False
+        return self.register(device_name_from_id(parts[1]))
+
+    def ack_device(self, topic):
+        """Name of the known device an ack topic belongs to, or None"""
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[0] != self.prefix or parts[2] != ACK_SUFFIX:
+            return None
+        esp_name = device_name_from_id(parts[1])
+        return esp_name if esp_name in self._command_topics else None
+
+    def status_device(self, topic):
+        """Name of the device a status topic belongs to (registering it), or None"""
+        parts = topic.split("/")
+        if len(parts) != 3 or parts[0] != self.prefix or parts[2] != STATUS_SUFFIX or not parts[1]:
+            return None
+        return self.register(device_name_from_id(parts[1]))[0]
+
+    def register(self, esp_name):
+        """Add a device by name; returns (esp_name, is_new)"""
+        with self._lock:
+            if esp_name in self._command_topics:
+                return esp_name, False
+            device_id = device_id_from_name(esp_name)
+            self._devices_by_topic[f"{self.prefix}/{device_id}/{DATA_SUFFIX}"] = esp_name
+            self._command_topics[esp_name] = f"{self.prefix}/{device_id}/{COMMAND_SUFFIX}"
+            return esp_name, True
+
+    def command_topic(self, esp_name):
+        """Command topic of a known device, or None"""
+        return self._command_topics.get(esp_name)
+
+    def names(self):
+        """Names of every known device, in discovery order"""
+        return list(self._command_topics)
+
+    def __contains__(self, esp_name):
+        return esp_name in self._command_topics
+
+    def __len__(self):
+        return len(self._command_topics)
@@ -0,0 +1,294 @@
+"""
+Step 4: Device table (Qt model/view)
+One row per ESP32 in a QTableView instead of one group box of widgets per
+device. The view only paints the rows that are visible, and a refresh emits
+dataChanged for the changed cells of the devices that changed, so the cost of
+the UI does not grow with the size of the fleet.
+
+    DeviceTableModel    rows of device state, fed with coalesced DeviceUpdates
+    DeviceFilterProxy   sorting and filtering by device state and name
+    DeviceDelegate      coloured state cell, spin box to send a blink command
+
+The State column shows a command in progress or failed, otherwise the
+device's liveness (online, stale or offline) as reported by the MQTT side.
+
+A device's blink command is typed in its Command cell (double-click or start
+typing) and sent with Enter, as with the entry box of the original
+per-device widgets. Leaving the editor any other way (Escape, clicking
+another row, scrolling) sends nothing, so browsing the table cannot blink a
+device by accident.
+"""
+
+import time
+from PyQt6.QtCore import QAbstractTableModel, QEvent, QModelIndex, QSortFilterProxyModel, Qt
+from PyQt6.QtGui import QColor, QPalette
+from PyQt6.QtWidgets import QSpinBox, QStyledItemDelegate
+from event_rates import format_rates
+import liveness
+
+# Table Configuration
+MAX_BLINKS = 20
+
+# Columns
+DEVICE, STATE, LAST_DATA, RATES, LAST_UPDATE, MESSAGES, LOG_ENTRIES, COMMAND = range(8)
+COLUMN_TITLES = ["Device", "State", "Last Data", "Event Rates", "Last Update", "Messages", "Log Entries",
+                 "Command"]
+
+# Device states, in the order used when sorting by state
+FAILED = "Command failed"
+PENDING = "Command pending"
+OFFLINE = "Offline"
+STALE = "Stale"
+ONLINE = "Online"
+STATES = [FAILED, PENDING, OFFLINE, STALE, ONLINE]
+STATE_COLORS = {FAILED: "#d9534f", PENDING: "#3a7bd5", OFFLINE: "#808080", STALE: "#e0a030", ONLINE: "#4caf50"}
+LIVENESS_STATES = {liveness.ONLINE: ONLINE, liveness.STALE: STALE, liveness.OFFLINE: OFFLINE}
+
+
+class DeviceRow:
+    """Displayed state of one device"""
+
+    __slots__ = ("esp_name", "last_data", "rates", "received_at", "message_count", "log_entries",
+                 "command_status", "command_state", "liveness", "state")
+
+    def __init__(self, esp_name):
+        self.esp_name = esp_name
+        self.last_data = ""
+        self.rates = ()                 # Events per minute, EVENT_NAMES order
+        self.received_at = 0.0
+        self.message_count = 0
+        self.log_entries = 0
+        self.command_status = ""
+        self.command_state = None   # None, PENDING or FAILED
+        self.liveness = ONLINE      # ONLINE, STALE or OFFLINE
+        self.state = ONLINE
+
+    def compute_state(self):
+        return self.command_state if self.command_state is not None else self.liveness
+
+
+class DeviceTableModel(QAbstractTableModel):
+    """Table of devices, updated in place with dataChanged on the changed cells"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self._row_of = {}               # esp_name -> row number
+
+        # Hooks set by the window
+        self.command_handler = None     # command_handler(esp_name, command) -> (status text, state)
+        self.recent_messages = None     # recent_messages(esp_name) -> tooltip text
+
+    # ─── Qt model interface ────────────────────────────
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_TITLES)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return COLUMN_TITLES[section]
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.column() == COMMAND:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._display(row, column)
+        if role == Qt.ItemDataRole.UserRole:
+            return self._sort_value(row, column)
+        if role == Qt.ItemDataRole.EditRole and column == COMMAND:
+            return 1
+        if role == Qt.ItemDataRole.ToolTipRole and column == LAST_DATA and self.recent_messages:
+            # Built only when the tooltip is about to show
+            return self.recent_messages(row.esp_name)
+        if role == Qt.ItemDataRole.TextAlignmentRole and column in (MESSAGES, LOG_ENTRIES):
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or index.column() != COMMAND or self.command_handler is None:
+            return False
+        row = self.rows[index.row()]
+        self.set_command_status(row.esp_name, *self.command_handler(row.esp_name, int(value)))
+        return True
+
+    @staticmethod
+    def _display(row, column):
+        if column == DEVICE:
+            return row.esp_name
+        if column == STATE:
+            return row.state
+        if column == LAST_DATA:
+            return row.last_data or "No data received"
+        if column == RATES:
+            return format_rates(row.rates) if row.rates else ""
+        if column == LAST_UPDATE:
+            return time.strftime("%H:%M:%S", time.localtime(row.received_at)) if row.received_at else ""
+        if column == MESSAGES:
+            return str(row.message_count)
+        if column == LOG_ENTRIES:
+            return str(row.log_entries)
+        return row.command_status
+
+    @staticmethod
+    def _sort_value(row, column):
+        if column == STATE:
+            return STATES.index(row.state)
+        if column == RATES:
+            return sum(row.rates)
+        if column == LAST_UPDATE:
+            return row.received_at
+        if column == MESSAGES:
+            return row.message_count
+        if column == LOG_ENTRIES:
+            return row.log_entries
+        return DeviceTableModel._display(row, column)
+
+    # ─── Updates ───────────────────────────────────────
+    def row_for(self, esp_name):
+        """Row of a device, inserting it the first time it is seen"""
+        number = self._row_of.get(esp_name)
+        if number is None:
+            number = len(self.rows)
+            self.beginInsertRows(QModelIndex(), number, number)
+            self.rows.append(DeviceRow(esp_name))
+            self._row_of[esp_name] = number
+            self.endInsertRows()
+        return number
+
+    def apply_update(self, update, log_entries):
+        """Show the latest coalesced data of a device"""
+        number = self.row_for(update.esp_name)
+        row = self.rows[number]
+        changed = []
+        if row.last_data != update.last_data:
+            row.last_data = update.last_data
+            changed.append(LAST_DATA)
+        if row.received_at != update.received_at:
+            row.received_at = update.received_at
+            changed.append(LAST_UPDATE)
+        if row.message_count != update.message_count:
+            row.message_count = update.message_count
+            changed.append(MESSAGES)
+        if row.log_entries != log_entries:
+            row.log_entries = log_entries
+            changed.append(LOG_ENTRIES)
+        state = row.compute_state()
+        if row.state != state:
+            row.state = state
+            changed.append(STATE)
+        if changed:
+            self._cells_changed(number, min(changed), max(changed))
+
+    def set_rates(self, esp_name, rates):
+        """Show a device's event rates (events per minute), emitting only if they changed"""
+        number = self._row_of.get(esp_name)
+        if number is None:
+            return
+        row = self.rows[number]
+        rates = tuple(round(rate) for rate in rates)
+        if row.rates != rates:
+            row.rates = rates
+            self._cells_changed(number, RATES, RATES)
+
+    def set_command_status(self, esp_name, text, state=None):
+        """Show a command's progress; state is PENDING, FAILED or None once settled"""
+        number = self.row_for(esp_name)
+        row = self.rows[number]
+        row.command_status = text
+        row.command_state = state
+        row.state = row.compute_state()
+        self._cells_changed(number, STATE, COMMAND)
+
+    def set_liveness(self, esp_name, state):
+        """Show a liveness transition (liveness.ONLINE, STALE or OFFLINE) of a device"""
+        number = self.row_for(esp_name)
+        row = self.rows[number]
+        row.liveness = LIVENESS_STATES[state]
+        state = row.compute_state()
+        if row.state != state:
+            row.state = state
+            self._cells_changed(number, STATE, STATE)
+
+    def _cells_changed(self, number, first_column, last_column):
+        self.dataChanged.emit(self.index(number, first_column), self.index(number, last_column),
+                              [Qt.ItemDataRole.DisplayRole])
+
+    def state_counts(self):
+        """Number of devices per state"""
+        counts = dict.fromkeys(STATES, 0)
+        for row in self.rows:
+            counts[row.state] += 1
+        return counts
+
+
+class DeviceFilterProxy(QSortFilterProxyModel):
+    """Sorts on raw values (UserRole) and keeps the devices matching a state and a name filter"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.state_filter = None        # One of STATES, or None for every device
+        self.setSortRole(Qt.ItemDataRole.UserRole)
+        self.setFilterKeyColumn(DEVICE)
+        self.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.setDynamicSortFilter(True)
+
+    def set_state_filter(self, state):
+        self.state_filter = state
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.state_filter is not None and self.sourceModel().rows[source_row].state != self.state_filter:
+            return False
+        return super().filterAcceptsRow(source_row, source_parent)
+
+
+class DeviceDelegate(QStyledItemDelegate):
+    """Coloured State cell and a 1-20 spin box as the Command editor (sent with Enter only)"""
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        if index.column() == STATE:
+            color = STATE_COLORS.get(index.data())
+            if color:
+                option.backgroundBrush = QColor(color)
+                option.palette.setColor(QPalette.ColorRole.Text, QColor("white"))
+
+    def createEditor(self, parent, option, index):
+        if index.column() != COMMAND:
+            return super().createEditor(parent, option, index)
+        editor = QSpinBox(parent)
+        editor.setRange(1, MAX_BLINKS)
+        editor.setSuffix(" blinks")
+        return editor
+
+    def setEditorData(self, editor, index):
+        if isinstance(editor, QSpinBox):
+            editor.setValue(1)
+        else:
+            super().setEditorData(editor, index)
+
+    def eventFilter(self, editor, event):
+        # Qt commits the editor on focus loss too; only Enter confirms a command
+        if (isinstance(editor, QSpinBox) and event.type() == QEvent.Type.KeyPress
+                and event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter)):
+            editor.setProperty("confirmed", True)
+        return super().eventFilter(editor, event)
+
+    def setModelData(self, editor, model, index):
+        if isinstance(editor, QSpinBox):
+            if editor.property("confirmed"):
+                editor.interpretText()
+                model.setData(index, editor.value(), Qt.ItemDataRole.EditRole)
+        else:
+            super().setModelData(editor, model, index)
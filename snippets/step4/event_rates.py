@@ -0,0 +1,142 @@
+"""
+Step 4: Event rate aggregation
+Counts the L1/L2/FP events of each device over time windows, so rates are
+read from a few integers instead of rescanning the message history:
+
+    sliding     events of each type during the last RATE_WINDOW_SECONDS, kept
+                in a ring of RATE_SLOT_SECONDS slots plus running totals
+    tumbling    events of each type during the last complete period of
+                RATE_PERIOD_SECONDS; each completed period is reported through
+                on_period (the MQTT core writes it to the device's log)
+
+Each device has fixed-size arrays (slots x event types), so memory does not
+grow with the session. Counting is O(1), closing expired slots is amortised
+O(1), and every query is O(1). Queries are plain reads: the owner calls
+roll() once per slot to expire old slots, even for silent devices.
+"""
+
+import threading
+import time
+from array import array
+
+# Rate Configuration
+EVENT_TYPES = ("L1", "L2", "FP")    # Counted separately; any other payload is counted as "other"
+RATE_SLOT_SECONDS = 1               # Resolution of the sliding window
+RATE_WINDOW_SECONDS = 60            # Length of the sliding window
+RATE_PERIOD_SECONDS = 60            # Length of a tumbling period (multiple of RATE_SLOT_SECONDS)
+
+EVENT_NAMES = EVENT_TYPES + ("other",)
+EVENT_INDEX = {event: index for index, event in enumerate(EVENT_TYPES)}
+OTHER = len(EVENT_TYPES)
+
+
+class DeviceRates:
+    """Sliding-window and tumbling-period counts of one device"""
+
+    __slots__ = ("slots", "window", "period", "last_period", "slot", "period_number", "had_events")
+
+    def __init__(self, window_slots, slot, period_number):
+        types = len(EVENT_NAMES)
+        self.slots = array('I', bytes(4 * window_slots * types))    # ring of per-slot counts
+        self.window = array('I', bytes(4 * types))                  # running totals of the ring
+        self.period = array('I', bytes(4 * types))                  # counts of the current period
+        self.last_period = array('I', bytes(4 * types))             # counts of the last complete period
+        self.slot = slot                                            # absolute number of the newest slot
+        self.period_number = period_number
+        self.had_events = False                                     # last complete period had events
+
+
+class EventRates:
+    """Per-device event counts over a sliding window and tumbling periods"""
+
+    def __init__(self, slot_seconds=RATE_SLOT_SECONDS, window_seconds=RATE_WINDOW_SECONDS,
+                 period_seconds=RATE_PERIOD_SECONDS):
+        self.slot_ns = int(slot_seconds * 1e9)
+        self.window_slots = max(1, round(window_seconds / slot_seconds))
+        self.period_slots = max(1, round(period_seconds / slot_seconds))
+        self.window_seconds = self.window_slots * slot_seconds
+        self.period_seconds = self.period_slots * slot_seconds
+        self.totals = array('Q', bytes(8 * len(EVENT_NAMES)))     # events since start, every device
+        self.on_period = None       # on_period(esp_name, counts) for each completed period with events
+        self._devices = {}          # esp_name -> DeviceRates
+        self._lock = threading.Lock()
+
+    def add(self, esp_name, event, now_ns=None):
+        """Count one event (a payload such as "L1") of a device; now_ns is monotonic"""
+        slot = (now_ns if now_ns else time.monotonic_ns()) // self.slot_ns
+        device = self._devices.get(esp_name)
+        if device is None:
+            with self._lock:
+                device = self._devices.setdefault(
+                    esp_name, DeviceRates(self.window_slots, slot, slot // self.period_slots))
+        if slot > device.slot:
+            self._advance(esp_name, device, slot)
+        # A late event (receive time before the newest slot) is counted in the newest slot
+        index = EVENT_INDEX.get(event, OTHER)
+        types = len(EVENT_NAMES)
+        device.slots[(device.slot % self.window_slots) * types + index] += 1
+        device.window[index] += 1
+        device.period[index] += 1
+        self.totals[index] += 1
+
+    def roll(self, now_ns=None):
+        """Expire old slots and close finished periods of every device (call once per slot)"""
+        slot = (now_ns if now_ns else time.monotonic_ns()) // self.slot_ns
+        for esp_name, device in list(self._devices.items()):
+            if slot > device.slot:
+                self._advance(esp_name, device, slot)
+
+    def _advance(self, esp_name, device, slot):
+        types = len(EVENT_NAMES)
+        # Clear the slots that left the window (at most one revolution of the ring)
+        for expired in range(device.slot + 1, min(slot, device.slot + self.window_slots) + 1):
+            base = (expired % self.window_slots) * types
+            for index in range(types):
+                device.window[index] -= device.slots[base + index]
+                device.slots[base + index] = 0
+        device.slot = slot
+        period_number = slot // self.period_slots
+        if period_number != device.period_number:
+            self._close_period(esp_name, device, device.period)
+            if period_number > device.period_number + 1:
+                # The periods in between had no events
+                self._close_period(esp_name, device, array('I', bytes(4 * types)))
+            device.period = array('I', bytes(4 * types))
+            device.period_number = period_number
+
+    def _close_period(self, esp_name, device, counts):
+        device.last_period[:] = counts
+        has_events = any(counts)
+        # Empty periods are reported once, after the last period with events
+        if self.on_period and (has_events or device.had_events):
+            self.on_period(esp_name, tuple(counts))
+        device.had_events = has_events
+
+    # ─── Queries (O(1), from any thread) ───────────────
+    def window_counts(self, esp_name):
+        """Events of each type (EVENT_NAMES order) during the sliding window"""
+        device = self._devices.get(esp_name)
+        return tuple(device.window) if device else (0,) * len(EVENT_NAMES)
+
+    def period_counts(self, esp_name):
+        """Events of each type during the last complete tumbling period"""
+        device = self._devices.get(esp_name)
+        return tuple(device.last_period) if device else (0,) * len(EVENT_NAMES)
+
+    def per_minute(self, esp_name):
+        """Events per minute of each type, averaged over the sliding window"""
+        scale = 60 / self.window_seconds
+        return tuple(count * scale for count in self.window_counts(esp_name))
+
+    def devices(self):
+        return list(self._devices)
+
+    def counters(self):
+        """Events since start per type, every device together"""
+        return dict(zip(EVENT_NAMES, self.totals))
+
+
+def format_rates(rates):
+    """'L1 12 · L2 3 · FP 0 /min' from per-minute rates in EVENT_NAMES order (other only if seen)"""
+    parts = [f"{name} {rate:.0f}" for name, rate in zip(EVENT_NAMES, rates) if name != "other" or rate]
+    return " · ".join(parts) + " /min"
@@ -0,0 +1,304 @@
+"""
+Step 4: Multi-process ingest
+Spreads message handling (paho parsing, decoding, dedup, logging) over a pool
+of worker processes, so ingest is not limited to the one core the GIL allows.
+Each worker has its own MQTT connection and MQTTCore, and sends compact
+aggregates to the coordinator every SHARD_FLUSH_INTERVAL: the latest value,
+message count and log status of each device that changed, plus the event
+rates of its devices every SHARD_STATS_INTERVAL.
+
+    shared  (default) workers share $share/<SHARED_GROUP>/mosquito/+/data and
+            the broker spreads the messages (needs MQTT 5 / Mosquitto 1.6+);
+            each worker receives a fraction of the traffic, but a device's
+            messages may be split over several workers and log files, and
+            a QoS 1 redelivery is only dropped as a duplicate when it lands
+            on the worker that received the first copy
+    hash    every worker subscribes to mosquito/+/data and keeps the devices
+            whose id hashes to it; a device always lands on the same worker,
+            so ordering, dedup and its log file stay in one place. Every
+            worker still receives and parses 100% of the traffic (the broker
+            sends it N times), so this mode does not scale with cores: use it
+            only when logging and dedup, not parsing, are the bottleneck, or
+            with a broker without shared subscriptions
+
+The coordinator (the GUI's MQTTWorker or the gateway) keeps one MQTT
+connection for commands and acknowledgements and feeds the aggregates into its
+own coalescer and metrics, so the front ends do not change. Aggregates of a
+device reported by several workers are merged: message counts, event rates
+and log entries are summed over the workers, and the latest value is the most
+recently received one. Device liveness
+is tracked by the coordinator from the aggregates (and the devices' Last Will),
+since in shared mode no worker sees all the traffic of a device. Received data are
+logged by the worker that handled them, in files ending in _w<worker>.
+
+A worker that dies (exception, out of memory, killed) is reported and started
+again, up to SHARD_MAX_RESTARTS times; while it is down, the devices it
+handled go stale, then offline, through the coordinator's liveness monitor.
+"""
+
+import asyncio
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from device_registry import DATA_SUFFIX, TOPIC_PREFIX, device_id_from_name
+from event_rates import EVENT_NAMES
+from log_writer import LogWriter
+from mqtt_core import MQTTCore
+from update_coalescer import DeviceUpdate
+
+# Sharding Configuration
+SHARD_MODE = "shared"           # "shared" or "hash" (every worker receives every message)
+SHARED_GROUP = "mosquito_ingest"
+SHARD_FLUSH_INTERVAL = 0.05     # Seconds between two aggregate batches from a worker
+SHARD_STATS_INTERVAL = 1.0      # Seconds between two counter snapshots from a worker
+SHARD_EXPORT_TIMEOUT = 120      # Seconds to wait for the workers' Excel exports
+SHARD_STOP_TIMEOUT = 30         # Seconds to wait for a worker to drain its logs and exit
+SHARD_CHECK_INTERVAL = 1.0      # Seconds between two checks that every worker is still running
+SHARD_MAX_RESTARTS = 5          # Restarts of a worker that died before it is given up
+
+
+def shard_of(esp_name, shards):
+    """Worker index of a device (stable across processes, unlike hash())"""
+    return zlib.crc32(device_id_from_name(esp_name).encode()) % shards
+
+
+def run_shard(index, shards, mode, broker, port, out_queue, control_queue):
+    """Worker process entry point"""
+    # Ctrl+C reaches the whole process group; the coordinator stops the workers in order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_shard(index, shards, mode, broker, port, out_queue, control_queue))
+
+
+async def _run_shard(index, shards, mode, broker, port, out_queue, control_queue):
+    log_writer = LogWriter()
+    log_writer.start()
+    if mode == "shared":
+        core = MQTTCore(log_writer, broker, port, log_suffix=f"_w{index}", device_acks=False,
+                        offline_queue=False, liveness=False, data_subscription=f"$share/{SHARED_GROUP}/{TOPIC_PREFIX}/+/{DATA_SUFFIX}")
+    else:
+        core = MQTTCore(log_writer, broker, port, log_suffix=f"_w{index}", device_acks=False,
+                        offline_queue=False, liveness=False, device_filter=lambda esp_name: shard_of(esp_name, shards) == index)
+    core.status_callback = lambda connected: out_queue.put(("status", index, connected))
+
+    forwarder = asyncio.create_task(_forward(index, core, out_queue, control_queue))
+    await core.run_async()
+    # The forwarder has returned on a stop request
+    export = forwarder.result() if forwarder.done() else False
+    forwarder.cancel()
+    loggers = core.close_logs()
+    log_writer.stop()
+    files = []
+    if export:
+        files = [logger.export_to_excel() for logger in loggers if logger.entry_count]
+    out_queue.put(("stopped", index, [f for f in files if f]))
+
+
+async def _forward(index, core, out_queue, control_queue):
+    """Send aggregates and counters until asked to stop; returns whether to export on exit"""
+    next_stats = time.monotonic()
+    while True:
+        await asyncio.sleep(SHARD_FLUSH_INTERVAL)
+        updates = core.coalescer.take_dirty()
+        if updates:
+            out_queue.put(("updates", index, [_aggregate(core, update) for update in updates]))
+        if time.monotonic() >= next_stats:
+            next_stats += SHARD_STATS_INTERVAL
+            out_queue.put(("counters", index, core.metrics.counters()))
+            out_queue.put(("rates", index, {esp_name: core.rates.per_minute(esp_name)
+                                            for esp_name in core.rates.devices()}))
+        try:
+            request = control_queue.get_nowait()
+        except queue.Empty:
+            continue
+        if request[0] == "export":
+            files = await asyncio.to_thread(
+                lambda: [logger.export_to_excel() for logger in list(core.loggers.values())])
+            out_queue.put(("exported", index, [f for f in files if f]))
+        elif request[0] == "stop":
+            core.stop()
+            return request[1]
+
+
+def _aggregate(core, update):
+    logger = core.get_logger(update.esp_name)
+    return (update.esp_name, update.last_data, update.received_at, update.message_count,
+            update.received_ns, os.path.basename(logger.log_file), logger.entry_count)
+
+
+class ShardCoordinator:
+    """Starts the worker processes and merges their aggregates into a coordinator MQTTCore"""
+
+    def __init__(self, core, shards, mode=SHARD_MODE):
+        if mode not in ("hash", "shared"):
+            raise ValueError(f"Unknown shard mode: {mode}")
+        self.core = core
+        self.shards = shards
+        self.mode = mode
+        # spawn: the same on every OS, and safe next to Qt and running threads
+        import multiprocessing
+        self._context = multiprocessing.get_context("spawn")
+        self.out_queue = self._context.Queue()
+        self.control_queues = []
+        self.processes = []
+        self.restarts = [0] * shards    # Worker index -> times it was started again after dying
+        self._stopped = set()           # Workers that have exited (or were given up)
+        self._stopping = False
+        self._message_counts = {}       # (worker, esp_name) -> message count already reported
+        self._device_counts = {}        # esp_name -> messages over every worker (including dead ones)
+        self._latest = {}               # esp_name -> (data, received_at, received_ns) of the newest message
+        self._log_status = {}           # (worker, esp_name) -> (log file name, log entry count)
+        self._counters = {}             # worker -> {counter: value}
+        self._retired_counters = {}     # Counters of workers that died, kept in the totals
+        self._rates = {}                # (worker, esp_name) -> events per minute, as last reported
+        self._replies = {}              # worker -> files, for the export in progress
+        self._replies_cond = threading.Condition()
+        self._reader = None
+
+        core.metrics.register_counters("workers", self.counters)
+
+    def start(self):
+        for index in range(self.shards):
+            control_queue, process = self._spawn(index)
+            self.control_queues.append(control_queue)
+            self.processes.append(process)
+        self._reader = threading.Thread(target=self._read, name="ShardReader", daemon=True)
+        self._reader.start()
+        print(f"Ingest split over {self.shards} worker processes ({self.mode} mode)")
+
+    def _spawn(self, index):
+        control_queue = self._context.Queue()
+        process = self._context.Process(
+            target=run_shard, name=f"IngestWorker-{index}",
+            args=(index, self.shards, self.mode, self.core.broker, self.core.port,
+                  self.out_queue, control_queue))
+        process.start()
+        return control_queue, process
+
+    def _read(self):
+        """Apply worker messages until every worker has stopped"""
+        next_check = time.monotonic() + SHARD_CHECK_INTERVAL
+        while len(self._stopped) < self.shards:
+            if time.monotonic() >= next_check:
+                next_check += SHARD_CHECK_INTERVAL
+                self._check_workers()
+            try:
+                kind, index, payload = self.out_queue.get(timeout=SHARD_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if kind == "updates":
+                self._apply_updates(index, payload)
+            elif kind == "counters":
+                self._counters[index] = payload
+            elif kind == "rates":
+                self._apply_rates(index, payload)
+            elif kind == "status":
+                print(f"Ingest worker {index}: MQTT {'connected' if payload else 'disconnected'}")
+            elif kind in ("exported", "stopped"):
+                with self._replies_cond:
+                    self._replies[index] = payload
+                    self._replies_cond.notify_all()
+                if kind == "stopped":
+                    self._stopped.add(index)
+
+    def _check_workers(self):
+        """Report the workers that exited without being asked to, and start them again"""
+        for index, process in enumerate(self.processes):
+            # Exit code 0: it stopped on request, its "stopped" message is on the way
+            if index in self._stopped or process.is_alive() or process.exitcode == 0:
+                continue
+            print(f"Ingest worker {index} died (exit code {process.exitcode})")
+            # An export or stop in progress does not wait for its reply
+            with self._replies_cond:
+                self._replies.setdefault(index, [])
+                self._replies_cond.notify_all()
+            if self._stopping or self.restarts[index] >= SHARD_MAX_RESTARTS:
+                if not self._stopping:
+                    print(f"Ingest worker {index} restarted {SHARD_MAX_RESTARTS} times, giving up")
+                self._stopped.add(index)
+                continue
+            self.restarts[index] += 1
+            # The new worker counts from zero; keep the totals of the one that died
+            for key in [key for key in self._message_counts if key[0] == index]:
+                del self._message_counts[key]
+            for name, value in self._counters.pop(index, {}).items():
+                self._retired_counters[name] = self._retired_counters.get(name, 0) + value
+            self._apply_rates(index, {})
+            self.control_queues[index], self.processes[index] = self._spawn(index)
+
+    def _apply_updates(self, index, aggregates):
+        core = self.core
+        for esp_name, data, received_at, count, received_ns, log_file, log_entries in aggregates:
+            core.registry.register(esp_name)
+            new_messages = count - self._message_counts.get((index, esp_name), 0)
+            self._message_counts[(index, esp_name)] = count
+            self._device_counts[esp_name] = self._device_counts.get(esp_name, 0) + new_messages
+            self._log_status[(index, esp_name)] = (log_file, log_entries)
+            # In shared mode another worker may have reported a newer message already
+            latest = self._latest.get(esp_name)
+            if latest is None or received_ns >= latest[2]:
+                latest = self._latest[esp_name] = (data, received_at, received_ns)
+            data, received_at, latest_ns = latest
+            core.coalescer.store(DeviceUpdate(esp_name, data, received_at, self._device_counts[esp_name],
+                                              latest_ns))
+            core.metrics.mark_received(esp_name, new_messages)
+            # Reception in the worker -> aggregate applied here
+            core.metrics.record("dispatch", esp_name, received_ns)
+        core.devices_seen([aggregate[0] for aggregate in aggregates])
+
+    def _apply_rates(self, index, rates):
+        """Replace the event rates reported by one worker"""
+        merged = {key: value for key, value in self._rates.items() if key[0] != index}
+        merged.update(((index, esp_name), value) for esp_name, value in rates.items())
+        self._rates = merged    # Swapped whole: the front end reads it from another thread
+
+    def log_status(self, esp_name):
+        """(log file names, log entry count) of a device, summed over the workers that logged it"""
+        status = sorted(value for key, value in list(self._log_status.items()) if key[1] == esp_name)
+        if not status:
+            return ("(in ingest worker)", 0)
+        return (", ".join(log_file for log_file, _ in status), sum(entries for _, entries in status))
+
+    def event_rates(self, esp_name):
+        """Events per minute of a device (EVENT_NAMES order), summed over the workers"""
+        totals = [0.0] * len(EVENT_NAMES)
+        for key, rates in self._rates.items():
+            if key[1] == esp_name:
+                totals = [total + rate for total, rate in zip(totals, rates)]
+        return tuple(totals)
+
+    def counters(self):
+        """Worker counters summed over every worker"""
+        totals = dict(self._retired_counters)
+        for counters in list(self._counters.values()):
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+        totals["restarts"] = sum(self.restarts)
+        return totals
+
+    def _collect(self, request, timeout):
+        with self._replies_cond:
+            self._replies.clear()
+        for index, control_queue in enumerate(self.control_queues):
+            if self.processes[index].is_alive():
+                control_queue.put(request)
+        expected = sum(1 for p in self.processes if p.is_alive())
+        with self._replies_cond:
+            self._replies_cond.wait_for(lambda: len(self._replies) >= expected, timeout)
+            return [f for files in self._replies.values() for f in files]
+
+    def export_logs(self):
+        """Have every worker convert its logs to .xlsx; returns the Excel file paths"""
+        return self._collect(("export",), SHARD_EXPORT_TIMEOUT)
+
+    def stop(self, export=False):
+        """Stop the workers after they drained (and optionally exported) their logs"""
+        self._stopping = True
+        files = self._collect(("stop", export), SHARD_STOP_TIMEOUT)
+        for process in self.processes:
+            process.join(SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        return files
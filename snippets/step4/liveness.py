@@ -0,0 +1,136 @@
+"""
+Step 4: Device liveness
+Notices when an ESP32 stops publishing. The SRS has every device send data
+every ~1 s ± 0.5 s, so a device is
+
+    online      traffic within HEARTBEAT_INTERVAL + HEARTBEAT_TOLERANCE
+    stale       silent for longer than that (late, possibly reconnecting)
+    offline     silent for LIVENESS_OFFLINE_AFTER, or its MQTT Last Will
+                ("offline" on mosquito/<id>/status) was published by the broker
+
+Deadlines live on the hashed timer wheel (timer_wheel.py), with at most one
+timer per device. A message only stores its receive time; when the timer
+fires it is re-armed for the remaining time if the device was heard from
+since, so a tick costs O(expired timers) whatever the size of the fleet.
+Devices are expected to be silent while they blink (see expect_quiet).
+"""
+
+import threading
+import time
+
+# Liveness Configuration
+HEARTBEAT_INTERVAL = 1.0        # Seconds between two messages of a device (SRS: ~1 s)
+HEARTBEAT_TOLERANCE = 0.5       # Allowed jitter on the interval (SRS: ± 0.5 s)
+HEARTBEAT_MARGIN = 0.25         # Broker and network delay on top of the tolerance
+LIVENESS_OFFLINE_AFTER = 5.0    # Seconds of silence before a stale device is offline
+
+ONLINE = "online"
+STALE = "stale"
+OFFLINE = "offline"
+LIVENESS_STATES = (ONLINE, STALE, OFFLINE)
+
+
+class DeviceLiveness:
+    """Liveness of one device"""
+
+    __slots__ = ("state", "last_seen", "quiet_until", "timer")
+
+    def __init__(self, now):
+        self.state = None
+        self.last_seen = now
+        self.quiet_until = 0.0      # No traffic expected before this time (blinking)
+        self.timer = None           # At most one pending check on the wheel
+
+
+class LivenessMonitor:
+    """Online/stale/offline state of every device, checked on a timer wheel"""
+
+    def __init__(self, wheel, stale_after=HEARTBEAT_INTERVAL + HEARTBEAT_TOLERANCE + HEARTBEAT_MARGIN,
+                 offline_after=LIVENESS_OFFLINE_AFTER):
+        self.wheel = wheel
+        self.stale_after = stale_after
+        self.offline_after = max(offline_after, stale_after)
+        self.transitions = dict.fromkeys(LIVENESS_STATES, 0)
+        self.on_change = None       # on_change(esp_name, old_state, new_state, reason), on the event loop
+        self._devices = {}          # esp_name -> DeviceLiveness
+        self._lock = threading.Lock()
+
+    def seen(self, esp_name, now=None, reason="data received"):
+        """Record traffic from a device (now is monotonic seconds); O(1), the wheel is rarely touched"""
+        now = time.monotonic() if now is None else now
+        device = self._device(esp_name, now)
+        if now > device.last_seen:
+            device.last_seen = now
+        if device.state != ONLINE:
+            self._set(esp_name, device, ONLINE, reason)
+        if device.timer is None:
+            device.timer = self.wheel.schedule(self._deadline(device) - time.monotonic(), self._check, esp_name)
+
+    def expect_quiet(self, esp_name, seconds):
+        """The device sends nothing for a while (e.g. during a blink sequence)"""
+        device = self._devices.get(esp_name)
+        if device is not None:
+            device.quiet_until = max(device.quiet_until, time.monotonic() + seconds)
+
+    def report(self, esp_name, state, reason):
+        """Set a state observed elsewhere (a Last Will, an ingest worker); no deadline is kept"""
+        device = self._device(esp_name, time.monotonic())
+        if device.timer is not None:
+            device.timer.cancel()
+            device.timer = None
+        if device.state != state:
+            self._set(esp_name, device, state, reason)
+
+    def _device(self, esp_name, now):
+        device = self._devices.get(esp_name)
+        if device is None:
+            with self._lock:
+                device = self._devices.setdefault(esp_name, DeviceLiveness(now))
+        return device
+
+    def _deadline(self, device):
+        """Next time the device's state can change"""
+        reference = max(device.last_seen, device.quiet_until)
+        return reference + (self.stale_after if device.state == ONLINE else self.offline_after)
+
+    def _check(self, esp_name):
+        """Timer callback: move the device on if it stayed silent, otherwise re-arm"""
+        device = self._devices[esp_name]
+        device.timer = None
+        now = time.monotonic()
+        silence = now - max(device.last_seen, device.quiet_until)
+        if device.state == ONLINE and silence >= self.stale_after:
+            self._set(esp_name, device, STALE, f"no data for {self.stale_after:g} s")
+        if device.state == STALE and silence >= self.offline_after:
+            self._set(esp_name, device, OFFLINE, f"no data for {self.offline_after:g} s")
+            return
+        device.timer = self.wheel.schedule(self._deadline(device) - now, self._check, esp_name)
+
+    def _set(self, esp_name, device, state, reason):
+        old = device.state
+        device.state = state
+        self.transitions[state] += 1
+        if self.on_change:
+            self.on_change(esp_name, old, state, reason)
+
+    # ─── Queries ───────────────────────────────────────
+    def state(self, esp_name):
+        """ONLINE, STALE, OFFLINE, or None for a device never seen"""
+        device = self._devices.get(esp_name)
+        return device.state if device else None
+
+    def states(self):
+        """esp_name -> state of every device"""
+        return {esp_name: device.state for esp_name, device in list(self._devices.items())}
+
+    def counts(self):
+        """Number of devices in each state"""
+        counts = dict.fromkeys(LIVENESS_STATES, 0)
+        for device in list(self._devices.values()):
+            if device.state:
+                counts[device.state] += 1
+        return counts
+
+    def counters(self):
+        """Transitions into each state since start"""
+        return dict(self.transitions)
@@ -0,0 +1,373 @@
+"""
+Step 4: Log rotation
+Splits each device's log into segments, so the file being appended to stays
+small however long the PC side runs:
+
+    - a segment is closed once it reaches LOG_ROTATE_BYTES or is older than
+      LOG_ROTATE_SECONDS (checked on every flush tick of the log writer, so
+      the segment of a silent device is closed too); the next entry of the
+      device opens a new one
+    - closed text segments (.csv, .jsonl) are compressed by a background
+      thread (gzip, or zstd with the zstandard package); binary segments are
+      kept as they are so that session_log.py can memory-map them
+    - a manifest lists every segment with its device, time range, entry count
+      and size (logs/manifest<suffix>.jsonl, one per process writing logs)
+    - the oldest closed segments are deleted once they are older than
+      LOG_RETENTION_DAYS or use more than LOG_RETENTION_BYTES together
+
+    for segment in load_manifests("logs", "ESP32_1", start_ns, end_ns):
+        rows = read_log(os.path.join("logs", segment["file"]))
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from log_sinks import (CsvLogSink, HEAP_EXTENSION, JsonLinesLogSink, TIMESTAMP_NS_FIELD, create_sink,
+                       export_to_excel)
+
+# Rotation Configuration
+LOG_ROTATE_BYTES = 64 * 1024 * 1024     # Segment size that closes it (0 = no size limit)
+LOG_ROTATE_SECONDS = 3600               # Segment age that closes it (0 = no time limit)
+LOG_COMPRESSION = "gzip"                # "gzip", "zstd" (needs the zstandard package) or "none"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+LOG_RETENTION_DAYS = 30                 # Closed segments older than this are deleted (0 = keep them)
+LOG_RETENTION_BYTES = 10 * 1024 ** 3    # Disk budget of the closed segments (0 = no limit)
+COMPRESS_EXIT_TIMEOUT = 30              # Seconds allowed at exit to compress the last segments
+MANIFEST_NAME = "manifest"
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+COMPRESSIBLE = (CsvLogSink.extension, JsonLinesLogSink.extension)
+COPY_CHUNK = 1024 * 1024
+
+# Segment states in the manifest
+ACTIVE = "active"
+CLOSED = "closed"
+COMPRESSED = "compressed"
+DELETED = "deleted"
+
+
+def compress_file(path, method):
+    """Compress a closed log file next to itself and remove it; returns the new path"""
+    target = path + COMPRESSION_EXTENSIONS[method]
+    temp_path = target + ".tmp"
+    with open(path, "rb") as src, open(temp_path, "wb") as dst:
+        if method == "zstd":
+            import zstandard
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+        else:
+            with gzip.GzipFile(os.path.basename(path), "wb", GZIP_LEVEL, dst) as gz:
+                shutil.copyfileobj(src, gz, COPY_CHUNK)
+        dst.flush()
+        os.fsync(dst.fileno())
+    # The original is only removed once the compressed copy is complete on disk
+    os.replace(temp_path, target)
+    os.remove(path)
+    return target
+
+
+def _read_manifest(path):
+    """Segments of one manifest journal, by id (the last line about a segment wins)"""
+    segments = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                segment = json.loads(line)
+                segments[segment["id"]] = segment
+            except (ValueError, KeyError):
+                continue  # Partial line from an interrupted write
+    return {key: segment for key, segment in segments.items() if segment["state"] != DELETED}
+
+
+def _overlaps(segment, start_ns, end_ns):
+    if end_ns is not None and segment["start_ns"] is not None and segment["start_ns"] >= end_ns:
+        return False
+    if start_ns is not None and segment["end_ns"] is not None and segment["end_ns"] < start_ns:
+        return False
+    return True
+
+
+def load_manifests(logs_dir="logs", esp_name=None, start_ns=None, end_ns=None):
+    """Segments listed in every manifest of a folder, for a device and/or time window, oldest first"""
+    segments = []
+    for path in sorted(glob.glob(os.path.join(logs_dir, MANIFEST_NAME + "*.jsonl"))):
+        segments += _read_manifest(path).values()
+    return sorted((s for s in segments
+                   if (esp_name is None or s["device"] == esp_name) and _overlaps(s, start_ns, end_ns)),
+                  key=lambda s: (s["start_ns"] or 0, s["id"]))
+
+
+def _check_compression(method):
+    if method == "none":
+        return None
+    if method not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unknown log compression: {method}")
+    if method == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print("zstandard is not installed, compressing logs with gzip")
+            return "gzip"
+    return method
+
+
+class SegmentStore:
+    """Manifest of the segments written by one process, and the thread that compresses and
+    expires closed segments"""
+
+    def __init__(self, logs_dir, suffix="", compression=LOG_COMPRESSION,
+                 retention_days=LOG_RETENTION_DAYS, retention_bytes=LOG_RETENTION_BYTES):
+        # Absolute, so the compressor thread does not depend on the working directory
+        self.logs_dir = os.path.abspath(logs_dir)
+        self.path = os.path.join(self.logs_dir, f"{MANIFEST_NAME}{suffix}.jsonl")
+        self.compression = _check_compression(compression)
+        self.retention_days = retention_days
+        self.retention_bytes = retention_bytes
+        self.compressed = 0
+        self.deleted = 0
+        self._segments = {}             # id -> segment dict (also referenced by the RotatingSinks)
+        self._journal_lines = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()     # Closed segments to compress
+        self._load()
+        self._thread = threading.Thread(target=self._run, name="LogCompressor", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _load(self):
+        """Take over the manifest of a previous session: its open segments are closed now"""
+        if os.path.exists(self.path):
+            self._segments = _read_manifest(self.path)
+        for key, segment in list(self._segments.items()):
+            files = self._files(segment)
+            if not os.path.exists(files[0]):
+                del self._segments[key]
+            elif segment["state"] == ACTIVE:
+                segment["state"] = CLOSED
+                segment["closed_at"] = os.path.getmtime(files[0])
+                segment["bytes"] = sum(os.path.getsize(f) for f in files if os.path.exists(f))
+        self._rewrite()
+        for segment in self._segments.values():
+            if segment["state"] == CLOSED:
+                self._queue.put(segment)
+        self._queue.put(None)       # Apply the retention policy once, even with nothing to compress
+
+    def _files(self, segment):
+        path = os.path.join(self.logs_dir, segment["file"])
+        return [path, path + HEAP_EXTENSION] if segment["format"] == "binary" else [path]
+
+    def open_segment(self, esp_name, log_format, path):
+        """Record a new, active segment"""
+        segment = {"id": os.path.basename(path), "file": os.path.basename(path), "device": esp_name,
+                   "format": log_format, "state": ACTIVE, "start_ns": time.time_ns(), "end_ns": None,
+                   "entries": 0, "bytes": 0, "closed_at": None}
+        with self._lock:
+            self._segments[segment["id"]] = segment
+            self._append(segment)
+        return segment
+
+    def close_segment(self, segment, start_ns, end_ns, entries):
+        """Record a segment's final time range and size, and queue it for compression"""
+        with self._lock:
+            if start_ns is not None:
+                segment["start_ns"] = start_ns
+            segment["end_ns"] = end_ns
+            segment["entries"] = entries
+            segment["bytes"] = sum(os.path.getsize(f) for f in self._files(segment) if os.path.exists(f))
+            segment["state"] = CLOSED
+            segment["closed_at"] = time.time()
+            self._append(segment)
+        self._queue.put(segment)
+
+    def segments(self, esp_name=None, start_ns=None, end_ns=None):
+        """Copies of the live segments of this process, oldest first"""
+        with self._lock:
+            return sorted((dict(s) for s in self._segments.values()
+                           if (esp_name is None or s["device"] == esp_name) and _overlaps(s, start_ns, end_ns)),
+                          key=lambda s: (s["start_ns"] or 0, s["id"]))
+
+    def paths(self, segments):
+        """Current paths of the given segments (compressed ones included), skipping deleted ones"""
+        with self._lock:
+            return [os.path.join(self.logs_dir, s["file"]) for s in segments if s["state"] != DELETED]
+
+    def wait_idle(self):
+        """Wait until every closed segment has been compressed"""
+        self._queue.join()
+
+    def stop(self, timeout=COMPRESS_EXIT_TIMEOUT):
+        """Give pending compressions some time to finish (called at exit)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        while True:
+            segment = self._queue.get()
+            try:
+                if segment is not None and segment["state"] == CLOSED:
+                    self._compress(segment)
+                self._apply_retention()
+            except Exception as e:
+                print(f"Error compressing log segment: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _compress(self, segment):
+        if self.compression is None or not segment["file"].endswith(COMPRESSIBLE):
+            return
+        path = compress_file(self._files(segment)[0], self.compression)
+        with self._lock:
+            segment["file"] = os.path.basename(path)
+            segment["bytes"] = os.path.getsize(path)
+            segment["state"] = COMPRESSED
+            self._append(segment)
+        self.compressed += 1
+
+    def _apply_retention(self):
+        """Delete the oldest closed segments that are too old or over the disk budget"""
+        if not self.retention_days and not self.retention_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            closed = sorted((s for s in self._segments.values() if s["state"] in (CLOSED, COMPRESSED)),
+                            key=lambda s: s["closed_at"] or 0)
+            total = sum(s["bytes"] for s in closed)
+            expired = []
+            for segment in closed:
+                too_old = self.retention_days and now - (segment["closed_at"] or now) > self.retention_days * 86400
+                if not too_old and not (self.retention_bytes and total > self.retention_bytes):
+                    break
+                expired.append(segment)
+                total -= segment["bytes"]
+            for segment in expired:
+                for path in self._files(segment):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                segment["state"] = DELETED
+                del self._segments[segment["id"]]
+                self._append(segment)
+        if expired:
+            self.deleted += len(expired)
+            print(f"Retention: deleted {len(expired)} old log segment(s)")
+
+    def _append(self, segment):
+        """Journal the new state of a segment (called with the lock held)"""
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(segment) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_lines += 1
+        if self._journal_lines > 4 * len(self._segments) + 100:
+            self._rewrite()
+
+    def _rewrite(self):
+        """Compact the journal to one line per live segment (atomically)"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(segment) + "\n" for segment in self._segments.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._journal_lines = len(self._segments)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def segment_store(logs_dir, suffix=""):
+    """The SegmentStore of a logs folder and file suffix, shared by every Logger of the process"""
+    logs_dir = os.path.abspath(logs_dir)
+    with _stores_lock:
+        store = _stores.get((logs_dir, suffix))
+        if store is None:
+            store = _stores[logs_dir, suffix] = SegmentStore(logs_dir, suffix)
+        return store
+
+
+class RotatingSink:
+    """A device log written as a series of segments; used like a LogSink by the LogWriter"""
+
+    def __init__(self, esp_name, log_format, new_path, store,
+                 rotate_bytes=LOG_ROTATE_BYTES, rotate_seconds=LOG_ROTATE_SECONDS):
+        self.esp_name = esp_name
+        self.log_format = log_format
+        self.new_path = new_path        # new_path() -> path of the next segment, without extension
+        self.store = store
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.rows_written = 0
+        self.path = None                # Current (or last) segment file
+        self.segments = []              # Segment dicts of this log, oldest first
+        self._sink = None
+        self._open()
+
+    def _open(self):
+        self._sink = create_sink(self.log_format, self.new_path())
+        self.path = self._sink.path
+        self.segments.append(self.store.open_segment(self.esp_name, self.log_format, self.path))
+        self._opened = time.monotonic()
+        self._first_ns = self._last_ns = None
+        self._entries = 0
+        self._rows_checked = 0
+
+    def write(self, entry):
+        if self._sink is None:
+            self._open()
+        timestamp_ns = entry[TIMESTAMP_NS_FIELD]
+        if self._first_ns is None:
+            self._first_ns = timestamp_ns
+        self._last_ns = timestamp_ns
+        self._entries += 1
+        self._sink.write(entry)
+        # The size is only checked when buffered rows have reached the file
+        if self._sink.rows_written != self._rows_checked:
+            self.rows_written += self._sink.rows_written - self._rows_checked
+            self._rows_checked = self._sink.rows_written
+            if self._rotation_due():
+                self.close()
+
+    def flush(self, force_sync=False):
+        if self._sink is None:
+            return
+        self._sink.flush(force_sync)
+        self.rows_written += self._sink.rows_written - self._rows_checked
+        self._rows_checked = self._sink.rows_written
+        if self._rotation_due():
+            self.close()
+
+    def rotate_if_due(self):
+        """Close the segment once it is too old, even if the device has gone quiet (writer tick)"""
+        if self._sink is not None and self._rotation_due():
+            self.close()
+
+    def _rotation_due(self):
+        return bool((self.rotate_bytes and self._sink.size() >= self.rotate_bytes)
+                    or (self.rotate_seconds and time.monotonic() - self._opened >= self.rotate_seconds))
+
+    def close(self):
+        """Close the current segment; the next write opens a new one"""
+        if self._sink is None:
+            return
+        self._sink.close()
+        self.rows_written += self._sink.rows_written - self._rows_checked
+        self._sink = None
+        self.store.close_segment(self.segments[-1], self._first_ns, self._last_ns, self._entries)
+
+    def segment_paths(self):
+        """Files of this log, oldest first, once pending compressions are done"""
+        self.store.wait_idle()
+        return self.store.paths(self.segments)
+
+    def export_to_excel(self):
+        """Convert every segment of this log to one .xlsx and return the Excel file path"""
+        return export_to_excel(self.segment_paths())
@@ -0,0 +1,290 @@
+"""
+Step 4: Append-only log sinks
+Streaming log formats used by the Logger. Each sink only ever appends rows,
+so the cost of logging one message does not depend on the session length.
+Excel files are produced on demand by converting a finished log.
+
+The binary format (.mlog) is made for large sessions: fixed-size records
+sorted by time, with the message text in a companion heap file (.mlog.msg).
+session_log.py memory-maps both for fast seeking and NumPy/pandas analysis.
+
+Closed text logs may be compressed by log_rotation.py (.csv.gz, .jsonl.zst);
+read_log() and export_to_excel() read them as they are.
+"""
+
+import csv
+import gzip
+import json
+import os
+import struct
+import time
+
+# Column order shared by every log format
+LOG_FIELDS = ['Timestamp', 'ESP32_Name', 'Direction', 'Message_Type', 'Message', 'Notes']
+TIMESTAMP_NS_FIELD = 'Timestamp_ns'     # Extra entry field, used by the binary format only
+
+# Buffering defaults
+LOG_BUFFER_ROWS = 64        # Rows kept in memory before they are written out
+LOG_FSYNC_INTERVAL = 2.0    # Seconds between two fsync() calls
+
+# Extensions added to a log file when it is compressed (see log_rotation.py)
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+
+class LogSink:
+    """Base class for an append-only, buffered log file"""
+
+    extension = ""
+
+    def __init__(self, path, buffer_rows=LOG_BUFFER_ROWS, fsync_interval=LOG_FSYNC_INTERVAL):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.fsync_interval = fsync_interval
+        self.rows_written = 0
+        self._buffer = []
+        self._last_fsync = time.monotonic()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = self.open_file(path)
+        if is_new:
+            self.write_header()
+            self._file.flush()
+
+    def open_file(self, path):
+        """Open the file for appending"""
+        return open(path, "a", newline="", encoding="utf-8")
+
+    def write_header(self):
+        """Write the format header (if any) to a new file"""
+
+    def write_rows(self, rows):
+        """Append rows to the underlying file"""
+        raise NotImplementedError
+
+    def write(self, entry):
+        """Buffer one log entry, writing the buffer out when it is full"""
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self, force_sync=False):
+        """Write buffered rows and fsync if the fsync interval has elapsed"""
+        if self._file is None:
+            return
+        if self._buffer:
+            self.write_rows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer.clear()
+            self._file.flush()
+        now = time.monotonic()
+        if force_sync or now - self._last_fsync >= self.fsync_interval:
+            self.sync()
+            self._last_fsync = now
+
+    def sync(self):
+        """Force written rows to disk"""
+        os.fsync(self._file.fileno())
+
+    def size(self):
+        """Bytes written to the file so far (buffered rows not included)"""
+        return os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        """Flush remaining rows and close the file"""
+        if self._file is None:
+            return
+        self.flush(force_sync=True)
+        self._file.close()
+        self._file = None
+
+
+class CsvLogSink(LogSink):
+    """Comma separated values, one row per entry"""
+
+    extension = ".csv"
+
+    def __init__(self, path, **kwargs):
+        self._writer = None
+        super().__init__(path, **kwargs)
+
+    def _get_writer(self):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=LOG_FIELDS, extrasaction="ignore")
+        return self._writer
+
+    def write_header(self):
+        self._get_writer().writeheader()
+
+    def write_rows(self, rows):
+        self._get_writer().writerows(rows)
+
+
+class JsonLinesLogSink(LogSink):
+    """JSON Lines, one JSON object per entry"""
+
+    extension = ".jsonl"
+
+    def write_rows(self, rows):
+        self._file.write("".join(json.dumps({field: row[field] for field in LOG_FIELDS}) + "\n"
+                                 for row in rows))
+
+
+# Binary format: a HEADER_SIZE header (magic, version, record size, then JSON with
+# the device name and the kind table), followed by fixed-size little-endian records
+BINARY_MAGIC = b"MQTTLOG\0"
+BINARY_VERSION = 1
+HEADER_SIZE = 4096
+HEADER_PREFIX = struct.Struct("<8sII")
+# timestamp_ns, message offset in the heap, message length, kind (index into the kind table)
+RECORD = struct.Struct("<qQIH2x")
+HEAP_EXTENSION = ".msg"
+
+
+class BinaryLogSink(LogSink):
+    """Fixed-size records sorted by time, message text in a separate heap file.
+    A kind is a (Direction, Message_Type, Notes) tuple stored once in the header."""
+
+    extension = ".mlog"
+
+    def __init__(self, path, **kwargs):
+        self.heap_path = path + HEAP_EXTENSION
+        self._heap = open(self.heap_path, "ab")
+        self._heap_size = self._heap.tell()
+        self._esp_name = ""
+        self._kinds = {}            # (direction, message_type, notes) -> kind index
+        super().__init__(path, **kwargs)
+        if self._file.tell() > HEADER_SIZE:
+            self._load_header()
+
+    def open_file(self, path):
+        # Not in append mode: new kinds are written back into the header
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        f = os.fdopen(fd, "r+b")
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def _load_header(self):
+        """Continue an existing log: reload the kind table and drop a partly written last record"""
+        self._file.seek(HEADER_PREFIX.size)
+        info = json.loads(self._file.read(HEADER_SIZE - HEADER_PREFIX.size).rstrip(b"\0"))
+        self._esp_name = info["device"]
+        self._kinds = {tuple(kind): index for index, kind in enumerate(info["kinds"])}
+        size = self._file.seek(0, os.SEEK_END)
+        self._file.truncate(size - (size - HEADER_SIZE) % RECORD.size)
+        self._file.seek(0, os.SEEK_END)
+
+    def write_header(self):
+        self._file.write(bytes(HEADER_SIZE))
+        self._update_header()
+
+    def _update_header(self):
+        info = json.dumps({"device": self._esp_name, "kinds": list(self._kinds)}).encode()
+        header = HEADER_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, RECORD.size) + info
+        if len(header) > HEADER_SIZE:
+            raise ValueError("Too many distinct log entry kinds for the binary log header")
+        self._file.flush()
+        os.pwrite(self._file.fileno(), header.ljust(HEADER_SIZE, b"\0"), 0)
+
+    def write_rows(self, rows):
+        heap = []
+        records = []
+        new_kinds = False
+        for row in rows:
+            kind = (row['Direction'], row['Message_Type'], row['Notes'])
+            index = self._kinds.get(kind)
+            if index is None:
+                index = self._kinds[kind] = len(self._kinds)
+                self._esp_name = row['ESP32_Name']
+                new_kinds = True
+            message = str(row['Message']).encode("utf-8")
+            records.append(RECORD.pack(row[TIMESTAMP_NS_FIELD], self._heap_size, len(message), index))
+            heap.append(message)
+            self._heap_size += len(message)
+        if new_kinds:
+            self._update_header()
+        # The heap goes first, so a record never points past the end of the heap
+        self._heap.write(b"".join(heap))
+        self._heap.flush()
+        self._file.write(b"".join(records))
+
+    def sync(self):
+        os.fsync(self._heap.fileno())
+        super().sync()
+
+    def size(self):
+        return super().size() + self._heap_size
+
+    def close(self):
+        super().close()
+        self._heap.close()
+
+
+SINK_TYPES = {
+    "csv": CsvLogSink,
+    "jsonl": JsonLinesLogSink,
+    "binary": BinaryLogSink,
+}
+
+# Extensions of every kind of log file: compressed segments and the SQLite store (log_store.py) included
+LOG_EXTENSIONS = tuple(sink_class.extension + compressed for sink_class in SINK_TYPES.values()
+                       for compressed in ("",) + COMPRESSED_EXTENSIONS) + (".sqlite",)
+
+
+def create_sink(log_format, base_path, **kwargs):
+    """Create a sink for the given format; the file extension is added here"""
+    if log_format not in SINK_TYPES:
+        raise ValueError(f"Unknown log format: {log_format}")
+    sink_class = SINK_TYPES[log_format]
+    return sink_class(base_path + sink_class.extension, **kwargs)
+
+
+def strip_compression(path):
+    """Path of a log file without its compression extension (if any)"""
+    for compressed in COMPRESSED_EXTENSIONS:
+        if path.endswith(compressed):
+            return path[:-len(compressed)]
+    return path
+
+
+def open_log_text(path):
+    """Open a text log for reading, decompressing .gz and .zst files on the fly"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def read_log(path):
+    """Yield the entries of a CSV, JSON Lines, binary or SQLite log file as dicts"""
+    if path.endswith(BinaryLogSink.extension):
+        from session_log import DeviceLog
+        with DeviceLog(path) as log:
+            yield from log.iter_dicts()
+        return
+    if path.endswith(".sqlite"):
+        from log_store import read_entries
+        yield from read_entries(path)
+        return
+    with open_log_text(path) as f:
+        if strip_compression(path).endswith(JsonLinesLogSink.extension):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def export_to_excel(log_paths, xlsx_path=None):
+    """Convert finished log files (one file, or the segments of a log in order) to one .xlsx
+    and return the Excel file path"""
+    # pandas/openpyxl are only needed for this one-off conversion
+    import pandas as pd
+
+    if isinstance(log_paths, str):
+        log_paths = [log_paths]
+    if xlsx_path is None:
+        xlsx_path = os.path.splitext(strip_compression(log_paths[0]))[0] + ".xlsx"
+    df = pd.DataFrame([row for path in log_paths for row in read_log(path)], columns=LOG_FIELDS)
+    df.to_excel(xlsx_path, index=False)
+    return xlsx_path
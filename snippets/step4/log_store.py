@@ -0,0 +1,259 @@
+"""
+Step 4: Consolidated SQLite log store
+With LOG_FORMAT = "sqlite", every device of a session is logged into one
+SQLite database in WAL mode instead of one file per device:
+
+    logs/mqtt_log_session_<timestamp><suffix>.sqlite
+        devices(id, name)
+        kinds(id, direction, message_type, notes)
+        entries(device, timestamp_ns, kind, message)    index on (device, timestamp_ns)
+        log                                             view with the text log columns
+
+The LogWriter batches rows from every device into one transaction per flush,
+so the number of files, handles and write syscalls does not grow with the
+fleet. Per-device views are indexed queries:
+
+    for row in read_entries("logs/mqtt_log_session_20250101_120000.sqlite", "ESP32_1", start_ns, end_ns):
+        ...                                             # dicts with the text log columns
+
+The database can be read (sqlite3, DB Browser, pandas) while it is written.
+A failed transaction keeps its rows for the next flush; after
+SQLITE_MAX_FAILED_FLUSHES failures in a row (disk full, database locked) they
+are dropped and counted, so the buffer and each retry stay bounded.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from log_sinks import LOG_FIELDS, LOG_FSYNC_INTERVAL, TIMESTAMP_NS_FIELD
+
+# Store Configuration
+SQLITE_EXTENSION = ".sqlite"
+SQLITE_BUFFER_ROWS = 1000       # Rows of every device buffered before one insert transaction
+SQLITE_CACHE_KB = 8192          # Page cache of the writer connection
+SQLITE_MAX_FAILED_FLUSHES = 5   # Failed transactions in a row before the buffered rows are dropped
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS kinds (id INTEGER PRIMARY KEY, direction TEXT NOT NULL, message_type TEXT NOT NULL,
+                                  notes TEXT NOT NULL, UNIQUE (direction, message_type, notes));
+CREATE TABLE IF NOT EXISTS entries (device INTEGER NOT NULL REFERENCES devices (id),
+                                    timestamp_ns INTEGER NOT NULL,
+                                    kind INTEGER NOT NULL REFERENCES kinds (id),
+                                    message TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS entries_device_time ON entries (device, timestamp_ns);
+CREATE VIEW IF NOT EXISTS log AS
+    SELECT entries.timestamp_ns, devices.name AS device, kinds.direction, kinds.message_type,
+           entries.message, kinds.notes
+    FROM entries JOIN devices ON devices.id = entries.device JOIN kinds ON kinds.id = entries.kind;
+"""
+
+
+class SqliteLogStore:
+    """One WAL-mode database shared by the Loggers of a process; used from the LogWriter thread"""
+
+    def __init__(self, path, buffer_rows=SQLITE_BUFFER_ROWS, fsync_interval=LOG_FSYNC_INTERVAL,
+                 max_failed_flushes=SQLITE_MAX_FAILED_FLUSHES):
+        self.path = path
+        self.buffer_rows = buffer_rows
+        self.fsync_interval = fsync_interval
+        self.max_failed_flushes = max_failed_flushes
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.failed_flushes = 0     # Failed transactions in a row
+        self.users = 0
+        self._buffer = []
+        self._devices = {}          # name -> device id
+        self._kinds = {}            # (direction, message_type, notes) -> kind id
+        self._last_fsync = time.monotonic()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def attach(self, esp_name):
+        """Sink for one device's Logger; the database is closed once every device sink is closed"""
+        with self._lock:
+            if self._conn is None:
+                self._open()
+            self.users += 1
+        return StoreDeviceSink(self, esp_name)
+
+    def _open(self):
+        # Created by the thread that creates a Logger, used by the LogWriter thread afterwards
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit does not fsync, the WAL is synced on checkpoints (see sync)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        self._conn.executescript(SCHEMA)
+        self._load_ids()
+
+    def write(self, entry):
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self, force_sync=False):
+        """Insert buffered rows of every device in one transaction"""
+        if self._conn is None:
+            return
+        if self._buffer:
+            conn = self._conn
+            try:
+                conn.execute("BEGIN")
+                rows = [(self._device_id(row['ESP32_Name']),
+                         row[TIMESTAMP_NS_FIELD],
+                         self._kind_id(row['Direction'], row['Message_Type'], row['Notes']),
+                         str(row['Message'])) for row in self._buffer]
+                conn.executemany("INSERT INTO entries (device, timestamp_ns, kind, message) VALUES (?, ?, ?, ?)",
+                                 rows)
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                # Ids cached during the failed transaction were rolled back too
+                self._load_ids()
+                self.failed_flushes += 1
+                if self.failed_flushes >= self.max_failed_flushes:
+                    self.rows_dropped += len(self._buffer)
+                    print(f"SQLite log store: {len(self._buffer)} entries dropped after "
+                          f"{self.failed_flushes} failed writes ({self.rows_dropped} in total)")
+                    self._buffer.clear()
+                    self.failed_flushes = 0
+                raise
+            self.rows_written += len(rows)
+            self._buffer.clear()
+            self.failed_flushes = 0
+        now = time.monotonic()
+        if force_sync or now - self._last_fsync >= self.fsync_interval:
+            self.sync()
+            self._last_fsync = now
+
+    def _load_ids(self):
+        self._devices = {name: id_ for id_, name in self._conn.execute("SELECT id, name FROM devices")}
+        self._kinds = {(direction, message_type, notes): id_ for id_, direction, message_type, notes
+                       in self._conn.execute("SELECT id, direction, message_type, notes FROM kinds")}
+
+    def _device_id(self, name):
+        device_id = self._devices.get(name)
+        if device_id is None:
+            device_id = self._conn.execute("INSERT INTO devices (name) VALUES (?)", (name,)).lastrowid
+            self._devices[name] = device_id
+        return device_id
+
+    def _kind_id(self, direction, message_type, notes):
+        kind = (direction, message_type, notes)
+        kind_id = self._kinds.get(kind)
+        if kind_id is None:
+            kind_id = self._conn.execute("INSERT INTO kinds (direction, message_type, notes) VALUES (?, ?, ?)",
+                                         kind).lastrowid
+            self._kinds[kind] = kind_id
+        return kind_id
+
+    def sync(self):
+        """Copy committed pages into the database file (fsyncs the WAL first)"""
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path))
+
+    def release(self):
+        """Close one device sink; the last one flushes and closes the database"""
+        with self._lock:
+            self.users -= 1
+            if self.users > 0 or self._conn is None:
+                return
+        self.flush()
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+        self._conn = None
+
+
+class StoreDeviceSink:
+    """One device's view of a SqliteLogStore, used like a LogSink by the LogWriter"""
+
+    def __init__(self, store, esp_name):
+        self.store = store
+        self.esp_name = esp_name
+        self.path = store.path
+        self._closed = False
+
+    def write(self, entry):
+        self.store.write(entry)
+
+    def flush(self, force_sync=False):
+        self.store.flush(force_sync)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.store.release()
+
+    def export_to_excel(self):
+        """Convert this device's entries to .xlsx and return the Excel file path"""
+        import pandas as pd
+
+        name = os.path.basename(self.path)[:-len(SQLITE_EXTENSION)].replace("_session_", f"_{self.esp_name}_", 1)
+        xlsx_path = os.path.join(os.path.dirname(self.path), name + ".xlsx")
+        df = pd.DataFrame(list(read_entries(self.path, self.esp_name)), columns=LOG_FIELDS)
+        df.to_excel(xlsx_path, index=False)
+        return xlsx_path
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def shared_store(logs_dir, suffix=""):
+    """The SqliteLogStore of a logs folder and file suffix, created on first use in the process"""
+    key = (os.path.abspath(logs_dir), suffix)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(logs_dir, f"mqtt_log_session_{timestamp}{suffix}{SQLITE_EXTENSION}")
+            store = _stores[key] = SqliteLogStore(path)
+        return store
+
+
+def _connect_readonly(path):
+    return sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+
+
+def devices(path):
+    """Names of the devices in a store, sorted"""
+    conn = _connect_readonly(path)
+    try:
+        return [name for name, in conn.execute("SELECT name FROM devices ORDER BY name")]
+    finally:
+        conn.close()
+
+
+def read_entries(path, esp_name=None, start_ns=None, end_ns=None):
+    """Yield the entries of a device (or of every device) as dicts with the text log columns,
+    in time order; start_ns <= timestamp < end_ns"""
+    conditions = []
+    params = []
+    if esp_name is not None:
+        conditions.append("device = (SELECT id FROM devices WHERE name = ?)")
+        params.append(esp_name)
+    if start_ns is not None:
+        conditions.append("timestamp_ns >= ?")
+        params.append(start_ns)
+    if end_ns is not None:
+        conditions.append("timestamp_ns < ?")
+        params.append(end_ns)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # One device: the (device, timestamp_ns) index returns rows in order without sorting
+    query = (f"SELECT timestamp_ns, devices.name, direction, message_type, message, notes "
+             f"FROM entries JOIN devices ON devices.id = entries.device JOIN kinds ON kinds.id = entries.kind "
+             f"{where} ORDER BY timestamp_ns")
+    conn = _connect_readonly(path)
+    try:
+        for timestamp_ns, name, direction, message_type, message, notes in conn.execute(query, params):
+            yield {'Timestamp': datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                   'ESP32_Name': name, 'Direction': direction, 'Message_Type': message_type,
+                   'Message': message, 'Notes': notes}
+    finally:
+        conn.close()
@@ -0,0 +1,143 @@
+"""
+Step 4: Background log writer
+A single thread shared by every Logger. Entries are handed over through a
+bounded queue and written to their sinks in batches, so disk I/O never runs
+on the thread that receives MQTT messages or draws the GUI.
+"""
+
+import queue
+import threading
+import time
+
+# Writer Configuration
+LOG_QUEUE_SIZE = 10000        # Max entries waiting to be written
+LOG_BATCH_SIZE = 500          # Max entries written per batch
+LOG_FLUSH_INTERVAL = 1.0      # Seconds between two flushes of idle sinks
+LOG_BLOCK_TIMEOUT = 0.0       # Seconds a producer may wait on a full queue (0 = drop at once)
+
+# Control items travelling through the queue next to regular entries
+_FLUSH = "flush"
+_CLOSE = "close"
+_STOP = "stop"
+
+
+class LogWriter(threading.Thread):
+    """Batched writer thread fed by a bounded queue"""
+
+    def __init__(self, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, block_timeout=LOG_BLOCK_TIMEOUT):
+        super().__init__(name="LogWriter", daemon=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.written = 0
+        self.dropped = 0
+        self.metrics = None         # Optional Metrics; receives log_commit latencies
+        self._dirty_sinks = set()
+        self._open_sinks = set()    # Sinks written to and not closed, for time-based rotation
+        self._uncommitted = []      # (esp_name, received_ns) written since the last flush
+        self._last_flush = time.monotonic()
+
+    def submit(self, sink, entry, received_ns=0):
+        """Queue an entry for the sink; returns False if it had to be dropped"""
+        try:
+            if self.block_timeout > 0:
+                self.queue.put((sink, entry, received_ns), timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait((sink, entry, received_ns))
+            return True
+        except queue.Full:
+            if self.dropped == 0:
+                print("Log writer is falling behind, dropping log entries")
+            self.dropped += 1
+            return False
+
+    def flush(self, wait=True):
+        """Ask the writer to flush every sink; optionally wait until done"""
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put((_FLUSH, done, 0))
+        if wait:
+            done.wait()
+
+    def close_sink(self, sink):
+        """Flush and close a sink once its queued entries are written"""
+        if self.is_alive():
+            self.queue.put((_CLOSE, sink, 0))
+        else:
+            sink.close()
+
+    def stop(self):
+        """Write everything still queued, then stop the thread"""
+        if self.is_alive():
+            self.queue.put((_STOP, None, 0))
+            self.join()
+
+    def pending(self):
+        """Number of entries waiting in the queue"""
+        return self.queue.qsize()
+
+    def run(self):
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            running = self.process_batch(batch)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush_sinks()
+        self.flush_sinks(force_sync=True)
+
+    def process_batch(self, batch):
+        """Write a batch of queued items; returns False once a stop is requested"""
+        running = True
+        for sink, item, received_ns in batch:
+            if sink is _FLUSH:
+                self.flush_sinks()
+                item.set()
+            elif sink is _CLOSE:
+                self._dirty_sinks.discard(item)
+                self._open_sinks.discard(item)
+                self._safe(item.close)
+            elif sink is _STOP:
+                running = False
+            else:
+                if self._safe(sink.write, item):
+                    self.written += 1
+                    self._dirty_sinks.add(sink)
+                    self._open_sinks.add(sink)
+                    if received_ns and self.metrics:
+                        self._uncommitted.append((item['ESP32_Name'], received_ns))
+        return running
+
+    def flush_sinks(self, force_sync=False):
+        """Flush every sink written to since the last flush; let idle ones rotate by age"""
+        for sink in self._dirty_sinks:
+            self._safe(sink.flush, force_sync)
+        for sink in self._open_sinks - self._dirty_sinks:
+            rotate_if_due = getattr(sink, "rotate_if_due", None)
+            if rotate_if_due:
+                self._safe(rotate_if_due)
+        self._dirty_sinks.clear()
+        self._last_flush = time.monotonic()
+        if self._uncommitted:
+            now_ns = time.monotonic_ns()
+            for esp_name, received_ns in self._uncommitted:
+                self.metrics.record("log_commit", esp_name, received_ns, now_ns)
+            self._uncommitted.clear()
+
+    def _safe(self, func, *args):
+        try:
+            func(*args)
+            return True
+        except Exception as e:
+            print(f"Error writing log file: {e}")
+            return False
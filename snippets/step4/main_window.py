@@ -0,0 +1,567 @@
+"""
+Step 4: PyQt6 Interface with Logging (window)
+Enhanced interface that logs all MQTT communication to append-only log files
+Creates separate log files for each ESP32 device; Excel (.xlsx) copies are
+exported on demand or when the application closes
+
+Devices are listed in a sortable, filterable table (device_table.py) that
+only paints the visible rows, so the window stays responsive with hundreds
+of ESP32s.
+
+Run on its own, the GUI connects to MQTT and logs in-process. With --attach
+it becomes a thin client of a running headless gateway (mqtt_gateway.py):
+    python snippets/step4/pyqt6_interface_with_logging.py --attach 127.0.0.1:8765
+
+Started through pyqt6_interface_with_logging.py, which only imports this
+module (and Qt) when the GUI is wanted.
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import sys
+import time
+import os
+import json
+import socket
+import threading
+from PyQt6.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
+                            QWidget, QLabel, QLineEdit, QPushButton, QComboBox,
+                            QMessageBox, QTableView, QHeaderView, QAbstractItemView)
+from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal
+from PyQt6.QtGui import QFont
+from log_writer import LogWriter
+from update_coalescer import DeviceUpdate, UpdateCoalescer
+from mqtt_core import MQTTCore
+from mqtt_gateway import GATEWAY_HOST, GATEWAY_PORT, encode_message
+from metrics import Metrics, METRICS_SUMMARY_INTERVAL, serve_metrics
+from command_batch import format_batch_summary
+from ingest_shards import SHARD_MODE, ShardCoordinator
+from device_table import (COMMAND, DEVICE, FAILED, PENDING, STATES, DeviceDelegate, DeviceFilterProxy,
+                          DeviceTableModel)
+
+# GUI Configuration
+GUI_REFRESH_HZ = 20             # Device rows are repainted at most this often
+RECENT_MESSAGES_SHOWN = 10      # Entries listed in the tooltip of a device's Last Data cell
+DEVICE_ROW_HEIGHT = 24          # Fixed row height, so the table never measures its rows
+
+# Logging Configuration
+LOG_STATUS_INTERVAL_MS = 1000   # How often the log writer status is refreshed
+EXPORT_EXCEL_ON_EXIT = True     # Convert each log to .xlsx when the app closes
+
+# Metrics Configuration
+METRICS_HTTP_PORT = None        # e.g. 9108 to serve Prometheus text on 127.0.0.1:9108/metrics
+
+class MQTTWorker(QThread):
+    """MQTT worker thread to handle communication and logging without blocking UI"""
+    connection_status = pyqtSignal(bool)  # connected/disconnected
+    command_sent = pyqtSignal(str, str)  # esp_name, command
+    command_result = pyqtSignal(str, str, str, object)  # esp_name, command, state, latency_ms
+    logs_exported = pyqtSignal(list)  # exported file names
+    batch_completed = pyqtSignal(dict)  # CommandBatch summary
+    liveness_changed = pyqtSignal(str, str, str)  # esp_name, online/stale/offline, reason
+    
+    def __init__(self, shards=0, shard_mode=SHARD_MODE):
+        super().__init__()
+        self.log_writer = LogWriter()
+        self.log_writer.start()
+        # With shards, worker processes ingest the data; this core sends commands
+        self.core = MQTTCore(self.log_writer, ingest=not shards)
+        self.shards = ShardCoordinator(self.core, shards, shard_mode) if shards else None
+        self.core.status_callback = self.connection_status.emit
+        self.core.command_callback = self.command_sent.emit
+        self.core.command_result_callback = self.command_result.emit
+        self.core.liveness_callback = self.liveness_changed.emit
+        
+        # Latest value per device, pulled by the GUI on a timer
+        self.coalescer = self.core.coalescer
+        self.metrics = self.core.metrics
+        self._export_thread = None
+
+    def run(self):
+        """Connect to MQTT and start loop"""
+        if self.shards:
+            self.shards.start()
+        self.core.run()
+
+    def send_command(self, esp_name, command):
+        """Send command to specific ESP32 and log it (queued while the broker is unreachable)"""
+        return self.core.send_command(esp_name, command)
+    
+    @property
+    def broker_connected(self):
+        return self.core.connected
+    
+    def send_batch(self, target, command):
+        """Send a command to a group of ESP32s; batch_completed is emitted when all have answered"""
+        batch = self.core.send_batch(target, command)
+        batch.add_done_callback(lambda b: self.batch_completed.emit(b.summary()))
+        return bool(batch.targets)
+    
+    def log_status(self, esp_name):
+        """Return (log file name, log entry count) of a device"""
+        if self.shards:
+            return self.shards.log_status(esp_name)
+        logger = self.core.get_logger(esp_name)
+        return os.path.basename(logger.log_file), logger.entry_count
+    
+    def event_rates(self, esp_name):
+        """Events per minute of a device over the sliding window (L1, L2, FP, other)"""
+        if self.shards:
+            return self.shards.event_rates(esp_name)
+        return self.core.rates.per_minute(esp_name)
+    
+    def recent_messages(self, esp_name, n):
+        """Last n logged entries of a device, from its in-memory history"""
+        if self.shards:
+            return []  # Received data are kept by the ingest workers
+        return self.core.get_logger(esp_name).recent_entries(n)
+    
+    def log_writer_status(self):
+        """Return a one-line summary of the log writer"""
+        writer = self.log_writer
+        return (f"Log writer: {writer.written} written, {writer.pending()} queued, "
+                f"{writer.dropped} dropped"), writer.dropped > 0
+    
+    def export_logs(self):
+        """Convert every log to .xlsx in a background thread; logs_exported is emitted when done"""
+        if self._export_thread and self._export_thread.is_alive():
+            return
+        self._export_thread = threading.Thread(target=self._export_logs, name="ExcelExport", daemon=True)
+        self._export_thread.start()
+
+    def _export_logs(self):
+        # pandas/openpyxl work and waiting for log compression stay off the GUI thread
+        files = [logger.export_to_excel() for logger in list(self.core.loggers.values())]
+        if self.shards:
+            files += self.shards.export_logs()
+        self.logs_exported.emit([os.path.basename(f) for f in files if f])
+
+    def stop(self):
+        """Stop the MQTT worker"""
+        self.core.stop()
+        self.quit()
+    
+    def shutdown(self):
+        """Drain the log writer, then convert the logs to Excel at the end of the session"""
+        if self._export_thread:
+            self._export_thread.join()
+        if self.shards:
+            self.shards.stop(export=EXPORT_EXCEL_ON_EXIT)
+        loggers = self.core.close_logs()
+        self.log_writer.stop()
+        if EXPORT_EXCEL_ON_EXIT:
+            for logger in loggers:
+                if logger.entry_count:
+                    logger.export_to_excel()
+
+class GatewayClient(QThread):
+    """Attaches the GUI to a headless gateway (same interface as MQTTWorker)"""
+    connection_status = pyqtSignal(bool)  # broker connected/disconnected, as seen by the gateway
+    command_sent = pyqtSignal(str, str)  # esp_name, command
+    command_result = pyqtSignal(str, str, str, object)  # esp_name, command, state, latency_ms
+    logs_exported = pyqtSignal(list)  # exported file names
+    batch_completed = pyqtSignal(dict)  # CommandBatch summary
+    liveness_changed = pyqtSignal(str, str, str)  # esp_name, online/stale/offline, reason
+    
+    def __init__(self, host=GATEWAY_HOST, port=GATEWAY_PORT):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.running = True
+        self.coalescer = UpdateCoalescer()
+        self.metrics = Metrics()  # GUI-side measurements only; the gateway has its own
+        self._log_status = {}  # esp_name -> (log file name, log entry count)
+        self._rates = {}  # esp_name -> events per minute, pushed by the gateway every second
+        self.broker_connected = False
+    
+    def run(self):
+        """Connect to the gateway and read its messages, reconnecting if it goes away"""
+        while self.running:
+            try:
+                self.sock = socket.create_connection((self.host, self.port))
+                with self.sock.makefile("rb") as stream:
+                    for line in stream:
+                        self.handle_message(json.loads(line))
+            except OSError as e:
+                if self.running:
+                    print(f"Gateway connection error: {e}")
+            self.sock = None
+            self.broker_connected = False
+            if self.running:
+                self.connection_status.emit(False)
+                time.sleep(2)
+    
+    def handle_message(self, message):
+        message_type = message.get("type")
+        if message_type == "update":
+            esp_name = message["device"]
+            self._log_status[esp_name] = (message["log_file"], message["log_entries"])
+            self.coalescer.store(DeviceUpdate(esp_name, message["data"],
+                                              message["received_at"], message["count"], 0))
+        elif message_type == "rates":
+            self._rates.update(message["rates"])
+        elif message_type == "liveness":
+            self.liveness_changed.emit(message["device"], message["state"], message["reason"])
+        elif message_type == "status":
+            self.broker_connected = message["connected"]
+            self.connection_status.emit(message["connected"])
+        elif message_type == "command_sent":
+            self.command_sent.emit(message["device"], message["command"])
+        elif message_type == "command_result":
+            self.command_result.emit(message["device"], message["command"],
+                                     message["state"], message["latency_ms"])
+        elif message_type == "send_result" and not message["ok"]:
+            print(f"Gateway could not send {message['command']} to {message['device']}")
+        elif message_type == "batch_result":
+            self.batch_completed.emit(message)
+        elif message_type == "export_result":
+            self.logs_exported.emit(message["files"])
+    
+    def request(self, message):
+        """Send a request to the gateway; returns False if not attached"""
+        if self.sock is None:
+            return False
+        try:
+            self.sock.sendall(encode_message(message))
+            return True
+        except OSError:
+            return False
+    
+    def send_command(self, esp_name, command):
+        """Ask the gateway to send (and log) a command"""
+        return self.request({"type": "send", "device": esp_name, "command": str(command)})
+    
+    def send_batch(self, target, command):
+        """Ask the gateway to send a command to a group of ESP32s"""
+        return self.request({"type": "send_batch", "target": target, "command": str(command)})
+    
+    def log_status(self, esp_name):
+        return self._log_status.get(esp_name, ("(on gateway)", 0))
+    
+    def event_rates(self, esp_name):
+        return self._rates.get(esp_name, ())
+    
+    def recent_messages(self, esp_name, n):
+        return []  # History is kept by the gateway
+    
+    def log_writer_status(self):
+        return f"Logs are written by the gateway at {self.host}:{self.port}", False
+    
+    def export_logs(self):
+        if not self.request({"type": "export"}):
+            self.logs_exported.emit([])
+    
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def shutdown(self):
+        pass
+
+class MainWindow(QMainWindow):
+    """Main application window with logging capabilities"""
+    
+    def __init__(self, gateway_address=None, shards=0):
+        super().__init__()
+        self.mqtt_worker = None
+        self.gateway_address = gateway_address  # (host, port) when attached to a gateway
+        self.shards = shards                    # Ingest worker processes (0 = ingest in this process)
+        self.setup_ui()
+        self.setup_mqtt()
+        
+    def setup_ui(self):
+        self.setWindowTitle("ESP32 MQTT Controller with Logging")
+        self.setGeometry(100, 100, 900, 600)
+        
+        # Central widget
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        
+        # Main layout
+        main_layout = QVBoxLayout()
+        
+        # Title
+        title_label = QLabel("ESP32 MQTT Communication Interface with Logging")
+        title_label.setFont(QFont("Arial", 16, QFont.Weight.Bold))
+        title_label.setStyleSheet("padding: 10px; background-color: #e0e0e0;")
+        main_layout.addWidget(title_label)
+        
+        # Connection status
+        self.connection_label = QLabel("MQTT Status: Connecting...")
+        self.connection_label.setStyleSheet("padding: 5px; color: #666;")
+        main_layout.addWidget(self.connection_label)
+        
+        # Log directory info
+        logs_dir = os.path.abspath("logs")
+        log_dir_label = QLabel(f"Log files saved to: {logs_dir}")
+        log_dir_label.setStyleSheet("padding: 5px; color: #666; font-size: 10px;")
+        main_layout.addWidget(log_dir_label)
+        
+        # Log writer status (queue depth and dropped entries)
+        self.log_status_label = QLabel("Log writer: idle")
+        self.log_status_label.setStyleSheet("padding: 5px; color: #666; font-size: 10px;")
+        main_layout.addWidget(self.log_status_label)
+        
+        # ESP32 table (rows are added when a device is discovered)
+        self.waiting_label = QLabel("Waiting for ESP32 devices to publish on mosquito/+/data...")
+        self.waiting_label.setStyleSheet("padding: 5px; color: #666;")
+        main_layout.addWidget(self.waiting_label)
+        
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Show:"))
+        self.state_filter_combo = QComboBox()
+        self.state_filter_combo.addItem("All devices", None)
+        for state in STATES:
+            self.state_filter_combo.addItem(state, state)
+        self.state_filter_combo.currentIndexChanged.connect(
+            lambda _: self.device_proxy.set_state_filter(self.state_filter_combo.currentData()))
+        filter_layout.addWidget(self.state_filter_combo)
+        self.name_filter_entry = QLineEdit()
+        self.name_filter_entry.setPlaceholderText("Filter by name (e.g. ESP32_1*)")
+        self.name_filter_entry.textChanged.connect(
+            lambda text: self.device_proxy.setFilterWildcard(text if any(c in text for c in "*?[") else f"*{text}*"))
+        filter_layout.addWidget(self.name_filter_entry, 1)
+        main_layout.addLayout(filter_layout)
+        
+        self.device_model = DeviceTableModel(self)
+        self.device_model.command_handler = self.send_device_command
+        self.device_model.recent_messages = self.recent_messages_tooltip
+        self.device_proxy = DeviceFilterProxy(self)
+        self.device_proxy.setSourceModel(self.device_model)
+        self.device_view = QTableView()
+        self.device_view.setModel(self.device_proxy)
+        self.device_view.setItemDelegate(DeviceDelegate(self.device_view))
+        self.device_view.setSortingEnabled(True)
+        self.device_view.sortByColumn(DEVICE, Qt.SortOrder.AscendingOrder)
+        self.device_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.device_view.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked
+                                         | QAbstractItemView.EditTrigger.SelectedClicked
+                                         | QAbstractItemView.EditTrigger.AnyKeyPressed)
+        self.device_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.device_view.verticalHeader().setDefaultSectionSize(DEVICE_ROW_HEIGHT)
+        self.device_view.verticalHeader().hide()
+        self.device_view.horizontalHeader().setStretchLastSection(True)
+        self.device_view.setToolTip("Double-click a Command cell to send a blink command")
+        main_layout.addWidget(self.device_view, 1)
+        
+        # Group command: one command to every device matched by a target
+        group_layout = QHBoxLayout()
+        group_layout.addWidget(QLabel("Send to:"))
+        self.group_target_entry = QLineEdit("all")
+        self.group_target_entry.setToolTip("all, group:<name>, a name pattern (ESP32_1*) "
+                                           "or a topic filter (mosquito/+/command)")
+        group_layout.addWidget(self.group_target_entry)
+        self.group_command_entry = QLineEdit()
+        self.group_command_entry.setPlaceholderText("Blinks (1-20)")
+        self.group_command_entry.returnPressed.connect(self.send_group_command)
+        group_layout.addWidget(self.group_command_entry)
+        self.group_send_button = QPushButton("Send to Group")
+        self.group_send_button.clicked.connect(self.send_group_command)
+        group_layout.addWidget(self.group_send_button)
+        self.group_status_label = QLabel("")
+        self.group_status_label.setStyleSheet("padding: 5px; color: #666;")
+        group_layout.addWidget(self.group_status_label, 1)
+        main_layout.addLayout(group_layout)
+        
+        # Controls layout
+        controls_layout = QHBoxLayout()
+        
+        self.open_logs_button = QPushButton("Open Logs Folder")
+        self.open_logs_button.clicked.connect(self.open_logs_folder)
+        controls_layout.addWidget(self.open_logs_button)
+        
+        self.export_excel_button = QPushButton("Export Logs to Excel")
+        self.export_excel_button.clicked.connect(self.export_logs_to_excel)
+        controls_layout.addWidget(self.export_excel_button)
+        
+        controls_layout.addStretch()
+        main_layout.addLayout(controls_layout)
+        
+
+        central_widget.setLayout(main_layout)
+        
+    def setup_mqtt(self):
+        """Initialize MQTT worker (ESP32 widgets are added as devices are discovered)"""
+        # Create and start MQTT worker (or attach to a running gateway)
+        if self.gateway_address:
+            self.mqtt_worker = GatewayClient(*self.gateway_address)
+        else:
+            self.mqtt_worker = MQTTWorker(self.shards)
+        self.mqtt_worker.connection_status.connect(self.on_connection_status)
+        self.mqtt_worker.command_sent.connect(self.on_command_sent)
+        self.mqtt_worker.command_result.connect(self.on_command_result)
+        self.mqtt_worker.logs_exported.connect(self.on_logs_exported)
+        self.mqtt_worker.batch_completed.connect(self.on_batch_completed)
+        self.mqtt_worker.liveness_changed.connect(self.on_liveness_changed)
+        self.mqtt_worker.start()
+        
+        # Pull coalesced device updates at a fixed rate instead of once per message
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh_devices)
+        self.refresh_timer.start(1000 // GUI_REFRESH_HZ)
+        
+        # Periodically show how the log writer keeps up
+        self.log_status_timer = QTimer(self)
+        self.log_status_timer.timeout.connect(self.update_log_status)
+        self.log_status_timer.start(LOG_STATUS_INTERVAL_MS)
+        
+        # Pipeline measurements: periodic summary line and optional Prometheus endpoint
+        if METRICS_SUMMARY_INTERVAL:
+            self.metrics_timer = QTimer(self)
+            self.metrics_timer.timeout.connect(self.print_metrics_summary)
+            self.metrics_timer.start(METRICS_SUMMARY_INTERVAL * 1000)
+        self.metrics_server = None
+        if METRICS_HTTP_PORT:
+            self.metrics_server = serve_metrics(self.mqtt_worker.metrics, METRICS_HTTP_PORT)
+    
+    def print_metrics_summary(self):
+        print(self.mqtt_worker.metrics.summary_line())
+    
+    def update_log_status(self):
+        """Show log writer queue depth and dropped entries, and the event rates"""
+        text, dropping = self.mqtt_worker.log_writer_status()
+        self.log_status_label.setText(text)
+        color = "red" if dropping else "#666"
+        self.log_status_label.setStyleSheet(f"padding: 5px; color: {color}; font-size: 10px;")
+        for row in self.device_model.rows:
+            self.device_model.set_rates(row.esp_name, self.mqtt_worker.event_rates(row.esp_name))
+        self.update_device_count()
+    
+    def update_device_count(self):
+        """Show how many devices there are in each state"""
+        if not self.device_model.rows:
+            return
+        counts = ", ".join(f"{count} {state.lower()}"
+                           for state, count in self.device_model.state_counts().items() if count)
+        self.waiting_label.setText(f"ESP32 devices: {len(self.device_model.rows)} ({counts})")
+    
+    def refresh_devices(self):
+        """Update the rows of the ESP32s that received data since the last refresh"""
+        metrics = self.mqtt_worker.metrics
+        updates = self.mqtt_worker.coalescer.take_dirty()
+        known = len(self.device_model.rows)
+        for update in updates:
+            _, log_entries = self.mqtt_worker.log_status(update.esp_name)
+            self.device_model.apply_update(update, log_entries)
+            metrics.record("gui_apply", update.esp_name, update.received_ns)
+        if len(self.device_model.rows) != known:
+            self.update_device_count()
+    
+    def send_device_command(self, esp_name, command):
+        """Send a blink command typed in a device's Command cell; returns (status, state)"""
+        if self.mqtt_worker.send_command(esp_name, command):
+            if self.mqtt_worker.broker_connected:
+                return f"Sending {command}...", PENDING
+            return f"Queued {command} (sent on reconnect)", PENDING
+        return "Failed to send command (not connected)", FAILED
+    
+    def recent_messages_tooltip(self, esp_name):
+        """Recent messages of a device, from the in-memory history"""
+        recent = self.mqtt_worker.recent_messages(esp_name, RECENT_MESSAGES_SHOWN)
+        return "\n".join(f"{time.strftime('%H:%M:%S', time.localtime(ts / 1e9))} {direction}: {message}"
+                         for ts, direction, _, message in recent)
+    
+    def send_group_command(self):
+        """Send the blink command to every ESP32 matched by the target"""
+        target = self.group_target_entry.text().strip() or "all"
+        try:
+            command = int(self.group_command_entry.text().strip())
+        except ValueError:
+            self.group_status_label.setText("Invalid input (numbers only)")
+            return
+        if not 1 <= command <= 20:
+            self.group_status_label.setText("Invalid number (1-20 allowed)")
+            return
+        # The batch may complete (and report) before send_batch returns
+        self.group_status_label.setText(f"Sending {command} to {target}...")
+        if self.mqtt_worker.send_batch(target, command):
+            self.group_command_entry.clear()
+        else:
+            self.group_status_label.setText(f"No device matches {target}")
+    
+    def on_batch_completed(self, summary):
+        """Show how a group command went"""
+        self.group_status_label.setText(format_batch_summary(summary))
+    
+    def on_command_sent(self, esp_name, command):
+        """Show a command as pending until it is acknowledged"""
+        # Command logging is handled in the MQTT worker (or gateway)
+        self.device_model.set_command_status(esp_name, f"Sent {command}, waiting for ack", PENDING)
+    
+    def on_command_result(self, esp_name, command, state, latency_ms):
+        """Show whether a command was acknowledged"""
+        if state == "completed":
+            self.device_model.set_command_status(esp_name, f"{command} done ({latency_ms:.0f} ms round trip)")
+        else:
+            self.device_model.set_command_status(esp_name, f"{command} {state}: no acknowledgement", FAILED)
+    
+    def on_liveness_changed(self, esp_name, state, reason):
+        """Show a device going online, stale or offline"""
+        self.device_model.set_liveness(esp_name, state)
+        self.update_device_count()
+    
+    def on_connection_status(self, connected):
+        """Handle MQTT connection status changes"""
+        if connected:
+            self.connection_label.setText("MQTT Status: Connected")
+            self.connection_label.setStyleSheet("padding: 5px; color: green;")
+        else:
+            self.connection_label.setText("MQTT Status: Disconnected")
+            self.connection_label.setStyleSheet("padding: 5px; color: red;")
+    
+    def open_logs_folder(self):
+        """Open the logs folder in file explorer"""
+        logs_dir = os.path.abspath("logs")
+        if os.path.exists(logs_dir):
+            if sys.platform == "win32":
+                os.startfile(logs_dir)
+            elif sys.platform == "darwin":
+                os.system(f"open {logs_dir}")
+            else:
+                os.system(f"xdg-open {logs_dir}")
+        else:
+            QMessageBox.information(self, "Info", "Logs folder will be created when communication starts.")
+    
+    def export_logs_to_excel(self):
+        """Convert the current log files to .xlsx on demand (the window stays responsive meanwhile)"""
+        self.export_excel_button.setEnabled(False)
+        self.export_excel_button.setText("Exporting...")
+        self.mqtt_worker.export_logs()
+    
+    def on_logs_exported(self, exported):
+        """Report the result of an Excel export"""
+        self.export_excel_button.setEnabled(True)
+        self.export_excel_button.setText("Export Logs to Excel")
+        if exported:
+            QMessageBox.information(self, "Export", "Exported:\n" + "\n".join(exported))
+        else:
+            QMessageBox.warning(self, "Export", "No log file could be exported.")
+    
+    def closeEvent(self, event):
+        """Handle application close"""
+        if self.mqtt_worker:
+            self.mqtt_worker.stop()
+            self.mqtt_worker.wait()
+            self.mqtt_worker.shutdown()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        event.accept()
+
+def run_gui(gateway_address=None, shards=0, qt_args=()):
+    """Start the PyQt6 application with logging; returns its exit code"""
+    app = QApplication(sys.argv[:1] + list(qt_args))
+    
+    # Set application style
+    app.setStyle('Fusion')
+    
+    # Create and show main window
+    window = MainWindow(gateway_address, shards)
+    window.show()
+    
+    # Start event loop
+    return app.exec()
@@ -0,0 +1,80 @@
+"""
+Step 4: In-memory message history
+A fixed-capacity, columnar ring buffer per device. Timestamps are int64
+nanoseconds, direction/type/notes are a one-byte kind code, and message
+strings are interned, so each entry costs a few bytes plus a shared string.
+Appending is O(1), reading the last N entries is O(N), and memory never grows
+past the capacity. The complete history lives only in the log file on disk.
+"""
+
+import sys
+from array import array
+
+# History Configuration
+HISTORY_CAPACITY = 1000     # Entries kept in memory per device
+
+# Kind codes: index into ENTRY_KINDS of (Direction, Message_Type, Notes) as written to the log
+ENTRY_KINDS = [
+    ('Received', 'Data', 'Data from ESP32'),
+    ('Sent', 'Command', 'Command to ESP32'),
+]
+KIND_CODES = {kind: code for code, kind in enumerate(ENTRY_KINDS)}
+
+
+def kind_code(direction, message_type, notes):
+    """One-byte code of an entry kind, registering new kinds on first use"""
+    kind = (direction, message_type, notes)
+    code = KIND_CODES.get(kind)
+    if code is None:
+        if len(ENTRY_KINDS) >= 256:
+            raise ValueError("Too many distinct log entry kinds")
+        code = KIND_CODES.setdefault(kind, len(ENTRY_KINDS))
+        if code == len(ENTRY_KINDS):
+            ENTRY_KINDS.append(kind)
+    return code
+
+# Longer messages are kept as-is; interning only pays off for short repeated values
+INTERN_MAX_LENGTH = 32
+
+
+class MessageHistory:
+    """Ring buffer of (timestamp_ns, kind, message) with a hard size limit"""
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.timestamps_ns = array('q', bytes(8 * capacity))
+        self.kinds = array('B', bytes(capacity))
+        self.messages = [None] * capacity
+        self.total = 0          # Entries appended since creation (including overwritten ones)
+        self._next = 0
+
+    def append(self, timestamp_ns, kind, message):
+        """Store one entry, overwriting the oldest when full"""
+        if not isinstance(message, str):
+            message = str(message)
+        if len(message) <= INTERN_MAX_LENGTH:
+            message = sys.intern(message)
+        index = self._next
+        self.timestamps_ns[index] = timestamp_ns
+        self.kinds[index] = kind
+        self.messages[index] = message
+        self._next = index + 1 if index + 1 < self.capacity else 0
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def last(self, n):
+        """The newest n entries as (timestamp_ns, direction, message_type, message), oldest first"""
+        n = min(n, len(self))
+        entries = []
+        for offset in range(n, 0, -1):
+            index = (self._next - offset) % self.capacity
+            direction, message_type, _ = ENTRY_KINDS[self.kinds[index]]
+            entries.append((self.timestamps_ns[index], direction, message_type, self.messages[index]))
+        return entries
+
+    def memory_bytes(self):
+        """Approximate memory held by the buffer itself (shared strings excluded)"""
+        return (self.timestamps_ns.itemsize * self.capacity + self.kinds.itemsize * self.capacity
+                + sys.getsizeof(self.messages))
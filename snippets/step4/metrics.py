@@ -0,0 +1,294 @@
+"""
+Step 4: Pipeline instrumentation
+Latency and throughput measurements for the ingest pipeline. Every message is
+stamped with a monotonic nanosecond time when it is received; later stages
+record how long after reception they handled it:
+
+    dispatch    - routed, queued for logging and stored for the GUI
+    gui_apply   - shown by the GUI
+    log_commit  - flushed to the log file by the log writer
+
+Commands are measured the same way from the moment they are sent:
+
+    command_puback  - acknowledged by the broker
+    command_rtt     - reported done by the device (round trip)
+
+Per-device histograms give latency percentiles, per-device rate meters give
+messages/s, gauges report the depth of every internal queue, device counts
+per liveness state are their own gauge and counters report pipeline events
+such as dropped duplicates. Everything
+is available as a dict (stats()), a one-line summary and Prometheus text,
+optionally served on a local HTTP port.
+"""
+
+import threading
+import time
+
+# Metrics Configuration
+METRICS_SUMMARY_INTERVAL = 10   # Seconds between two printed summary lines (0 = never)
+METRICS_HTTP_HOST = "127.0.0.1"
+METRICS_RATE_WINDOW = 10        # Seconds averaged by the messages/s rate
+
+STAGES = ("dispatch", "gui_apply", "log_commit", "command_puback", "command_rtt")
+
+# Histogram buckets: powers of two from 1 us to ~67 s (upper bounds in ns)
+BUCKET_BOUNDS_NS = [1000 << i for i in range(27)]
+
+
+def label_value(value):
+    """A Prometheus label value with backslash, double quote and newline escaped"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def message_received_ns(msg):
+    """Monotonic receive time of a paho message in ns (paho stamps it with time.monotonic())"""
+    return int(msg.timestamp * 1e9)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with O(1) recording"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_NS) + 1)   # last bucket = overflow
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, value_ns):
+        if value_ns < 0:
+            value_ns = 0
+        # Bucket index from the bit length: bucket i holds values up to 1 us * 2**i
+        index = max(0, (value_ns - 1) // 1000).bit_length()
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ns += value_ns
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def percentile(self, fraction):
+        """Upper bound (ns) of the bucket holding the given fraction of samples"""
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                if index < len(BUCKET_BOUNDS_NS):
+                    return min(BUCKET_BOUNDS_NS[index], self.max_ns)
+                return self.max_ns
+        return self.max_ns
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ns / self.count / 1e6 if self.count else 0.0,
+            "p50_ms": self.percentile(0.50) / 1e6,
+            "p90_ms": self.percentile(0.90) / 1e6,
+            "p99_ms": self.percentile(0.99) / 1e6,
+            "max_ms": self.max_ns / 1e6,
+        }
+
+
+class RateMeter:
+    """Messages/s over a sliding window of one-second slots"""
+
+    def __init__(self, window=METRICS_RATE_WINDOW):
+        self.window = window
+        self.slots = [0] * window
+        self.slot_seconds = [0] * window
+        self.total = 0
+
+    def mark(self, now_s=None, count=1):
+        second = int(now_s if now_s is not None else time.monotonic())
+        index = second % self.window
+        if self.slot_seconds[index] != second:
+            self.slot_seconds[index] = second
+            self.slots[index] = 0
+        self.slots[index] += count
+        self.total += count
+
+    def rate(self, now_s=None):
+        second = int(now_s if now_s is not None else time.monotonic())
+        # Only complete seconds inside the window are counted
+        oldest = second - self.window
+        count = sum(c for c, s in zip(self.slots, self.slot_seconds) if oldest <= s < second)
+        return count / self.window
+
+
+class Metrics:
+    """Per-device latency histograms, rates and queue-depth gauges"""
+
+    def __init__(self):
+        self._histograms = {stage: {} for stage in STAGES}   # stage -> esp_name -> Histogram
+        self._rates = {}                                    # esp_name -> RateMeter
+        self._gauges = {}                                   # queue name -> callable
+        self._counters = {}                                 # source name -> callable returning a dict
+        self._device_states = None                          # callable returning {state: device count}
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def mark_received(self, esp_name, count=1):
+        """Count received messages for the device's rate"""
+        meter = self._rates.get(esp_name)
+        if meter is None:
+            with self._lock:
+                meter = self._rates.setdefault(esp_name, RateMeter())
+        meter.mark(count=count)
+
+    def record(self, stage, esp_name, received_ns, now_ns=None):
+        """Record the latency of a stage for a message received at received_ns"""
+        if not received_ns:
+            return
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        histograms = self._histograms[stage]
+        histogram = histograms.get(esp_name)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(esp_name, Histogram())
+        histogram.record(now_ns - received_ns)
+
+    def register_gauge(self, name, read_value):
+        """Report the value returned by read_value() (e.g. a queue depth)"""
+        with self._lock:
+            self._gauges[name] = read_value
+
+    def register_counters(self, name, read_counters):
+        """Report the counters returned by read_counters() as {event: count}"""
+        with self._lock:
+            self._counters[name] = read_counters
+
+    def register_device_states(self, read_counts):
+        """Report the number of devices in each state returned by read_counts() as {state: count}"""
+        self._device_states = read_counts
+
+    def device_states(self):
+        return self._device_states() if self._device_states else {}
+
+    def counters(self):
+        values = {}
+        for name, read_counters in list(self._counters.items()):
+            for event, count in read_counters().items():
+                values[f"{name}_{event}"] = count
+        return values
+
+    def gauges(self):
+        values = {}
+        for name, read_value in list(self._gauges.items()):
+            try:
+                values[name] = read_value()
+            except Exception:
+                values[name] = -1
+        return values
+
+    def stats(self):
+        """All measurements as a plain dict"""
+        devices = {}
+        for esp_name, meter in list(self._rates.items()):
+            devices[esp_name] = {
+                "messages": meter.total,
+                "rate_per_s": meter.rate(),
+                "latency": {stage: self._histograms[stage][esp_name].stats()
+                            for stage in STAGES if esp_name in self._histograms[stage]},
+            }
+        totals = {}
+        for stage in STAGES:
+            merged = Histogram()
+            for histogram in list(self._histograms[stage].values()):
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.total_ns += histogram.total_ns
+                merged.max_ns = max(merged.max_ns, histogram.max_ns)
+            totals[stage] = merged.stats()
+        return {
+            "uptime_s": time.monotonic() - self.started,
+            "messages": sum(d["messages"] for d in devices.values()),
+            "rate_per_s": sum(d["rate_per_s"] for d in devices.values()),
+            "latency": totals,
+            "queues": self.gauges(),
+            "device_states": self.device_states(),
+            "counters": self.counters(),
+            "devices": devices,
+        }
+
+    def summary_line(self):
+        """Short human-readable summary of the whole pipeline"""
+        stats = self.stats()
+        parts = [f"{len(stats['devices'])} devices",
+                 f"{stats['messages']} msgs",
+                 f"{stats['rate_per_s']:.1f} msg/s"]
+        for stage, latency in stats["latency"].items():
+            if latency["count"]:
+                parts.append(f"{stage} p50/p99 {latency['p50_ms']:.2f}/{latency['p99_ms']:.2f} ms")
+        parts.extend(f"{state}={count}" for state, count in stats["device_states"].items())
+        parts.extend(f"{name}={depth}" for name, depth in stats["queues"].items())
+        parts.extend(f"{name}={count}" for name, count in stats["counters"].items() if count)
+        return "Metrics: " + ", ".join(parts)
+
+    def prometheus_text(self):
+        """Measurements in the Prometheus text exposition format"""
+        lines = ["# HELP mosquito_latency_seconds Time from message reception (or command send) to a stage",
+                 "# TYPE mosquito_latency_seconds histogram"]
+        for stage in STAGES:
+            for esp_name, histogram in sorted(self._histograms[stage].items()):
+                labels = f'stage="{stage}",device="{label_value(esp_name)}"'
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKET_BOUNDS_NS, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'mosquito_latency_seconds_bucket{{{labels},le="{bound / 1e9:g}"}} {cumulative}')
+                lines.append(f'mosquito_latency_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"mosquito_latency_seconds_sum{{{labels}}} {histogram.total_ns / 1e9:.9f}")
+                lines.append(f"mosquito_latency_seconds_count{{{labels}}} {histogram.count}")
+        lines += ["# HELP mosquito_messages_total Messages received per device",
+                  "# TYPE mosquito_messages_total counter"]
+        rates = sorted(self._rates.items())
+        for esp_name, meter in rates:
+            lines.append(f'mosquito_messages_total{{device="{label_value(esp_name)}"}} {meter.total}')
+        lines += ["# HELP mosquito_message_rate Messages per second per device",
+                  "# TYPE mosquito_message_rate gauge"]
+        for esp_name, meter in rates:
+            lines.append(f'mosquito_message_rate{{device="{label_value(esp_name)}"}} {meter.rate():g}')
+        lines += ["# HELP mosquito_queue_depth Items waiting in an internal queue",
+                  "# TYPE mosquito_queue_depth gauge"]
+        for name, depth in sorted(self.gauges().items()):
+            lines.append(f'mosquito_queue_depth{{queue="{label_value(name)}"}} {depth}')
+        lines += ["# HELP mosquito_devices Devices in each liveness state",
+                  "# TYPE mosquito_devices gauge"]
+        for state, count in sorted(self.device_states().items()):
+            lines.append(f'mosquito_devices{{state="{label_value(state)}"}} {count}')
+        lines += ["# HELP mosquito_events_total Pipeline events (duplicates, gaps, ...)",
+                  "# TYPE mosquito_events_total counter"]
+        for name, count in sorted(self.counters().items()):
+            lines.append(f'mosquito_events_total{{event="{label_value(name)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(metrics, port, host=METRICS_HTTP_HOST):
+    """Serve Prometheus text on http://host:port/metrics from a daemon thread"""
+    # http.server is only imported when the endpoint is enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = self.server.metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Keep the console for the application's own output
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, name="MetricsHTTP", daemon=True).start()
+    print(f"Prometheus metrics on http://{host}:{port}/metrics")
+    return server
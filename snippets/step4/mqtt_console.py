@@ -0,0 +1,156 @@
+"""
+Step 4: Console interface
+CLI-only mode of the Step 4 interface (pyqt6_interface_with_logging.py --cli):
+the same MQTT core, per-device logs, liveness and commands as the GUI, driven
+from the terminal. Qt is never imported, so it starts quickly and runs on
+machines without a display.
+
+    ESP32_1 4           blink ESP32_1 four times
+    all 4               send to a group target, as in the GUI's Send to bar
+                        (all, group:<name>, ESP32_1*, mosquito/+/command)
+    list                devices with their state, last data and event rates
+    stats               metrics summary line
+    export              convert the logs to .xlsx
+    quit                (or Ctrl+D / Ctrl+C)
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import os
+import threading
+import time
+from command_batch import format_batch_summary
+from event_rates import format_rates
+from log_writer import LogWriter
+from mqtt_core import MQTTCore
+
+# Console Configuration
+EXPORT_EXCEL_ON_EXIT = True     # Convert each log to .xlsx when the console exits
+MAX_BLINKS = 20
+
+HELP = "Commands: <device or target> <blinks 1-20>, list, stats, export, quit"
+
+
+class ConsoleApp:
+    """MQTT core in a background thread, commands read from stdin"""
+
+    def __init__(self, shards=0):
+        self.log_writer = LogWriter()
+        # With shards, worker processes ingest the data; this core sends commands
+        self.core = MQTTCore(self.log_writer, ingest=not shards)
+        self.shards = None
+        if shards:
+            from ingest_shards import ShardCoordinator
+            self.shards = ShardCoordinator(self.core, shards)
+        self.core.status_callback = self.on_status
+        self.core.command_result_callback = self.on_command_result
+        self.core.liveness_callback = self.on_liveness
+
+    # ─── MQTT events (MQTT thread) ─────────────────────
+    def on_status(self, connected):
+        print(f"MQTT Status: {'Connected' if connected else 'Disconnected'}")
+
+    def on_command_result(self, esp_name, command, state, latency_ms):
+        if state == "completed":
+            print(f"{esp_name}: {command} done ({latency_ms:.0f} ms round trip)")
+        else:
+            print(f"{esp_name}: {command} {state}: no acknowledgement")
+
+    def on_liveness(self, esp_name, state, reason):
+        print(f"{esp_name}: {state} ({reason})")
+
+    # ─── Commands (main thread) ────────────────────────
+    def handle(self, line):
+        """Run one command line; returns False to quit"""
+        words = line.split()
+        if not words:
+            return True
+        if words[0] in ("quit", "exit"):
+            return False
+        if words[0] == "list":
+            self.list_devices()
+        elif words[0] == "stats":
+            print(self.core.metrics.summary_line())
+        elif words[0] == "export":
+            files = self.export_logs()
+            print("Exported:\n" + "\n".join(os.path.basename(f) for f in files) if files else "Nothing exported")
+        elif len(words) == 2 and words[1].isdigit() and 1 <= int(words[1]) <= MAX_BLINKS:
+            self.send(words[0], int(words[1]))
+        else:
+            print(HELP)
+        return True
+
+    def send(self, target, command):
+        esp_name = target.upper()
+        if esp_name in self.core.registry:
+            if not self.core.send_command(esp_name, command):
+                print(f"{esp_name}: failed to send command (not connected)")
+            return
+        batch = self.core.send_batch(target, command)
+        if batch.targets:
+            batch.add_done_callback(lambda b: print(format_batch_summary(b.summary())))
+        else:
+            print(f"No device matches {target}")
+
+    def list_devices(self):
+        names = self.core.registry.names()
+        if not names:
+            print("No ESP32 seen yet (waiting for mosquito/+/data)")
+        for esp_name in sorted(names):
+            update = self.core.coalescer.snapshot(esp_name)
+            state = self.core.liveness.state(esp_name) or "-"
+            data = update.last_data if update else "No data received"
+            seen = time.strftime("%H:%M:%S", time.localtime(update.received_at)) if update else ""
+            print(f"{esp_name:12} {state:8} {data:10} {seen:8}  {format_rates(self.event_rates(esp_name))}")
+
+    def event_rates(self, esp_name):
+        if self.shards:
+            return self.shards.event_rates(esp_name)
+        return self.core.rates.per_minute(esp_name)
+
+    def export_logs(self):
+        files = [logger.export_to_excel() for logger in list(self.core.loggers.values())]
+        if self.shards:
+            files += self.shards.export_logs()
+        return [f for f in files if f]
+
+    # ─── Lifecycle ─────────────────────────────────────
+    def run(self):
+        """Read commands until quit or end of input"""
+        self.log_writer.start()
+        if self.shards:
+            self.shards.start()
+        mqtt_thread = threading.Thread(target=self.core.run, name="MQTT", daemon=True)
+        mqtt_thread.start()
+        print(f"Logging to {os.path.abspath('logs')}\n{HELP}")
+        try:
+            while True:
+                try:
+                    line = input()
+                except EOFError:
+                    break
+                if not self.handle(line):
+                    break
+        except KeyboardInterrupt:
+            print()
+        print("Shutting down...")
+        self.core.stop()
+        mqtt_thread.join()
+        self.shutdown()
+
+    def shutdown(self):
+        """Drain the log writer, then convert the logs to Excel at the end of the session"""
+        if self.shards:
+            self.shards.stop(export=EXPORT_EXCEL_ON_EXIT)
+        loggers = self.core.close_logs()
+        self.log_writer.stop()
+        if EXPORT_EXCEL_ON_EXIT:
+            for logger in loggers:
+                if logger.entry_count:
+                    logger.export_to_excel()
+
+
+def run_console(shards=0):
+    """Run the console interface; returns its exit code"""
+    ConsoleApp(shards).run()
+    return 0
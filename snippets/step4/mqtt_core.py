@@ -0,0 +1,382 @@
+"""
+Step 4: MQTT core
+MQTT handling shared by the PyQt6 interface and the headless gateway:
+device discovery, per-device logging, coalesced latest values and commands.
+No Qt import; front ends are notified through plain callbacks.
+
+The MQTT connection runs on an asyncio event loop (async_mqtt.py). Commands
+from other threads are handed to the loop and published without waiting for
+the broker, so sending never blocks the caller or the receive path. A
+command can go to a whole group of devices in one pipelined burst
+(command_batch.py). Every command is tracked until the broker and, for
+blink commands, the device acknowledge it, with bounded retries
+(command_tracker.py).
+
+The connection is supervised: it is re-established with jittered backoff when
+the broker goes away, and the subscriptions are renewed on every connect. With
+a fixed MQTT_CLIENT_ID the session is persistent (clean_session=False), so the
+broker queues the devices' QoS 1 messages while the PC is away, also across a
+restart; ingest workers add their index to that id. Without one, the session
+is clean, so no run leaves an orphaned session queuing messages on the broker.
+Commands sent while offline wait in a bounded, persistent queue
+(outbound_queue.py) and are published in order after the reconnect.
+
+Payloads may be text or compact binary frames (wire_protocol.py); commands
+are sent to each device in the format it uses. Sequenced frames delivered
+twice by QoS 1 are dropped (sequence_window.py).
+
+Received events are counted per device and type over sliding and tumbling
+windows (event_rates.py); the front ends show the rates and each completed
+period is written to the device's log.
+
+Every device is expected to publish every ~1 s; a liveness monitor on the
+same timer wheel marks silent devices stale, then offline (liveness.py). The
+devices' MQTT Last Will (mosquito/<id>/status) marks them offline at once.
+Transitions go to the front ends, the device's log and the metrics.
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import asyncio
+import os
+import time
+import socket
+import threading
+from async_mqtt import AsyncMQTTClient
+from device_registry import STATUS_SUFFIX, DeviceRegistry
+from update_coalescer import UpdateCoalescer
+from mqtt_logger import Logger
+from metrics import Metrics, message_received_ns
+from wire_protocol import WireCodec
+from sequence_window import DuplicateFilter
+from command_batch import BATCH_TIMEOUT, CommandBatch, select_targets
+from command_tracker import BLINK_SECONDS, COMPLETED, CommandTracker, DEVICE_ACK_ENABLED
+from timer_wheel import TimerWheel
+from outbound_queue import OutboundQueue
+from event_rates import EVENT_NAMES, RATE_SLOT_SECONDS, EventRates
+from liveness import OFFLINE, ONLINE, LivenessMonitor
+
+# MQTT Configuration
+MQTT_BROKER = "localhost"  # Change to your MQTT broker address
+MQTT_PORT = 1883
+MQTT_CLIENT_ID = ""        # Fixed session name (one running instance per name); empty = clean session
+MQTT_CLEAN_SESSION = False # With MQTT_CLIENT_ID: False = the broker keeps queued messages across reconnects
+
+
+class MQTTCore:
+    """MQTT client that routes, logs and coalesces ESP32 messages"""
+
+    def __init__(self, log_writer, broker=MQTT_BROKER, port=MQTT_PORT, ingest=True,
+                 data_subscription=None, device_filter=None, log_suffix="", device_acks=DEVICE_ACK_ENABLED,
+                 offline_queue=True, liveness=True):
+        self.broker = broker
+        self.port = port
+        # A persistent session is only resumed under the same id: never keep one for a per-run name
+        if MQTT_CLIENT_ID:
+            client_id, clean_session = MQTT_CLIENT_ID + log_suffix, MQTT_CLEAN_SESSION
+        else:
+            client_id, clean_session = f"mosquito_pc_{socket.gethostname()}_{os.getpid()}{log_suffix}", True
+        self.client = AsyncMQTTClient(client_id, clean_session=clean_session)
+
+        # Sharded ingest (ingest_shards.py): the coordinator does not subscribe to data,
+        # each worker subscribes with its own filter and keeps only its devices
+        self.ingest = ingest
+        self.data_subscription = data_subscription
+        self.device_filter = device_filter      # device_filter(esp_name) -> True to handle it
+        self.log_suffix = log_suffix
+        self.device_acks = device_acks
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.connected = False
+        self.running = True
+        self.loop = None
+        self._stop_event = None
+
+        # Front-end hooks, called from the MQTT thread
+        self.status_callback = None     # status_callback(connected)
+        self.command_callback = None    # command_callback(esp_name, command)
+        self.command_result_callback = None  # command_result_callback(esp_name, command, state, latency_ms)
+        self.liveness_callback = None   # liveness_callback(esp_name, state, reason)
+
+        # Devices are discovered from a single wildcard subscription (mosquito/+/data)
+        self.registry = DeviceRegistry()
+
+        # Text or binary payloads, negotiated per device
+        self.codec = WireCodec()
+        self.dedup = DuplicateFilter()
+
+        # Latest value per device, pulled by the front end on a timer
+        self.coalescer = UpdateCoalescer()
+
+        # L1/L2/FP counts per device over sliding and tumbling windows
+        self.rates = EventRates()
+        self.rates.on_period = self._log_period_rates
+
+        # One logger per device, created on the device's first message
+        self.log_writer = log_writer
+        self.loggers = {}
+        self._loggers_lock = threading.Lock()
+
+        # Latency/throughput measurements and queue-depth gauges
+        self.metrics = Metrics()
+        self.log_writer.metrics = self.metrics
+        self.metrics.register_gauge("mqtt_receive", self.client.pending_messages)
+        self.metrics.register_gauge("log_writer", self.log_writer.pending)
+        self.metrics.register_gauge("gui_dirty_devices", self.coalescer.dirty_count)
+        self.metrics.register_counters("sequence", self.dedup.counters)
+        self.metrics.register_counters("events", self.rates.counters)
+
+        # Outstanding commands, with timeouts on a timer wheel
+        self.timers = TimerWheel()
+        self.tracker = CommandTracker(self.client.publish_message, self.timers, self.metrics)
+        self.tracker.on_result = self._on_command_result
+        self.tracker.on_retry = self._on_command_retry
+        self.metrics.register_gauge("pending_commands", self.tracker.outstanding)
+        self.metrics.register_counters("commands", self.tracker.counters)
+
+        # Online/stale/offline per device, with deadlines on the same wheel; ingest
+        # workers leave it to the coordinator, which sees every device
+        self.liveness = LivenessMonitor(self.timers) if liveness else None
+        if self.liveness is not None:
+            self.liveness.on_change = self._on_liveness_change
+            self.metrics.register_device_states(self.liveness.counts)
+            self.metrics.register_counters("liveness", self.liveness.counters)
+
+        # Commands sent while the broker is unreachable, published after the reconnect
+        self.outbound = OutboundQueue() if offline_queue else None
+        if self.outbound is not None:
+            self.tracker.can_send = lambda: self.connected
+            self.metrics.register_gauge("offline_commands", self.outbound.__len__)
+            self.metrics.register_counters("offline", self.outbound.counters)
+            self.outbound.on_expired = self._on_command_expired
+
+    def on_connect(self, rc):
+        if rc == 0:
+            self.connected = True
+            # One subscription covers every ESP32
+            if self.ingest:
+                topic = self.data_subscription or self.registry.data_wildcard
+                self.loop.create_task(self.client.subscribe(topic, qos=1))
+            if self.device_acks:
+                self.loop.create_task(self.client.subscribe(self.registry.ack_wildcard, qos=1))
+            if self.liveness is not None:
+                self.loop.create_task(self.client.subscribe(self.registry.status_wildcard, qos=1))
+            # After paho has re-sent the publishes that were in flight when the connection dropped
+            self.loop.call_soon(self._drain_outbound)
+        else:
+            self.connected = False
+        self._notify_status()
+
+    def on_message(self, msg):
+        received_ns = message_received_ns(msg)
+        topic = msg.topic
+
+        # Determine which ESP32 sent the message (registers new devices)
+        esp_name, _ = self.registry.lookup(topic)
+        if esp_name is None:
+            if topic.endswith(STATUS_SUFFIX):
+                self.on_device_status(topic, msg.payload)
+            else:
+                self.on_device_ack(topic, msg.payload)
+        elif self.device_filter is None or self.device_filter(esp_name):
+            decoded = self.codec.decode(esp_name, msg.payload)
+            if decoded is None or not self.dedup.accept(esp_name, decoded.seq, decoded.device_ms,
+                                                        received_ns // 1_000_000):
+                return
+            message = decoded.text
+            self.get_logger(esp_name).log_received_data(message, received_ns)
+            self.coalescer.update(esp_name, message, received_ns)
+            self.rates.add(esp_name, message, received_ns)
+            if self.liveness is not None:
+                self.liveness.seen(esp_name, received_ns / 1e9)
+            self.metrics.mark_received(esp_name)
+            self.metrics.record("dispatch", esp_name, received_ns)
+
+    def on_device_ack(self, topic, payload):
+        """A device reports a finished command on mosquito/<id>/ack"""
+        esp_name = self.registry.ack_device(topic)
+        if esp_name is None:
+            return
+        decoded = self.codec.decode(esp_name, payload)
+        if decoded is not None:
+            self.get_logger(esp_name).log_entry('Received', 'Ack', decoded.text, 'Ack from ESP32')
+            self.tracker.device_ack(esp_name, decoded.text)
+
+    def on_device_status(self, topic, payload):
+        """A device's retained status: "online" after it connects, "offline" from its Last Will"""
+        esp_name = self.registry.status_device(topic)
+        if esp_name is None or self.liveness is None:
+            return
+        status = payload.decode(errors="replace").strip().lower()
+        if status == OFFLINE:
+            self.liveness.report(esp_name, OFFLINE, "status offline (Last Will or clean exit)")
+        elif status == ONLINE:
+            self.liveness.seen(esp_name, reason="status online")
+
+    def devices_seen(self, esp_names):
+        """Traffic of devices handled by ingest workers (thread-safe)"""
+        if self.liveness is not None and self.loop:
+            self.loop.call_soon_threadsafe(self._devices_seen, esp_names)
+
+    def _devices_seen(self, esp_names):
+        for esp_name in esp_names:
+            self.liveness.seen(esp_name)
+
+    def _on_liveness_change(self, esp_name, old, state, reason):
+        """Log and report a device going online, stale or offline"""
+        if old is not None:
+            # The first sighting of a device is not a transition worth a log entry
+            self.get_logger(esp_name).log_entry('Status', 'Liveness', state, reason[:1].upper() + reason[1:])
+            if state == OFFLINE:
+                print(f"{esp_name} is offline ({reason})")
+        if self.liveness_callback:
+            self.liveness_callback(esp_name, state, reason)
+
+    def on_disconnect(self, rc):
+        self.connected = False
+        self._notify_status()
+
+    def _notify_status(self):
+        if self.status_callback:
+            self.status_callback(self.connected)
+
+    def get_logger(self, esp_name):
+        """Return the logger of a device, creating it on first use"""
+        logger = self.loggers.get(esp_name)
+        if logger is None:
+            with self._loggers_lock:
+                logger = self.loggers.get(esp_name)
+                if logger is None:
+                    logger = Logger(esp_name, self.log_writer, file_suffix=self.log_suffix)
+                    self.loggers[esp_name] = logger
+        return logger
+
+    def run(self):
+        """Run the event loop in the calling thread (blocks until stopped)"""
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """Connect to MQTT and process messages until stop() is called"""
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if not self.running:
+            return
+        connection = self.loop.create_task(self.client.stay_connected(self.broker, self.port, 60))
+        receiver = self.loop.create_task(self.receive_messages())
+        timers = self.loop.create_task(self.timers.run())
+        self.timers.schedule(RATE_SLOT_SECONDS, self._roll_rates)
+        await self._stop_event.wait()
+        connection.cancel()
+        receiver.cancel()
+        timers.cancel()
+        await self.client.disconnect()
+
+    async def receive_messages(self):
+        async for msg in self.client.messages():
+            self.on_message(msg)
+
+    def _roll_rates(self):
+        """Expire rate slots once per slot, so silent devices drop to zero"""
+        self.rates.roll(time.monotonic_ns())
+        self.timers.schedule(RATE_SLOT_SECONDS, self._roll_rates)
+
+    def _log_period_rates(self, esp_name, counts):
+        """Write the event counts of a completed tumbling period to the device's log"""
+        text = " ".join(f"{name}={count}" for name, count in zip(EVENT_NAMES, counts))
+        self.get_logger(esp_name).log_entry('Summary', 'Rates', text,
+                                            f'Events in {self.rates.period_seconds:g} s')
+
+    def send_command(self, esp_name, command):
+        """Queue a command for a specific ESP32 (thread-safe, does not block).
+        While offline the command waits in the outbound queue; returns False if it cannot be sent."""
+        topic = self.registry.command_topic(esp_name)
+        if not topic:
+            return False
+        if self.connected and self.loop:
+            self.loop.call_soon_threadsafe(self._publish_command, esp_name, topic, str(command))
+            return True
+        if self.outbound is None or not self.outbound.put(esp_name, command):
+            return False
+        print(f"MQTT offline: command {command} to {esp_name} queued ({len(self.outbound)} waiting)")
+        if self.loop:
+            # The connection may have come back since connected was read
+            self.loop.call_soon_threadsafe(self._drain_outbound)
+        return True
+
+    def _drain_outbound(self):
+        """Publish the commands queued while offline, oldest first"""
+        if not self.connected or self.outbound is None:
+            return
+        items = self.outbound.drain()
+        if items:
+            print(f"MQTT reconnected: sending {len(items)} queued command(s)")
+        for esp_name, command, _ in items:
+            self.registry.register(esp_name)
+            self._publish_command(esp_name, self.registry.command_topic(esp_name), command)
+
+    def _on_command_expired(self, esp_name, command, age):
+        """A command waited too long in the offline queue and is not sent"""
+        print(f"Command {command} to {esp_name} dropped: queued {age:.0f} s ago while offline")
+        self.get_logger(esp_name).log_entry('Dropped', 'Command', command, 'Expired in offline queue')
+
+    def _publish_command(self, esp_name, topic, command):
+        """Publish and track a command on the event loop, and log it.
+        Returns a future resolved with the mid on PUBACK, or None if the command fails."""
+        pending = self.tracker.send(esp_name, topic, command, self.codec.encode_command(esp_name, command))
+        if self.liveness is not None and command.isdigit():
+            # The device sends no data while it blinks
+            self.liveness.expect_quiet(esp_name, int(command) * BLINK_SECONDS)
+        self.get_logger(esp_name).log_sent_command(command)
+        if self.command_callback:
+            self.command_callback(esp_name, command)
+        return pending.delivered
+
+    def _on_command_retry(self, pending):
+        print(f"No acknowledgement for command {pending.command} to {pending.esp_name}, "
+              f"re-sending (attempt {pending.attempts + 1})")
+        pending.payload = self.codec.encode_command(pending.esp_name, pending.command)
+        self.get_logger(pending.esp_name).log_entry('Sent', 'Command', pending.command, 'Retry to ESP32')
+
+    def _on_command_result(self, pending):
+        if pending.state != COMPLETED:
+            print(f"Command {pending.command} to {pending.esp_name} failed after {pending.attempts} attempts")
+        if self.command_result_callback:
+            self.command_result_callback(pending.esp_name, pending.command, pending.state, pending.latency_ms)
+
+    def send_batch(self, target, command):
+        """Send a command to every device addressed by target (thread-safe, does not block).
+        Returns a CommandBatch that completes when every device has acknowledged or failed."""
+        targets = select_targets(target, self.registry.names(), self.registry.command_topic)
+        for esp_name in targets:
+            self.registry.register(esp_name)  # Group members may not have published yet
+        batch = CommandBatch(command, targets, target)
+        if self.connected and self.loop:
+            self.loop.call_soon_threadsafe(self._publish_batch, batch)
+        else:
+            batch.expire()
+        return batch
+
+    def _publish_batch(self, batch):
+        """Hand every publish of a batch to the socket at once; PUBACKs complete it"""
+        for esp_name in batch.targets:
+            batch.track(esp_name, self._publish_command(esp_name, self.registry.command_topic(esp_name),
+                                                        batch.command))
+        batch.mark_published()
+        if not batch.done:
+            self.loop.call_later(BATCH_TIMEOUT, batch.expire)
+
+    def stop(self):
+        """Stop the event loop, disconnecting from the broker"""
+        self.running = False
+        if self.loop and self._stop_event and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                pass  # Loop already finished
+
+    def close_logs(self):
+        """Close every log file; returns the loggers that were closed"""
+        loggers = list(self.loggers.values())
+        for logger in loggers:
+            logger.close()
+        return loggers
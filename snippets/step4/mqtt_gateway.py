@@ -0,0 +1,298 @@
+"""
+Step 4: Headless MQTT gateway
+Runs MQTT ingest, logging and command routing without any GUI (no Qt import).
+GUI clients attach over a local TCP socket using JSON Lines messages:
+
+    gateway -> client: {"type": "status", "connected": true}
+                       {"type": "update", "device": "ESP32_1", "data": "L1",
+                        "received_at": 1700000000.0, "count": 12,
+                        "log_file": "mqtt_log_ESP32_1_....csv", "log_entries": 13}
+                       {"type": "rates", "rates": {"ESP32_1": [12.0, 3.0, 0.0, 0.0]}}
+                                         (events/min of L1, L2, FP, other; every second)
+                       {"type": "liveness", "device": "ESP32_1", "state": "stale",
+                        "reason": "no data for 1.75 s"}           (online, stale or offline)
+                       {"type": "command_sent", "device": "ESP32_1", "command": "4"}
+                       {"type": "command_result", "device": "ESP32_1", "command": "4",
+                        "state": "completed", "latency_ms": 2104.5}
+                       {"type": "send_result", "device": "ESP32_1", "command": "4", "ok": true,
+                        "queued": false}
+                       {"type": "batch_result", "batch": 1, "target": "all", "command": "4",
+                        "devices": 20, "acknowledged": 20, "failed": [], ...}
+                       {"type": "export_result", "files": ["mqtt_log_ESP32_1_....xlsx"]}
+                       {"type": "stats_result", "stats": {...}}
+    client -> gateway: {"type": "send", "device": "ESP32_1", "command": "4"}
+                       {"type": "send_batch", "target": "group:rack_a", "command": "4"}
+                       {"type": "export"}
+                       {"type": "stats"}
+
+Usage:
+    python snippets/step4/mqtt_gateway.py --broker localhost --port 1883 [--metrics-port 9108] [--shards 4]
+    python snippets/step4/pyqt6_interface_with_logging.py --attach 127.0.0.1:8765
+"""
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from log_writer import LogWriter
+from metrics import METRICS_SUMMARY_INTERVAL, serve_metrics
+from ingest_shards import SHARD_MODE, ShardCoordinator
+from mqtt_core import MQTTCore, MQTT_BROKER, MQTT_PORT
+
+# Gateway Configuration
+GATEWAY_HOST = "127.0.0.1"      # Local clients only
+GATEWAY_PORT = 8765
+GATEWAY_PUSH_HZ = 20            # Coalesced device updates are pushed at most this often
+RATES_PUSH_INTERVAL = 1.0       # Seconds between two pushes of the event rates
+EXPORT_EXCEL_ON_EXIT = True     # Convert each log to .xlsx when the gateway stops
+
+
+def encode_message(message):
+    """One JSON Lines message as bytes"""
+    return (json.dumps(message) + "\n").encode()
+
+
+class GatewayClientHandler(socketserver.StreamRequestHandler):
+    """Serves one attached GUI client"""
+
+    def setup(self):
+        super().setup()
+        self.server.gateway.add_client(self.request)
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                print(f"Invalid request from {self.client_address}: {line!r}")
+                continue
+            self.server.gateway.handle_request(self.request, request)
+
+    def finish(self):
+        self.server.gateway.remove_client(self.request)
+        super().finish()
+
+
+class GatewayServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, gateway, address):
+        self.gateway = gateway
+        super().__init__(address, GatewayClientHandler)
+
+
+class Gateway:
+    """Headless gateway: MQTT core, log writer and local client socket"""
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT,
+                 listen_host=GATEWAY_HOST, listen_port=GATEWAY_PORT, push_hz=GATEWAY_PUSH_HZ,
+                 metrics_port=None, shards=0, shard_mode=SHARD_MODE):
+        self.log_writer = LogWriter()
+        # With shards, worker processes ingest the data; this core sends commands
+        self.core = MQTTCore(self.log_writer, broker, port, ingest=not shards)
+        self.shards = ShardCoordinator(self.core, shards, shard_mode) if shards else None
+        self.core.status_callback = self.on_status
+        self.core.command_callback = self.on_command_sent
+        self.core.command_result_callback = self.on_command_result
+        self.core.liveness_callback = self.on_liveness
+        self.push_interval = 1.0 / push_hz
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.mqtt_thread = None
+        self.server = GatewayServer(self, (listen_host, listen_port))
+        self._clients = {}      # socket -> send lock
+        self._clients_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    # ─── Clients ───────────────────────────────────────
+    def add_client(self, sock):
+        with self._clients_lock:
+            self._clients[sock] = threading.Lock()
+        print(f"GUI client attached: {sock.getpeername()}")
+        # Bring the new client up to date
+        self.send(sock, {"type": "status", "connected": self.core.connected})
+        for esp_name in self.core.registry.names():
+            update = self.core.coalescer.snapshot(esp_name)
+            if update:
+                self.send(sock, self.update_message(update))
+        for esp_name, state in self.core.liveness.states().items():
+            if state:
+                self.send(sock, {"type": "liveness", "device": esp_name, "state": state, "reason": ""})
+
+    def remove_client(self, sock):
+        with self._clients_lock:
+            self._clients.pop(sock, None)
+
+    def send(self, sock, message):
+        """Send a message to one client, dropping the client if it is gone"""
+        lock = self._clients.get(sock)
+        if lock is None:
+            return
+        try:
+            with lock:
+                sock.sendall(encode_message(message))
+        except OSError:
+            self.remove_client(sock)
+
+    def broadcast(self, message):
+        """Send a message to every attached client"""
+        with self._clients_lock:
+            clients = list(self._clients)
+        for sock in clients:
+            self.send(sock, message)
+
+    def handle_request(self, sock, request):
+        """Run a request coming from a client"""
+        request_type = request.get("type")
+        if request_type == "send":
+            esp_name = request.get("device", "")
+            command = str(request.get("command", ""))
+            ok = self.core.send_command(esp_name, command)
+            # queued: the broker is unreachable, the command is sent after the reconnect
+            self.send(sock, {"type": "send_result", "device": esp_name, "command": command, "ok": ok,
+                             "queued": ok and not self.core.connected})
+        elif request_type == "send_batch":
+            batch = self.core.send_batch(request.get("target", ""), str(request.get("command", "")))
+            batch.add_done_callback(lambda b: self.send(sock, {"type": "batch_result", **b.summary()}))
+        elif request_type == "export":
+            files = [os.path.basename(f) for f in self.export_logs() if f]
+            self.send(sock, {"type": "export_result", "files": files})
+        elif request_type == "stats":
+            self.send(sock, {"type": "stats_result", "stats": self.core.metrics.stats()})
+        else:
+            print(f"Unknown request type: {request_type}")
+
+    # ─── MQTT events ───────────────────────────────────
+    def on_status(self, connected):
+        print(f"MQTT Status: {'Connected' if connected else 'Disconnected'}")
+        self.broadcast({"type": "status", "connected": connected})
+
+    def on_command_sent(self, esp_name, command):
+        self.broadcast({"type": "command_sent", "device": esp_name, "command": command})
+
+    def on_command_result(self, esp_name, command, state, latency_ms):
+        self.broadcast({"type": "command_result", "device": esp_name, "command": command,
+                        "state": state, "latency_ms": latency_ms})
+
+    def on_liveness(self, esp_name, state, reason):
+        self.broadcast({"type": "liveness", "device": esp_name, "state": state, "reason": reason})
+
+    def update_message(self, update):
+        if self.shards:
+            log_file, log_entries = self.shards.log_status(update.esp_name)
+        else:
+            logger = self.core.get_logger(update.esp_name)
+            log_file, log_entries = os.path.basename(logger.log_file), logger.entry_count
+        return {
+            "type": "update",
+            "device": update.esp_name,
+            "data": update.last_data,
+            "received_at": update.received_at,
+            "count": update.message_count,
+            "log_file": log_file,
+            "log_entries": log_entries,
+        }
+
+    def push_updates(self):
+        """Send the devices that changed since the last push"""
+        for update in self.core.coalescer.take_dirty():
+            self.broadcast(self.update_message(update))
+    
+    def event_rates(self, esp_name):
+        if self.shards:
+            return self.shards.event_rates(esp_name)
+        return self.core.rates.per_minute(esp_name)
+    
+    def push_rates(self):
+        """Send the event rates of every device (they change without new messages)"""
+        names = self.core.registry.names()
+        if names:
+            self.broadcast({"type": "rates", "rates": {name: self.event_rates(name) for name in names}})
+
+    def export_logs(self):
+        """Convert every log to .xlsx and return the Excel file paths"""
+        files = [logger.export_to_excel() for logger in list(self.core.loggers.values())]
+        if self.shards:
+            files += self.shards.export_logs()
+        return files
+
+    # ─── Lifecycle ─────────────────────────────────────
+    def start(self):
+        self.log_writer.start()
+        if self.shards:
+            self.shards.start()
+        self.mqtt_thread = threading.Thread(target=self.core.run, name="MQTT", daemon=True)
+        self.mqtt_thread.start()
+        threading.Thread(target=self.server.serve_forever, name="GatewayServer", daemon=True).start()
+        host, port = self.server.server_address
+        print(f"Gateway listening for GUI clients on {host}:{port}")
+        if self.metrics_port:
+            self.metrics_server = serve_metrics(self.core.metrics, self.metrics_port)
+
+    def run_forever(self):
+        """Push coalesced updates and event rates (and print metrics summaries) until stop() is called"""
+        next_summary = time.monotonic() + METRICS_SUMMARY_INTERVAL
+        next_rates = time.monotonic()
+        while not self._stop_event.wait(self.push_interval):
+            self.push_updates()
+            if time.monotonic() >= next_rates:
+                self.push_rates()
+                next_rates += RATES_PUSH_INTERVAL
+            if METRICS_SUMMARY_INTERVAL and time.monotonic() >= next_summary:
+                print(self.core.metrics.summary_line())
+                next_summary += METRICS_SUMMARY_INTERVAL
+
+    def stop(self):
+        self._stop_event.set()
+        self.core.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        if self.shards:
+            self.shards.stop(export=EXPORT_EXCEL_ON_EXIT)
+        # Messages still being dispatched log into the sinks closed below
+        if self.mqtt_thread:
+            self.mqtt_thread.join()
+        loggers = self.core.close_logs()
+        self.log_writer.stop()
+        if EXPORT_EXCEL_ON_EXIT:
+            for logger in loggers:
+                if logger.entry_count:
+                    logger.export_to_excel()
+
+
+def main():
+    """Main function to start the headless gateway"""
+    parser = argparse.ArgumentParser(description="Headless ESP32 MQTT gateway")
+    parser.add_argument("--broker", default=MQTT_BROKER, help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=MQTT_PORT, help="MQTT broker port")
+    parser.add_argument("--listen-host", default=GATEWAY_HOST, help="Address for GUI clients")
+    parser.add_argument("--listen-port", type=int, default=GATEWAY_PORT, help="Port for GUI clients")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on 127.0.0.1:<port>/metrics")
+    parser.add_argument("--shards", type=int, default=0, help="Split message ingest over N worker processes")
+    parser.add_argument("--shard-mode", choices=("shared", "hash"), default=SHARD_MODE,
+                        help="shared: $share subscription balanced by the broker; hash: devices split by id, "
+                             "but every worker receives all the traffic")
+    args = parser.parse_args()
+
+    print("Starting headless MQTT gateway...")
+    gateway = Gateway(args.broker, args.port, args.listen_host, args.listen_port,
+                      metrics_port=args.metrics_port, shards=args.shards, shard_mode=args.shard_mode)
+    gateway.start()
+    try:
+        gateway.run_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        gateway.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Step 4: Per-device MQTT logger
+One Logger per ESP32. Entries are queued to the shared LogWriter thread and
+appended to a streaming log file, rotated into segments by log_rotation.py,
+or inserted into the SQLite store shared by every device (log_store.py);
+Excel copies are made on demand. Only the
+most recent entries stay in memory, in a bounded MessageHistory.
+No Qt import, so the logger is shared by the GUI and the headless gateway.
+"""
+
+import glob
+import os
+import time
+from datetime import datetime
+from log_rotation import RotatingSink, segment_store
+from log_sinks import TIMESTAMP_NS_FIELD
+from log_store import shared_store
+from message_history import MessageHistory, kind_code
+
+# Logging Configuration
+LOG_FORMAT = "csv"              # "csv", "jsonl", "binary" (for session_log.py) or "sqlite" (one database
+                                # for every device, see log_store.py)
+LOGS_DIR = "logs"
+
+class Logger:
+    """Streaming logger for MQTT communication (writes go through the shared LogWriter)"""
+    
+    def __init__(self, esp_name, log_writer, log_format=LOG_FORMAT, file_suffix=""):
+        self.esp_name = esp_name
+        self.log_writer = log_writer
+        self.log_format = log_format
+        self.file_suffix = file_suffix  # e.g. "_w1" for the log of ingest worker 1
+        self.logs_dir = os.path.abspath(LOGS_DIR)
+        self.sink = None
+        self.history = MessageHistory()
+        self._last_ns = 0               # Timestamp of the latest entry
+        self.setup_log_file()
+        
+    def setup_log_file(self):
+        """Create the rotating log (its first segment is opened now), or join the SQLite store"""
+        # Create logs directory if it doesn't exist
+        if not os.path.exists(self.logs_dir):
+            os.makedirs(self.logs_dir)
+            
+        if self.log_format == "sqlite":
+            self.sink = shared_store(self.logs_dir, self.file_suffix).attach(self.esp_name)
+            return
+        self.sink = RotatingSink(self.esp_name, self.log_format, self.new_segment_path,
+                                 segment_store(self.logs_dir, self.file_suffix))
+        
+    def new_segment_path(self):
+        """Path (without extension) of a new log segment"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.logs_dir, f"mqtt_log_{self.esp_name}_{timestamp}")
+        path = base + self.file_suffix
+        part = 1
+        while glob.glob(glob.escape(path) + ".*"):
+            # Rotated more than once in the same second
+            path = f"{base}_{part}{self.file_suffix}"
+            part += 1
+        return path
+        
+    @property
+    def log_file(self):
+        """Segment (or SQLite store) currently written to"""
+        return self.sink.path
+        
+    def log_received_data(self, data, received_ns=0):
+        """Log data received from ESP32"""
+        self.log_entry('Received', 'Data', data, 'Data from ESP32', received_ns)
+        
+    def log_sent_command(self, command):
+        """Log command sent to ESP32"""
+        self.log_entry('Sent', 'Command', command, 'Command to ESP32')
+        
+    def log_entry(self, direction, message_type, message, notes, received_ns=0):
+        """Add entry to the history and queue it for the log writer thread"""
+        # Never earlier than the previous entry, even if the clock is stepped back (NTP, manual
+        # change): binary segments are binary-searched and merged, which needs time order
+        timestamp_ns = self._last_ns = max(time.time_ns(), self._last_ns)
+        timestamp = datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        
+        entry = {
+            'Timestamp': timestamp,
+            'ESP32_Name': self.esp_name,
+            'Direction': direction,
+            'Message_Type': message_type,
+            'Message': message,
+            'Notes': notes,
+            TIMESTAMP_NS_FIELD: timestamp_ns
+        }
+        
+        self.history.append(timestamp_ns, kind_code(direction, message_type, notes), message)
+        self.log_writer.submit(self.sink, entry, received_ns)
+        
+    @property
+    def entry_count(self):
+        """Entries logged since the logger was created"""
+        return self.history.total
+        
+    def recent_entries(self, n):
+        """The newest n entries as (timestamp_ns, direction, message_type, message)"""
+        return self.history.last(n)
+        
+    def flush(self):
+        """Wait until every queued entry has been written to disk"""
+        self.log_writer.flush()
+            
+    def close(self):
+        """Flush and close the log file (in the log writer thread)"""
+        self.log_writer.close_sink(self.sink)
+            
+    def export_to_excel(self):
+        """Convert the device's log to one .xlsx and return the Excel file path"""
+        self.flush()
+        try:
+            return self.sink.export_to_excel()
+        except Exception as e:
+            print(f"Error exporting log file: {e}")
+            return None
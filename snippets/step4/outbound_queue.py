@@ -0,0 +1,130 @@
+"""
+Step 4: Offline outbound queue
+Commands sent while the broker is unreachable wait here instead of failing,
+and are published in order as soon as the connection is back. The queue is
+bounded (the oldest command is dropped when it is full) and mirrored to a
+JSON Lines file, so commands queued before the application was closed are
+sent on its next connection. Commands older than OUTBOUND_MAX_AGE are dropped
+instead of being sent (a blink requested yesterday is not wanted today).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from mqtt_logger import LOGS_DIR
+
+# Offline queue Configuration
+OUTBOUND_QUEUE_SIZE = 1000      # Commands kept while offline (0 = fail commands while offline)
+OUTBOUND_QUEUE_FILE = os.path.join(LOGS_DIR, "outbound_queue.jsonl")
+OUTBOUND_MAX_AGE = 300          # Seconds a queued command stays worth sending (0 = no limit)
+
+
+class OutboundQueue:
+    """Bounded FIFO of (esp_name, command, queued_at) mirrored to disk (thread-safe)"""
+
+    def __init__(self, path=OUTBOUND_QUEUE_FILE, maxlen=OUTBOUND_QUEUE_SIZE, max_age=OUTBOUND_MAX_AGE):
+        self.path = path
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self.queued = 0
+        self.drained = 0
+        self.dropped = 0
+        self.expired = 0
+        self.on_expired = None      # on_expired(esp_name, command, age) for each command dropped as too old
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Restore the commands left by a previous session"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                    self._items.append((item["device"], item["command"], item["queued_at"]))
+                except (ValueError, KeyError):
+                    continue  # Partial line from an interrupted write
+        while len(self._items) > self.maxlen:
+            self._items.popleft()
+            self.dropped += 1
+        if self._expire(time.time()):
+            self._rewrite()
+        if self._items:
+            print(f"{len(self._items)} queued command(s) restored from {self.path}")
+
+    def put(self, esp_name, command):
+        """Queue a command; returns False if offline queuing is disabled"""
+        if self.maxlen <= 0:
+            return False
+        item = (esp_name, str(command), time.time())
+        with self._lock:
+            self._items.append(item)
+            self.queued += 1
+            if len(self._items) > self.maxlen:
+                old_name, old_command, _ = self._items.popleft()
+                self.dropped += 1
+                print(f"Offline queue full, dropped command {old_command} to {old_name}")
+                self._rewrite()
+            else:
+                self._append(item)
+        return True
+
+    def drain(self):
+        """Remove and return every queued (esp_name, command, queued_at) that has not expired, oldest first"""
+        with self._lock:
+            expired = self._expire(time.time())
+            items = list(self._items)
+            if items or expired:
+                self._items.clear()
+                self._rewrite()
+                self.drained += len(items)
+        if self.on_expired:
+            for esp_name, command, age in expired:
+                self.on_expired(esp_name, command, age)
+        return items
+
+    def _expire(self, now):
+        """Drop the commands older than max_age; returns them as (esp_name, command, age)"""
+        expired = []
+        while self.max_age and self._items and now - self._items[0][2] > self.max_age:
+            esp_name, command, queued_at = self._items.popleft()
+            expired.append((esp_name, command, now - queued_at))
+        if expired:
+            self.expired += len(expired)
+            print(f"Offline queue: dropped {len(expired)} command(s) older than {self.max_age:g} s")
+        return expired
+
+    def _append(self, item):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(self._encode(item))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self):
+        """Replace the file with the current queue (atomically, so a crash keeps the old one)"""
+        if not self._items:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.writelines(self._encode(item) for item in self._items)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def _encode(item):
+        esp_name, command, queued_at = item
+        return json.dumps({"device": esp_name, "command": command, "queued_at": queued_at}) + "\n"
+
+    def __len__(self):
+        return len(self._items)
+
+    def counters(self):
+        return {"queued": self.queued, "drained": self.drained, "dropped": self.dropped, "expired": self.expired}
@@ -0,0 +1,119 @@
+"""
+Step 4: Duplicate suppression
+QoS 1 is "at least once": a message can reach the PC twice when a PUBACK is
+lost. Binary frames (wire_protocol.py) carry a 16-bit sequence number per
+device; a sliding window over the last SEQUENCE_WINDOW numbers tells new,
+duplicate and late (reordered) messages apart in O(1) time and memory per
+device, so each message is logged and acted upon once. A duplicate is an
+exact copy, so the device timestamp of each remembered number is kept too:
+a known number with another timestamp means the device restarted.
+
+A number too far behind the window is a stale redelivery (e.g. a QoS 1
+message the broker kept for a persistent session) and is dropped: resetting
+the window on it would let the next in-order frames through a second time.
+It is only taken for a restart when the device's uptime (device_ms) went
+backwards, i.e. is shorter than the time since its newest frame arrived: the
+device can only have booted after sending that frame.
+
+Text payloads have no sequence number and are always accepted: the simulator
+sends binary frames by default, and the Wokwi sketches need
+USE_BINARY_PROTOCOL (they stay on text for the Step 3 interface).
+"""
+
+import time
+
+# Dedup Configuration
+SEQUENCE_WINDOW = 64        # Sequence numbers remembered behind the newest one
+SEQUENCE_MODULO = 1 << 16   # Sequence numbers are uint16 and wrap around
+RESTART_TOLERANCE_MS = 1000 # Network jitter allowed when comparing uptime with time since the newest frame
+
+NEW = "new"
+DUPLICATE = "duplicate"
+REORDERED = "reordered"
+RESTARTED = "restarted"
+
+
+class SequenceWindow:
+    """Seen/unseen bitmask of the last SEQUENCE_WINDOW sequence numbers of one device"""
+
+    __slots__ = ("window", "highest", "mask", "device_ms", "highest_at")
+
+    def __init__(self, window=SEQUENCE_WINDOW):
+        self.window = window
+        self.highest = None                 # Newest sequence number seen
+        self.mask = 0                       # Bit i set = sequence number (highest - i) seen
+        self.device_ms = [None] * window    # Device timestamp of each number, by seq % window
+        self.highest_at = None              # Local time (ms) the newest number arrived
+
+    def check(self, seq, device_ms=None, now_ms=None):
+        """Classify seq and mark it seen; returns (NEW/DUPLICATE/REORDERED/RESTARTED, skipped).
+        now_ms is the local monotonic receive time in ms (default: now)."""
+        if now_ms is None:
+            now_ms = time.monotonic_ns() // 1_000_000
+        if self.highest is None:
+            return self._restart(seq, device_ms, now_ms, NEW)
+        delta = (seq - self.highest) % SEQUENCE_MODULO
+        if delta < SEQUENCE_MODULO // 2 and delta:
+            # Ahead of the newest: slide the window, the numbers in between were skipped
+            self.mask = ((self.mask << delta) | 1) & ((1 << self.window) - 1)
+            self.highest, self.highest_at = seq, now_ms
+            self.device_ms[seq % self.window] = device_ms
+            return NEW, delta - 1
+        behind = (SEQUENCE_MODULO - delta) % SEQUENCE_MODULO
+        if behind >= self.window:
+            if device_ms is not None and device_ms < now_ms - self.highest_at + RESTART_TOLERANCE_MS:
+                # Booted after the newest frame: the device restarted and counts from 0 again
+                return self._restart(seq, device_ms, now_ms, RESTARTED)
+            # Stale redelivery from before the window
+            return DUPLICATE, 0
+        bit = 1 << behind
+        if self.mask & bit:
+            if device_ms != self.device_ms[seq % self.window]:
+                return self._restart(seq, device_ms, now_ms, RESTARTED)
+            return DUPLICATE, 0
+        self.mask |= bit
+        self.device_ms[seq % self.window] = device_ms
+        return REORDERED, 0
+
+    def _restart(self, seq, device_ms, now_ms, result):
+        self.highest, self.mask, self.highest_at = seq, 1, now_ms
+        self.device_ms[seq % self.window] = device_ms
+        return result, 0
+
+
+class DuplicateFilter:
+    """Per-device sequence windows with duplicate, gap, reorder and restart counters"""
+
+    def __init__(self, window=SEQUENCE_WINDOW):
+        self.window = window
+        self.devices = {}       # esp_name -> SequenceWindow
+        self.duplicates = 0
+        self.gaps = 0           # Sequence numbers skipped (lost, or arriving late)
+        self.reorders = 0       # Late arrivals inside the window (each one filled a gap)
+        self.restarts = 0
+
+    def accept(self, esp_name, seq, device_ms=None, now_ms=None):
+        """True if the message is processed, False if it is a duplicate"""
+        if seq is None:
+            return True
+        sequence = self.devices.get(esp_name)
+        if sequence is None:
+            sequence = self.devices[esp_name] = SequenceWindow(self.window)
+        result, skipped = sequence.check(seq, device_ms, now_ms)
+        if result is DUPLICATE:
+            self.duplicates += 1
+            return False
+        if result is REORDERED:
+            self.reorders += 1
+        elif result is RESTARTED:
+            self.restarts += 1
+        self.gaps += skipped
+        return True
+
+    def counters(self):
+        return {"duplicates": self.duplicates, "gaps": self.gaps,
+                "reorders": self.reorders, "restarts": self.restarts}
+
+    def summary(self):
+        return (f"Sequence: {self.duplicates} duplicates dropped, {self.gaps} gaps, "
+                f"{self.reorders} reordered, {self.restarts} restarts")
@@ -0,0 +1,229 @@
+"""
+Step 4: Memory-mapped session log reader
+Opens binary logs (LOG_FORMAT = "binary", see log_sinks.py) without reading
+them: records and message heap are memory-mapped, so a multi-million-row
+session opens instantly and only the pages that are used are loaded.
+
+    with SessionLog("logs") as session:
+        session.devices()                                   # ['ESP32_1', 'ESP32_2']
+        for entry in session.entries("ESP32_1", start_ns, end_ns):
+            ...                                             # (timestamp_ns, direction, type, message, notes)
+        df = session.to_dataframe("ESP32_1")                # pandas, one row per entry
+
+Records are written in time order (the logger never lets a device's
+timestamps go backwards, even when the wall clock does), so seeking to a
+timestamp is a binary search (O(log n)) on the timestamp column, and a
+device/time window is a NumPy view of the mapped file (no copy). Message text
+is decoded only for the entries that are iterated; raw=True yields
+memoryviews into the heap instead.
+"""
+
+import glob
+import heapq
+import json
+import mmap
+import os
+from datetime import datetime
+import numpy as np
+from log_sinks import (BINARY_MAGIC, BINARY_VERSION, HEADER_PREFIX, HEADER_SIZE, HEAP_EXTENSION,
+                       BinaryLogSink, RECORD)
+
+# Reader Configuration
+ITER_CHUNK_ROWS = 65536     # Records converted to Python values at a time while iterating
+
+# Same layout as log_sinks.RECORD
+RECORD_DTYPE = np.dtype({"names": ["timestamp_ns", "offset", "length", "kind"],
+                         "formats": ["<i8", "<u8", "<u4", "<u2"],
+                         "offsets": [0, 8, 16, 20],
+                         "itemsize": RECORD.size})
+
+
+def _map(path):
+    """Read-only memory map of a file, or None if it is empty"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def format_timestamp(timestamp_ns):
+    """Log timestamp text, as written by the Logger"""
+    return datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+class DeviceLog:
+    """One memory-mapped binary log file (a snapshot of its size when opened)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._records_map = _map(path)
+        if self._records_map is None or len(self._records_map) < HEADER_SIZE:
+            raise ValueError(f"{path} is not a binary log (no header)")
+        magic, version, record_size = HEADER_PREFIX.unpack_from(self._records_map)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a version {BINARY_VERSION} binary log")
+        info = json.loads(self._records_map[HEADER_PREFIX.size:HEADER_SIZE].rstrip(b"\0"))
+        self.esp_name = info["device"]
+        self.kinds = [tuple(kind) for kind in info["kinds"]]
+
+        # A record written only partly (e.g. during a crash) is ignored
+        count = (len(self._records_map) - HEADER_SIZE) // RECORD.size
+        self.records = np.frombuffer(self._records_map, dtype=RECORD_DTYPE, count=count, offset=HEADER_SIZE)
+        self.timestamps_ns = self.records["timestamp_ns"]
+
+        self._heap_map = _map(path + HEAP_EXTENSION)
+        self._heap = memoryview(self._heap_map) if self._heap_map is not None else memoryview(b"")
+        # Records whose text did not reach the heap (crash between the two writes) are ignored
+        if count and int(self.records["offset"][-1]) + int(self.records["length"][-1]) > len(self._heap):
+            ends = self.records["offset"] + self.records["length"]
+            self.records = self.records[:np.searchsorted(ends, len(self._heap), side="right")]
+            self.timestamps_ns = self.records["timestamp_ns"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def seek(self, timestamp_ns):
+        """Index of the first entry at or after timestamp_ns (binary search)"""
+        return int(np.searchsorted(self.timestamps_ns, timestamp_ns, side="left"))
+
+    def bounds(self, start_ns=None, end_ns=None):
+        """Index range [first, last) of the entries with start_ns <= timestamp < end_ns"""
+        first = 0 if start_ns is None else self.seek(start_ns)
+        last = len(self.records) if end_ns is None else self.seek(end_ns)
+        return first, max(first, last)
+
+    def window(self, start_ns=None, end_ns=None):
+        """Records of a time window, as a NumPy view of the mapped file (no copy)"""
+        first, last = self.bounds(start_ns, end_ns)
+        return self.records[first:last]
+
+    def message(self, record, raw=False):
+        """Text of a record (a memoryview into the heap if raw)"""
+        offset = int(record["offset"])
+        data = self._heap[offset:offset + int(record["length"])]
+        return data if raw else str(data, "utf-8", "replace")
+
+    def entries(self, start_ns=None, end_ns=None, raw=False):
+        """Yield (timestamp_ns, direction, message_type, message, notes) in time order"""
+        first, last = self.bounds(start_ns, end_ns)
+        heap = self._heap
+        kinds = self.kinds
+        for chunk_start in range(first, last, ITER_CHUNK_ROWS):
+            chunk = self.records[chunk_start:min(last, chunk_start + ITER_CHUNK_ROWS)]
+            for timestamp_ns, offset, length, kind in zip(chunk["timestamp_ns"].tolist(), chunk["offset"].tolist(),
+                                                          chunk["length"].tolist(), chunk["kind"].tolist()):
+                data = heap[offset:offset + length]
+                direction, message_type, notes = kinds[kind]
+                yield (timestamp_ns, direction, message_type,
+                       data if raw else str(data, "utf-8", "replace"), notes)
+
+    def iter_dicts(self, start_ns=None, end_ns=None):
+        """Entries as dicts with the text log columns (for Excel export and replay)"""
+        for timestamp_ns, direction, message_type, message, notes in self.entries(start_ns, end_ns):
+            yield {'Timestamp': format_timestamp(timestamp_ns), 'ESP32_Name': self.esp_name,
+                   'Direction': direction, 'Message_Type': message_type, 'Message': message,
+                   'Notes': notes}
+
+    def to_dataframe(self, start_ns=None, end_ns=None, messages=True):
+        """pandas DataFrame of a time window (Timestamp in UTC); kind columns are categoricals"""
+        import pandas as pd
+
+        records = self.window(start_ns, end_ns)
+        kinds = records["kind"].astype(np.int16)
+        columns = {"Timestamp": pd.to_datetime(records["timestamp_ns"], unit="ns"),
+                   "ESP32_Name": pd.Categorical.from_codes(np.zeros(len(records), np.int8), [self.esp_name])}
+        for position, name in enumerate(("Direction", "Message_Type", "Notes")):
+            values = [kind[position] for kind in self.kinds]
+            categories = list(dict.fromkeys(values))
+            codes = np.array([categories.index(value) for value in values], dtype=np.int16)
+            columns[name] = pd.Categorical.from_codes(codes[kinds] if len(codes) else kinds, categories)
+        if messages:
+            heap = self._heap
+            columns["Message"] = [str(heap[offset:offset + length], "utf-8", "replace")
+                                  for offset, length in zip(records["offset"].tolist(), records["length"].tolist())]
+        return pd.DataFrame(columns)
+
+    def close(self):
+        self.records = self.timestamps_ns = None
+        self._heap.release()
+        for mapped in (self._records_map, self._heap_map):
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass  # Views handed out are still alive; the map is released with them
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionLog:
+    """Every binary log in a directory (or a list of files), grouped by device"""
+
+    def __init__(self, paths="logs"):
+        if isinstance(paths, str):
+            paths = ([paths] if os.path.isfile(paths)
+                     else sorted(glob.glob(os.path.join(paths, "*" + BinaryLogSink.extension))))
+        self.logs = []
+        for path in paths:
+            try:
+                self.logs.append(DeviceLog(path))
+            except ValueError as e:
+                print(f"Skipping {path}: {e}")
+
+    def devices(self):
+        """Names of the devices with a log, sorted"""
+        return sorted({log.esp_name for log in self.logs})
+
+    def device_logs(self, esp_name=None):
+        """Logs of one device (several with ingest workers or sessions), or of every device"""
+        return [log for log in self.logs if esp_name is None or log.esp_name == esp_name]
+
+    def __len__(self):
+        return sum(len(log) for log in self.logs)
+
+    def time_range(self, esp_name=None):
+        """(first, last) timestamp_ns of the entries, or None if there are none"""
+        logs = [log for log in self.device_logs(esp_name) if len(log)]
+        if not logs:
+            return None
+        return (min(int(log.timestamps_ns[0]) for log in logs),
+                max(int(log.timestamps_ns[-1]) for log in logs))
+
+    def count(self, esp_name=None, start_ns=None, end_ns=None):
+        """Entries in a device/time window, without touching the messages"""
+        total = 0
+        for log in self.device_logs(esp_name):
+            first, last = log.bounds(start_ns, end_ns)
+            total += last - first
+        return total
+
+    def entries(self, esp_name=None, start_ns=None, end_ns=None, raw=False):
+        """Yield (esp_name, timestamp_ns, direction, message_type, message, notes), merged in time order"""
+        streams = [((log.esp_name,) + entry for entry in log.entries(start_ns, end_ns, raw))
+                   for log in self.device_logs(esp_name)]
+        yield from heapq.merge(*streams, key=lambda entry: entry[1])
+
+    def to_dataframe(self, esp_name=None, start_ns=None, end_ns=None, messages=True):
+        """One pandas DataFrame for a device/time window, sorted by time"""
+        import pandas as pd
+
+        frames = [log.to_dataframe(start_ns, end_ns, messages) for log in self.device_logs(esp_name)]
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values("Timestamp", kind="stable", ignore_index=True) if len(frames) > 1 else df
+
+    def close(self):
+        for log in self.logs:
+            log.close()
+        self.logs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
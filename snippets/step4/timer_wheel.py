@@ -0,0 +1,87 @@
+"""
+Step 4: Timer wheel
+Hashed timing wheel for large numbers of timeouts (command acknowledgements,
+device liveness). Scheduling and cancelling are O(1); one periodic tick runs
+whatever expired, so thousands of outstanding timers cost one asyncio task
+instead of one loop callback each. Timers fire up to one tick late. A
+callback that raises is reported and does not stop the other timers.
+"""
+
+import asyncio
+import time
+
+# Timer wheel Configuration
+TIMER_TICK = 0.05           # Seconds per wheel slot (timer resolution)
+TIMER_SLOTS = 512           # Slots per revolution (512 x 50 ms = 25.6 s)
+
+
+class Timer:
+    """Handle of a scheduled callback"""
+
+    __slots__ = ("deadline_tick", "callback", "args", "cancelled")
+
+    def __init__(self, deadline_tick, callback, args):
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """Timers bucketed by deadline tick modulo the number of slots"""
+
+    def __init__(self, tick=TIMER_TICK, slots=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = self._tick_of(time.monotonic())
+        self.scheduled = 0
+
+    def _tick_of(self, now):
+        return int(now / self.tick)
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds; returns a Timer that can be cancelled"""
+        deadline_tick = max(self._tick_of(time.monotonic() + delay), self.current_tick + 1)
+        timer = Timer(deadline_tick, callback, args)
+        self.slots[deadline_tick % len(self.slots)].append(timer)
+        self.scheduled += 1
+        return timer
+
+    def advance(self, now=None):
+        """Run every timer due by now; returns how many fired"""
+        target_tick = self._tick_of(time.monotonic() if now is None else now)
+        fired = 0
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % len(self.slots)]
+            if not slot:
+                continue
+            due = [t for t in slot if t.deadline_tick <= self.current_tick]
+            if not due:
+                continue
+            # Timers of later revolutions stay in the slot
+            slot[:] = [t for t in slot if t.deadline_tick > self.current_tick]
+            for timer in due:
+                self.scheduled -= 1
+                if not timer.cancelled:
+                    fired += 1
+                    try:
+                        timer.callback(*timer.args)
+                    except Exception as e:
+                        # Command timeouts, liveness and rate rolls share the wheel
+                        name = getattr(timer.callback, "__qualname__", timer.callback)
+                        print(f"Error in timer callback {name}: {e!r}")
+        return fired
+
+    def __len__(self):
+        """Timers scheduled and not yet fired (cancelled ones included until their slot is reached)"""
+        return self.scheduled
+
+    async def run(self):
+        """Advance the wheel every tick until cancelled"""
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
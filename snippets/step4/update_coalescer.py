@@ -0,0 +1,61 @@
+"""
+Step 4: Coalesced device updates
+The MQTT thread records only the latest value of each device and marks it
+dirty; the GUI collects the dirty devices on a fixed-rate timer. However fast
+messages arrive, each device is repainted at most once per GUI refresh.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+# Copy of a device's latest state handed to the GUI
+# (received_ns is the monotonic receive time of last_data, 0 if unknown)
+DeviceUpdate = namedtuple("DeviceUpdate", ["esp_name", "last_data", "received_at", "message_count",
+                                           "received_ns"])
+
+
+class UpdateCoalescer:
+    """Latest-value snapshot per device with dirty flags"""
+
+    def __init__(self):
+        self._latest = {}       # esp_name -> [last_data, received_at, message_count, received_ns]
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def update(self, esp_name, data, received_ns=0):
+        """Record a new value for a device (called for every message)"""
+        now = time.time()
+        with self._lock:
+            state = self._latest.get(esp_name)
+            if state is None:
+                self._latest[esp_name] = [data, now, 1, received_ns]
+            else:
+                state[0] = data
+                state[1] = now
+                state[2] += 1
+                state[3] = received_ns
+            self._dirty.add(esp_name)
+
+    def store(self, update):
+        """Record a DeviceUpdate produced elsewhere (e.g. received from the gateway)"""
+        with self._lock:
+            self._latest[update.esp_name] = [update.last_data, update.received_at, update.message_count,
+                                             update.received_ns]
+            self._dirty.add(update.esp_name)
+
+    def take_dirty(self):
+        """Return a DeviceUpdate for every device changed since the last call"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return [DeviceUpdate(esp_name, *self._latest[esp_name]) for esp_name in dirty]
+
+    def dirty_count(self):
+        """Number of devices waiting to be repainted"""
+        return len(self._dirty)
+
+    def snapshot(self, esp_name):
+        """Latest DeviceUpdate of one device, or None"""
+        with self._lock:
+            state = self._latest.get(esp_name)
+            return DeviceUpdate(esp_name, *state) if state else None
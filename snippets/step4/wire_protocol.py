@@ -0,0 +1,144 @@
+"""
+Step 4: Compact binary wire protocol
+Optional alternative to the text payloads (L1/L2/FP, PRESSED/RELEASED, ON/OFF,
+blink counts). A frame is an 8-byte little-endian header, plus one argument
+byte for blink commands:
+
+    byte 0      magic/version   0xA0 | version (0xA1 = version 1)
+    byte 1      event code      see EVENT_CODES
+    bytes 2-3   sequence        uint16, incremented by the sender per frame
+    bytes 4-7   device time     uint32 milliseconds (millis() on the ESP32)
+    byte 8      argument        blink count (CMD_BLINK only)
+
+0xA0-0xAF can never start a UTF-8 string, so text and binary payloads are
+told apart per message. A device opts in by sending binary frames; from then
+on commands to it are sent in binary too (WIRE_FORMAT = "auto"). Decoded
+frames are turned into the same strings as the text protocol, so logging and
+display do not change.
+"""
+
+import struct
+import sys
+import time
+from collections import namedtuple
+
+# Wire format Configuration
+WIRE_FORMAT = "auto"        # "auto" = per device, "text" = always text, "binary" = always binary
+
+WIRE_VERSION = 1
+WIRE_MAGIC = 0xA0 | WIRE_VERSION
+HEADER = struct.Struct("<BBHI")
+HEADER_SIZE = HEADER.size
+
+# Event codes: telemetry from the ESP32 (0x01-0x3F), commands from the PC (0x40-0x7F)
+EVENT_CODES = {
+    "L1": 0x01,
+    "L2": 0x02,
+    "FP": 0x03,
+    "PRESSED": 0x04,
+    "RELEASED": 0x05,
+    "ON": 0x40,
+    "OFF": 0x41,
+}
+CMD_BLINK = 0x42
+MAX_BLINKS = 255
+
+# Event code -> text, as a flat table for the decoder
+EVENT_TEXT = [None] * 256
+for _text, _code in EVENT_CODES.items():
+    EVENT_TEXT[_code] = sys.intern(_text)
+
+# One decoded payload; seq and device_ms are None for text payloads
+WireMessage = namedtuple("WireMessage", ["text", "seq", "device_ms", "binary"])
+
+
+class WireError(ValueError):
+    """Malformed or unsupported binary frame"""
+
+
+def is_binary(payload):
+    return len(payload) > 0 and payload[0] & 0xF0 == 0xA0
+
+
+def decode_payload(payload):
+    """Decode a text or binary payload into a WireMessage"""
+    if not is_binary(payload):
+        return WireMessage(payload.decode(errors="replace"), None, None, False)
+    if payload[0] != WIRE_MAGIC:
+        raise WireError(f"Unsupported wire protocol version {payload[0] & 0x0F}")
+    if len(payload) < HEADER_SIZE:
+        raise WireError(f"Truncated frame ({len(payload)} bytes)")
+    _, event, seq, device_ms = HEADER.unpack_from(payload)
+    if event == CMD_BLINK:
+        if len(payload) <= HEADER_SIZE:
+            raise WireError("Blink command without a count")
+        text = str(payload[HEADER_SIZE])
+    else:
+        text = EVENT_TEXT[event]
+        if text is None:
+            raise WireError(f"Unknown event code 0x{event:02X}")
+    return WireMessage(text, seq, device_ms, True)
+
+
+def encode_frame(text, seq, device_ms):
+    """Binary frame for a text event or command; None when it has no binary form"""
+    text = str(text).strip().upper()
+    code = EVENT_CODES.get(text)
+    if code is not None:
+        return HEADER.pack(WIRE_MAGIC, code, seq & 0xFFFF, device_ms & 0xFFFFFFFF)
+    if text.isdigit() and 0 < int(text) <= MAX_BLINKS:
+        return HEADER.pack(WIRE_MAGIC, CMD_BLINK, seq & 0xFFFF, device_ms & 0xFFFFFFFF) + bytes([int(text)])
+    return None
+
+
+class WireCodec:
+    """Per-device wire format negotiation: a device is sent binary once it sends binary"""
+
+    def __init__(self, wire_format=WIRE_FORMAT):
+        if wire_format not in ("auto", "text", "binary"):
+            raise ValueError(f"Unknown wire format: {wire_format}")
+        self.wire_format = wire_format
+        self.binary_devices = set()
+        self._command_seq = {}
+        self.text_messages = 0
+        self.binary_messages = 0
+        self.bytes_received = 0
+        self.errors = 0
+
+    def decode(self, esp_name, payload):
+        """Decode a payload from a device; returns None (and counts an error) if malformed"""
+        self.bytes_received += len(payload)
+        try:
+            message = decode_payload(payload)
+        except WireError as e:
+            self.errors += 1
+            print(f"Bad frame from {esp_name}: {e}")
+            return None
+        if message.binary:
+            self.binary_messages += 1
+            if esp_name not in self.binary_devices:
+                self.binary_devices.add(esp_name)
+                print(f"{esp_name} uses the binary wire protocol")
+        else:
+            self.text_messages += 1
+        return message
+
+    def uses_binary(self, esp_name):
+        if self.wire_format == "auto":
+            return esp_name in self.binary_devices
+        return self.wire_format == "binary"
+
+    def encode_command(self, esp_name, command):
+        """Payload of a command in the device's format (text if it has no binary form)"""
+        if self.uses_binary(esp_name):
+            seq = self._command_seq.get(esp_name, 0)
+            frame = encode_frame(command, seq, time.monotonic_ns() // 1_000_000)
+            if frame is not None:
+                self._command_seq[esp_name] = (seq + 1) & 0xFFFF
+                return frame
+        return str(command)
+
+    def summary(self):
+        return (f"Wire: {self.text_messages} text, {self.binary_messages} binary, "
+                f"{self.bytes_received} bytes, {self.errors} errors, "
+                f"{len(self.binary_devices)} binary devices")
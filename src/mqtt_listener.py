@@ -1,85 +1,109 @@
 """
 Step 1: Python MQTT Listener (1-way communication)
-Listens to MQTT channels from 2 ESP32 devices
+Listens to MQTT channels from every ESP32 device (one wildcard subscription)
 Uses Paho MQTT client with QoS 1 (at least once)
 Note: QoS 2 is supported by paho-mqtt but NOT by PubSubClient on ESP32.
       Effective QoS is the minimum of publisher and subscriber, so QoS 1 is used.
+Reconnects on its own when the broker goes away (clean session, renewed subscription).
 """
 
 import paho.mqtt.client as mqtt
+import os
+import socket
 import time
 
 # MQTT Configuration
 MQTT_BROKER = "test.mosquitto.org"  # Public broker for initial integration tests
 MQTT_PORT = 1883
 MQTT_NAMESPACE = "udem/pfh3221/mosquito"
-MQTT_TOPICS = {
-    "ESP32_1": f"{MQTT_NAMESPACE}/esp32_1/data",
-    "ESP32_2": f"{MQTT_NAMESPACE}/esp32_2/data"
-}
+MQTT_DATA_TOPIC = f"{MQTT_NAMESPACE}/+/data"  # Matches <namespace>/<esp32_name>/data
+MQTT_CLIENT_ID = f"mosquito_listener_{socket.gethostname()}_{os.getpid()}"
+RECONNECT_MIN_DELAY = 1    # Seconds before the first reconnect attempt (doubles up to the max)
+RECONNECT_MAX_DELAY = 60
 
-# Variables to store data from ESP32s
-ESPtoPC1 = ""
-ESPtoPC2 = ""
+# ESP32 name per data topic, filled as devices are discovered
+DEVICE_TOPICS = {}
+
+# Latest data from each ESP32, keyed by ESP32 name (ESPtoPC["ESP32_1"], ...)
+ESPtoPC = {}
+
+def device_name(topic):
+    """Return the ESP32 name for a data topic, registering new devices on first use"""
+    esp_name = DEVICE_TOPICS.get(topic)
+    if esp_name is None:
+        parts = topic.split("/")
+        if len(parts) < 2 or parts[-1] != "data" or not parts[-2]:
+            return None
+        esp_name = parts[-2].upper()
+        DEVICE_TOPICS[topic] = esp_name
+        print(f"New ESP32 discovered: {esp_name}")
+    return esp_name
 
 def on_connect(client, userdata, flags, rc):
     """Callback for when the client receives a CONNACK response from the server."""
     if rc == 0:
         print("Connected to MQTT Broker!")
-        # Subscribe to both ESP32 topics with QoS 1
-        for esp_name, topic in MQTT_TOPICS.items():
-            client.subscribe(topic, qos=1)
-            print(f"Subscribed to {topic}")
+        # Subscribe to every ESP32 topic with QoS 1
+        client.subscribe(MQTT_DATA_TOPIC, qos=1)
+        print(f"Subscribed to {MQTT_DATA_TOPIC}")
     else:
         print(f"Failed to connect, return code {rc}")
 
+def on_connect_fail(client, userdata):
+    """Callback for when the broker cannot be reached (paho retries with backoff)."""
+    print("Could not connect to MQTT Broker, retrying...")
+
 def on_message(client, userdata, msg):
     """Callback for when a PUBLISH message is received from the server."""
-    global ESPtoPC1, ESPtoPC2
-    
     topic = msg.topic
-    message = msg.payload.decode()
+    message = msg.payload.decode(errors="replace")
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
     
     print(f"[{timestamp}] Received from {topic}: {message}")
     
-    # Store message in appropriate variable based on topic
-    if topic == MQTT_TOPICS["ESP32_1"]:
-        ESPtoPC1 = message
-        print(f"ESPtoPC1 updated: {ESPtoPC1}")
-    elif topic == MQTT_TOPICS["ESP32_2"]:
-        ESPtoPC2 = message
-        print(f"ESPtoPC2 updated: {ESPtoPC2}")
+    # Store message for the ESP32 that sent it
+    esp_name = device_name(topic)
+    if esp_name is not None:
+        ESPtoPC[esp_name] = message
+        print(f"ESPtoPC[{esp_name}] updated: {message}")
 
 def on_disconnect(client, userdata, rc):
     """Callback for when the client disconnects from the server."""
-    print("Disconnected from MQTT Broker")
+    if rc == 0:
+        print("Disconnected from MQTT Broker")
+    else:
+        print(f"Connection to MQTT Broker lost (rc {rc}), reconnecting...")
 
 def main():
     """Main function to start MQTT listener"""
     print("Starting MQTT Listener for ESP32 devices...")
     
-    # Create MQTT client
-    client = mqtt.Client()
+    # Create MQTT client; clean session: the per-run id would leave an orphaned session on the public broker
+    client = mqtt.Client(MQTT_CLIENT_ID, clean_session=True)
+    client.reconnect_delay_set(RECONNECT_MIN_DELAY, RECONNECT_MAX_DELAY)
     
     # Set callbacks
     client.on_connect = on_connect
+    client.on_connect_fail = on_connect_fail
     client.on_message = on_message
     client.on_disconnect = on_disconnect
     
-    try:
-        # Connect to broker
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        
-        # Start the loop
-        print("Listening for messages... Press Ctrl+C to exit")
-        client.loop_forever()
-        
-    except KeyboardInterrupt:
-        print("\nShutting down...")
-        client.disconnect()
-    except Exception as e:
-        print(f"Error: {e}")
+    # Connect in the loop, so a broker that is down at start-up is retried too
+    client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+    print("Listening for messages... Press Ctrl+C to exit")
+    
+    while True:
+        try:
+            # Reconnects with backoff whenever the connection drops
+            client.loop_forever(retry_first_connection=True)
+            break
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+            client.disconnect()
+            break
+        except Exception as e:
+            print(f"Error: {e}, restarting the MQTT loop")
+            time.sleep(RECONNECT_MIN_DELAY)
 
 if __name__ == "__main__":
     main()
@@ -1,161 +1,242 @@
 """
 Step 2: Python MQTT Bidirectional Communication
-Listens to and sends MQTT messages to 2 ESP32 devices
+Listens to and sends MQTT messages to every ESP32 device (discovered automatically)
 Implements both ESPtoPC and PCtoESP communication
+MQTT runs on an asyncio event loop (async_mqtt.py). Automatic switch replies
+are decided by a rule engine (switch_rules.py) and published from an outbound
+queue, so the receive path never waits on the network
+Payloads may be text or compact binary frames (wire_protocol.py); commands are
+sent to each ESP32 in the format it uses; sequenced frames delivered twice by
+QoS 1 are dropped before they can re-trigger the auto-responder (sequence_window.py)
+async_mqtt.py, wire_protocol.py, sequence_window.py and command_batch.py are
+imported from snippets/step4, so both steps run the same code
+The connection is re-established with backoff when the broker goes away, with a
+clean session (subscriptions are renewed on every connect, and no session is
+left behind on the public broker); commands typed while offline are kept (up to
+OFFLINE_QUEUE_SIZE) and sent after the reconnect. This queue is paho's own
+in-memory queue: unlike Step 4 (outbound_queue.py), it is not saved to disk,
+so commands still waiting when the program exits are lost
 
 Note: QoS 2 is supported by paho-mqtt but NOT by PubSubClient on ESP32.
       Effective QoS is the minimum of publisher and subscriber, so QoS 1 is used.
 """
 
-import paho.mqtt.client as mqtt
+import asyncio
+import os
+import socket
+import sys
 import time
-import threading
+from switch_rules import SwitchRuleEngine
+
+# The asyncio MQTT client, wire protocol, dedup and group commands live with the Step 4 code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "snippets", "step4"))
+from async_mqtt import AsyncMQTTClient, MQTTError  # noqa: E402
+from wire_protocol import WireCodec  # noqa: E402
+from sequence_window import DuplicateFilter  # noqa: E402
+from command_batch import BATCH_TIMEOUT, CommandBatch, format_batch_summary, select_targets  # noqa: E402
 
 # MQTT Configuration
 MQTT_BROKER = "test.mosquitto.org"  # Public broker for initial integration tests
 MQTT_PORT = 1883
 MQTT_NAMESPACE = "udem/pfh3221/mosquito"
+MQTT_CLIENT_ID = f"mosquito_step2_{socket.gethostname()}_{os.getpid()}"
+MQTT_CLEAN_SESSION = True   # Per-run id: a persistent session would never be resumed
+OFFLINE_QUEUE_SIZE = 1000   # Commands paho keeps in memory (including unacknowledged ones) while offline
+COMMAND_TIMEOUT = 10.0      # Seconds the CLI waits for the PUBACK of a command
 
 # Auto round-trip behavior: switch state from ESP triggers a command back to ESP
 AUTO_TRIGGER_FROM_SWITCH = True
 AUTO_LED_ON_COMMAND = "ON"
 AUTO_LED_OFF_COMMAND = "OFF"
 
-# MQTT Topics
-LISTEN_TOPICS = {
-    "ESP32_1": f"{MQTT_NAMESPACE}/esp32_1/data",
-    "ESP32_2": f"{MQTT_NAMESPACE}/esp32_2/data"
-}
+# MQTT Topics: one wildcard subscription, devices are discovered on their first message
+LISTEN_TOPIC = f"{MQTT_NAMESPACE}/+/data"
+
+# Topic lookup tables, filled as devices are discovered
+LISTEN_TOPICS = {}  # data topic -> ESP32 name
+SEND_TOPICS = {}    # ESP32 name -> command topic
 
-SEND_TOPICS = {
-    "ESP32_1": f"{MQTT_NAMESPACE}/esp32_1/command",
-    "ESP32_2": f"{MQTT_NAMESPACE}/esp32_2/command"
-}
+# Latest data from each ESP32, keyed by ESP32 name
+# (written only by the event loop; the CLI thread reads snapshots of it)
+ESPtoPC = {}
 
-# Variables to store data from ESP32s (with thread lock)
-_data_lock = threading.Lock()
-ESPtoPC1 = ""
-ESPtoPC2 = ""
+def register_device(esp_name):
+    """Add the topics of an ESP32 to the lookup tables"""
+    device_id = esp_name.lower()
+    LISTEN_TOPICS[f"{MQTT_NAMESPACE}/{device_id}/data"] = esp_name
+    SEND_TOPICS[esp_name] = f"{MQTT_NAMESPACE}/{device_id}/command"
+
+def device_name(topic):
+    """Return the ESP32 name for a data topic, registering new devices on first use"""
+    esp_name = LISTEN_TOPICS.get(topic)
+    if esp_name is None:
+        parts = topic.split("/")
+        if len(parts) < 2 or parts[-1] != "data" or not parts[-2]:
+            return None
+        esp_name = parts[-2].upper()
+        register_device(esp_name)
+        print(f"New ESP32 discovered: {esp_name}")
+    return esp_name
 
 class MQTTManager:
     def __init__(self):
-        self.client = mqtt.Client()
+        self.client = AsyncMQTTClient(MQTT_CLIENT_ID, clean_session=MQTT_CLEAN_SESSION)
+        self.client.client.max_queued_messages_set(OFFLINE_QUEUE_SIZE)
         self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
         self.client.on_disconnect = self.on_disconnect
         self.connected = False
-        self.last_switch_state = {"ESP32_1": "RELEASED", "ESP32_2": "RELEASED"}
+        self.loop = None
+        self.codec = WireCodec()
+        self.dedup = DuplicateFilter()
+        self.rules = SwitchRuleEngine(AUTO_LED_ON_COMMAND, AUTO_LED_OFF_COMMAND,
+                                      enabled=AUTO_TRIGGER_FROM_SWITCH)
 
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, rc):
         """Callback for when the client receives a CONNACK response from the server."""
         if rc == 0:
             print("Connected to MQTT Broker!")
             self.connected = True
-            # Subscribe to both ESP32 topics with QoS 1
-            for esp_name, topic in LISTEN_TOPICS.items():
-                client.subscribe(topic, qos=1)
-                print(f"Subscribed to {topic}")
+            # Subscribe to every ESP32 topic with QoS 1
+            self.loop.create_task(self.client.subscribe(LISTEN_TOPIC, qos=1))
+            print(f"Subscribed to {LISTEN_TOPIC}")
         else:
             print(f"Failed to connect, return code {rc}")
             self.connected = False
 
-    def on_message(self, client, userdata, msg):
-        """Callback for when a PUBLISH message is received from the server."""
-        global ESPtoPC1, ESPtoPC2
-        
+    def on_message(self, msg):
+        """Handle a PUBLISH message received from the server."""
+        received_ns = time.monotonic_ns()
         topic = msg.topic
-        message = msg.payload.decode()
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        print(f"[{timestamp}] Received from {topic}: {message}")
         
-        # Store message in appropriate variable based on topic
-        with _data_lock:
-            if topic == LISTEN_TOPICS["ESP32_1"]:
-                ESPtoPC1 = message
-                print(f"ESPtoPC1 updated: {ESPtoPC1}")
-                self.handle_switch_round_trip("ESP32_1", message)
-            elif topic == LISTEN_TOPICS["ESP32_2"]:
-                ESPtoPC2 = message
-                print(f"ESPtoPC2 updated: {ESPtoPC2}")
-                self.handle_switch_round_trip("ESP32_2", message)
-
-    def handle_switch_round_trip(self, esp_name, message):
-        """Send command back when switch state is reported by ESP32."""
-        if not AUTO_TRIGGER_FROM_SWITCH:
+        # Store message for the ESP32 that sent it
+        esp_name = device_name(topic)
+        if esp_name is None:
             return
-
-        normalized = message.strip().upper()
-        if normalized not in ("PRESSED", "RELEASED"):
+        decoded = self.codec.decode(esp_name, msg.payload)
+        if decoded is None:
             return
+        message = decoded.text
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if not self.dedup.accept(esp_name, decoded.seq, decoded.device_ms):
+            print(f"[{timestamp}] Duplicate from {topic} ignored (seq {decoded.seq})")
+            return
+        print(f"[{timestamp}] Received from {topic}: {message}")
+        ESPtoPC[esp_name] = message
+        print(f"ESPtoPC[{esp_name}] updated: {message}")
+        
+        # Switch round trip: the rule engine queues the reply, the sender task publishes it
+        command = self.rules.process(esp_name, message, received_ns)
+        if command is not None:
+            print(f"Switch {message.strip().upper()} on {esp_name}, queued LED command: {command}")
 
-        previous = self.last_switch_state.get(esp_name, "RELEASED")
-        self.last_switch_state[esp_name] = normalized
-
-        # Trigger only on state changes to avoid repeated commands from periodic status updates.
-        if previous != normalized:
-            if normalized == "PRESSED":
-                print(f"Switch PRESSED on {esp_name}, sending LED command: {AUTO_LED_ON_COMMAND}")
-                self.send_command_to_esp32(esp_name, AUTO_LED_ON_COMMAND)
-            else:
-                print(f"Switch RELEASED on {esp_name}, sending LED command: {AUTO_LED_OFF_COMMAND}")
-                self.send_command_to_esp32(esp_name, AUTO_LED_OFF_COMMAND)
-
-    def on_disconnect(self, client, userdata, rc):
+    def on_disconnect(self, rc):
         """Callback for when the client disconnects from the server."""
         print("Disconnected from MQTT Broker")
         self.connected = False
 
-    def connect(self):
-        """Connect to MQTT broker"""
+    async def connect(self):
+        """Connect to MQTT broker, reconnecting with backoff whenever the connection drops (runs until cancelled)"""
+        self.loop = asyncio.get_running_loop()
+        await self.client.stay_connected(MQTT_BROKER, MQTT_PORT, 60)
+
+    async def run(self):
+        """Handle received messages (and publish automatic replies) until cancelled"""
+        sender = asyncio.create_task(self.rules.run_sender(self.publish_command))
         try:
-            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            self.client.loop_start()
-            return True
-        except Exception as e:
-            print(f"Connection error: {e}")
-            return False
+            async for msg in self.client.messages():
+                self.on_message(msg)
+        finally:
+            sender.cancel()
+
+    def publish_command(self, esp_name, command):
+        """Hand a command to the socket without waiting; returns a future resolved on PUBACK"""
+        if esp_name not in SEND_TOPICS:
+            register_device(esp_name)
+        topic = SEND_TOPICS[esp_name]
+        future = self.client.publish_nowait(topic, self.codec.encode_command(esp_name, command), qos=1)
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[{timestamp}] Sent to {esp_name} ({topic}): {command}")
+        return future
 
-    def disconnect(self):
+    async def disconnect(self):
         """Disconnect from MQTT broker"""
-        self.client.loop_stop()
-        self.client.disconnect()
+        await self.client.disconnect()
 
-    def send_command_to_esp32(self, esp_name, command):
-        """Send command to specific ESP32"""
-        if not self.connected:
-            print("Not connected to MQTT broker")
-            return False
-        
+    async def send_command_to_esp32(self, esp_name, command):
+        """Send command to specific ESP32 and wait for the broker's acknowledgement"""
         if esp_name not in SEND_TOPICS:
-            print(f"Unknown ESP32: {esp_name}")
-            return False
+            # Commands may be sent before the ESP32 has published anything
+            register_device(esp_name)
         
         topic = SEND_TOPICS[esp_name]
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
         
+        # Publish with QoS 1 (at least once); paho keeps it until the broker acknowledges it
+        future = self.client.publish_nowait(topic, self.codec.encode_command(esp_name, command), qos=1)
+        if not self.connected and not future.done():
+            print(f"[{timestamp}] Not connected, command for {esp_name} queued until the broker is back: {command}")
+            return True
         try:
-            # Publish with QoS 1 (at least once)
-            result = self.client.publish(topic, str(command), qos=1)
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"[{timestamp}] Sent to {esp_name} ({topic}): {command}")
-                return True
-            else:
-                print(f"Failed to send command to {esp_name}")
-                return False
-        except Exception as e:
-            print(f"Error sending command: {e}")
+            await asyncio.wait_for(asyncio.shield(future), COMMAND_TIMEOUT)
+            print(f"[{timestamp}] Sent to {esp_name} ({topic}): {command}")
+            return True
+        except asyncio.TimeoutError:
+            print(f"[{timestamp}] No acknowledgement yet for {command} to {esp_name}, it will be re-sent after a reconnect")
+            return False
+        except MQTTError as e:
+            print(f"Failed to send command to {esp_name}: {e}")
             return False
 
+    async def send_command_to_group(self, target, command):
+        """Send a command to every ESP32 matched by target in one burst and wait for the PUBACKs"""
+        targets = select_targets(target, list(SEND_TOPICS), SEND_TOPICS.get)
+        batch = CommandBatch(command, targets, target)
+        futures = []
+        for esp_name in batch.targets:
+            try:
+                future = self.publish_command(esp_name, command)
+            except MQTTError as e:
+                print(f"Failed to send command to {esp_name}: {e}")
+                batch.set_result(esp_name, False)
+                continue
+            batch.track(esp_name, future)
+            futures.append(future)
+        batch.mark_published()
+        if futures:
+            await asyncio.wait(futures, timeout=BATCH_TIMEOUT)
+        batch.expire()
+        return batch
+
+    def send_command(self, esp_name, command):
+        """Send a command from another thread (e.g. the CLI) and wait for the result"""
+        future = asyncio.run_coroutine_threadsafe(self.send_command_to_esp32(esp_name, command), self.loop)
+        return future.result()
+
+    def send_group_command(self, target, command):
+        """Send a group command from another thread (e.g. the CLI) and wait for the CommandBatch"""
+        future = asyncio.run_coroutine_threadsafe(self.send_command_to_group(target, command), self.loop)
+        return future.result()
+
+def is_group_target(token):
+    """'all', 'group:<name>', a name pattern or a topic filter address several ESP32s"""
+    return token in ("all", "*") or token.startswith("group:") or any(c in token for c in "*?[/+")
+
+def parse_device(token):
+    """Accept '3' or 'esp32_3' and return the ESP32 name ('ESP32_3')"""
+    if token.isdigit():
+        return f"ESP32_{token}"
+    return token.upper()
+
 def user_interface(mqtt_manager):
     """Simple command line interface for sending commands"""
     print("\n=== MQTT Command Interface ===")
     print("Commands:")
-    print("  1 on/off - Set LED state on ESP32_1")
-    print("  2 on/off - Set LED state on ESP32_2")
-    print("  1 or 2 - Select ESP, then you will be asked for on/off")
+    print("  <n> on/off - Set LED state on ESP32_<n> (e.g. 1 on)")
+    print("  <name> on/off - Set LED state on an ESP32 by name (e.g. esp32_12 off)")
+    print("  <n> or <name> - Select ESP, then you will be asked for on/off")
+    print("  all on/off - Set LED state on every ESP32 at once (also group:<name>, esp32_1*, .../+/command)")
     print(f"  auto switch-trigger is {'ON' if AUTO_TRIGGER_FROM_SWITCH else 'OFF'}")
-    print("  status - Show current ESP32 data")
+    print("  status - Show current ESP32 data and auto-responder latency")
     print("  quit - Exit program")
     print("=====================================\n")
     
@@ -166,33 +247,32 @@ def user_interface(mqtt_manager):
             if user_input == "quit":
                 break
             elif user_input == "status":
-                with _data_lock:
-                    print(f"ESPtoPC1: {ESPtoPC1}")
-                    print(f"ESPtoPC2: {ESPtoPC2}")
-            elif user_input.startswith("1"):
+                snapshot = list(ESPtoPC.items())
+                if not snapshot:
+                    print("No ESP32 discovered yet")
+                for esp_name, data in sorted(snapshot):
+                    print(f"ESPtoPC[{esp_name}]: {data}")
+                print(mqtt_manager.rules.summary())
+                print(mqtt_manager.codec.summary())
+                print(mqtt_manager.dedup.summary())
+            elif user_input:
+                parts = user_input.split()
+                group = is_group_target(parts[0])
+                esp_name = parts[0] if group else parse_device(parts[0])
                 try:
-                    parts = user_input.split()
                     if len(parts) == 1:
-                        command = input("LED command for ESP32_1 (on/off): ").strip().upper()
+                        command = input(f"LED command for {esp_name} (on/off): ").strip().upper()
                     else:
                         command = parts[1].upper()
                     if command not in ("ON", "OFF"):
                         raise ValueError("Command must be on or off")
-                    mqtt_manager.send_command_to_esp32("ESP32_1", command)
-                except (IndexError, ValueError):
-                    print("Invalid format. Use: 1 on/off or 1")
-            elif user_input.startswith("2"):
-                try:
-                    parts = user_input.split()
-                    if len(parts) == 1:
-                        command = input("LED command for ESP32_2 (on/off): ").strip().upper()
+                    if group:
+                        batch = mqtt_manager.send_group_command(esp_name, command)
+                        print(format_batch_summary(batch.summary()))
                     else:
-                        command = parts[1].upper()
-                    if command not in ("ON", "OFF"):
-                        raise ValueError("Command must be on or off")
-                    mqtt_manager.send_command_to_esp32("ESP32_2", command)
+                        mqtt_manager.send_command(esp_name, command)
                 except (IndexError, ValueError):
-                    print("Invalid format. Use: 2 on/off or 2")
+                    print(f"Invalid format. Use: {parts[0]} on/off or {parts[0]}")
             else:
                 print("Unknown command. Type 'quit' to exit.")
                 
@@ -201,33 +281,34 @@ def user_interface(mqtt_manager):
         except Exception as e:
             print(f"Error: {e}")
 
+async def async_main():
+    """Connect, then handle messages while the CLI runs in its own thread"""
+    # Create MQTT manager
+    mqtt_manager = MQTTManager()
+    
+    # Connect to broker (and keep reconnecting); commands typed meanwhile are queued
+    connection = asyncio.create_task(mqtt_manager.connect())
+    print("Starting user interface...")
+    receiver = asyncio.create_task(mqtt_manager.run())
+    
+    try:
+        # input() blocks, so the user interface runs outside the event loop
+        await asyncio.to_thread(user_interface, mqtt_manager)
+    finally:
+        connection.cancel()
+        receiver.cancel()
+        await mqtt_manager.disconnect()
+
 def main():
     """Main function to start MQTT bidirectional communication"""
     print("Starting MQTT Bidirectional Communication...")
     
-    # Create MQTT manager
-    mqtt_manager = MQTTManager()
-    
     try:
-        # Connect to broker
-        if not mqtt_manager.connect():
-            print("Failed to connect to MQTT broker")
-            return
-        
-        # Wait a moment for connection to establish
-        time.sleep(2)
-        
-        print("MQTT connection established. Starting user interface...")
-        
-        # Start user interface
-        user_interface(mqtt_manager)
-        
+        asyncio.run(async_main())
     except KeyboardInterrupt:
         print("\nShutting down...")
     except Exception as e:
         print(f"Error: {e}")
-    finally:
-        mqtt_manager.disconnect()
 
 if __name__ == "__main__":
     main()
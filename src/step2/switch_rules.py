@@ -0,0 +1,106 @@
+"""
+Step 2: Switch auto-responder rules
+Turns switch reports (PRESSED/RELEASED) from an ESP32 into LED commands.
+The receive path only updates per-device state and queues the command; a
+separate sender task publishes it, so handling a message never waits on the
+network. Reaction latency (message received -> command published/acknowledged)
+is measured for every automatic command.
+"""
+
+import asyncio
+import time
+from collections import namedtuple
+
+# Outbound queue Configuration
+OUTBOUND_QUEUE_SIZE = 1000    # Commands waiting to be published (new ones are dropped when full)
+
+# Command waiting in the outbound queue; received_ns is the monotonic receive time of the trigger
+OutboundCommand = namedtuple("OutboundCommand", ["esp_name", "command", "received_ns"])
+
+SWITCH_STATES = ("PRESSED", "RELEASED")
+
+
+class LatencyStats:
+    """Running count / average / max of a latency in nanoseconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.last_ns = 0
+
+    def add(self, latency_ns):
+        self.count += 1
+        self.total_ns += latency_ns
+        self.last_ns = latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def summary(self):
+        if not self.count:
+            return "no samples"
+        avg_ms = self.total_ns / self.count / 1e6
+        return (f"{self.count} samples, last {self.last_ns / 1e6:.2f} ms, "
+                f"avg {avg_ms:.2f} ms, max {self.max_ns / 1e6:.2f} ms")
+
+
+class SwitchRuleEngine:
+    """Per-device switch state machine feeding an outbound command queue"""
+
+    def __init__(self, on_command, off_command, enabled=True, queue_size=OUTBOUND_QUEUE_SIZE):
+        self.on_command = on_command
+        self.off_command = off_command
+        self.enabled = enabled
+        self.last_switch_state = {}     # esp_name -> "PRESSED"/"RELEASED"
+        self.outbound = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.publish_latency = LatencyStats()   # received -> handed to the socket
+        self.ack_latency = LatencyStats()       # received -> PUBACK from the broker
+
+    def process(self, esp_name, message, received_ns):
+        """Update the device's switch state; queue a command on a state change.
+        Returns the queued command or None. Never blocks."""
+        if not self.enabled:
+            return None
+
+        normalized = message.strip().upper()
+        if normalized not in SWITCH_STATES:
+            return None
+
+        previous = self.last_switch_state.get(esp_name, "RELEASED")
+        self.last_switch_state[esp_name] = normalized
+
+        # Trigger only on state changes to avoid repeated commands from periodic status updates.
+        if previous == normalized:
+            return None
+        command = self.on_command if normalized == "PRESSED" else self.off_command
+        try:
+            self.outbound.put_nowait(OutboundCommand(esp_name, command, received_ns))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return None
+        return command
+
+    async def run_sender(self, publish):
+        """Publish queued commands until cancelled.
+        publish(esp_name, command) must return a future resolved on PUBACK."""
+        while True:
+            outbound = await self.outbound.get()
+            try:
+                future = publish(outbound.esp_name, outbound.command)
+            except Exception as e:
+                print(f"Failed to send command to {outbound.esp_name}: {e}")
+                continue
+            self.publish_latency.add(time.monotonic_ns() - outbound.received_ns)
+            future.add_done_callback(lambda f, o=outbound: self._on_ack(o, f))
+
+    def _on_ack(self, outbound, future):
+        if future.cancelled() or future.exception():
+            print(f"Command {outbound.command} to {outbound.esp_name} was not acknowledged")
+            return
+        self.ack_latency.add(time.monotonic_ns() - outbound.received_ns)
+
+    def summary(self):
+        return (f"Auto-responder: {self.outbound.qsize()} queued, {self.dropped} dropped\n"
+                f"  received -> published: {self.publish_latency.summary()}\n"
+                f"  received -> acknowledged: {self.ack_latency.summary()}")
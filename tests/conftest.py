@@ -0,0 +1,6 @@
+"""Unit tests of the Step 4 modules (run with: python -m pytest tests)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snippets", "step4"))
@@ -0,0 +1,148 @@
+"""Command tracking: PUBACKs, device acks, timeouts and when a command is re-sent"""
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+import command_tracker
+import timer_wheel
+from command_tracker import COMPLETED, FAILED, CommandTracker
+from timer_wheel import TimerWheel
+
+
+class FakeBroker:
+    """publish() hook recording each publish; PUBACKs are resolved by the test"""
+
+    def __init__(self):
+        self.published = []     # (mid, payload)
+        self.futures = {}
+
+    def publish(self, topic, payload):
+        mid = len(self.published) + 1
+        self.published.append((mid, payload))
+        self.futures[mid] = asyncio.get_running_loop().create_future()
+        return mid, self.futures[mid]
+
+    def puback(self, mid):
+        self.futures[mid].set_result(mid)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Manual clock for the timer wheel (the event loop keeps the real one)"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(timer_wheel, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def run(clock):
+    def run(scenario):
+        async def main():
+            broker = FakeBroker()
+            wheel = TimerWheel(tick=0.01)
+            tracker = CommandTracker(broker.publish, wheel, max_retries=2)
+            results = []
+            tracker.on_result = lambda pending: results.append(pending.state)
+
+            async def expire(seconds):
+                """Move the clock on and fire the timers that are due"""
+                await asyncio.sleep(0)
+                clock.now += seconds
+                wheel.advance()
+                await asyncio.sleep(0)
+            await scenario(broker, expire, tracker, results)
+        asyncio.run(main())
+    return run
+
+
+def test_blink_completes_on_puback_until_the_device_has_acked(run):
+    async def scenario(broker, expire, tracker, results):
+        # Firmware without acks: waiting for one would blink the LED again on every retry
+        tracker.send("ESP32_1", "t", "3", b"3")
+        broker.puback(1)
+        await asyncio.sleep(0)
+        assert results == [COMPLETED]
+        assert not tracker.device_ack("ESP32_1", "3")
+        tracker.send("ESP32_1", "t", "2", b"2")
+        broker.puback(2)
+        await asyncio.sleep(0)
+        assert tracker.awaiting_device["ESP32_1"]
+        assert tracker.device_ack("ESP32_1", "2")
+        assert results == [COMPLETED, COMPLETED]
+    run(scenario)
+
+
+def test_device_ack_completes_a_blink_command(run):
+    async def scenario(broker, expire, tracker, results):
+        tracker.ack_devices.add("ESP32_1")
+        tracker.send("ESP32_1", "t", "3", b"3")
+        broker.puback(1)
+        await asyncio.sleep(0)
+        assert tracker.awaiting_device["ESP32_1"]
+        assert tracker.device_ack("ESP32_1", "3")
+        assert results == [COMPLETED]
+        assert tracker.outstanding() == 0
+    run(scenario)
+
+
+def test_command_in_flight_is_not_published_again(run):
+    async def scenario(broker, expire, tracker, results):
+        tracker.send("ESP32_1", "t", "3", b"3")
+        for _ in range(3):
+            await expire(command_tracker.PUBACK_TIMEOUT + 0.1)
+        # paho keeps re-sending the original; a second publish could blink the device twice
+        assert len(broker.published) == 1
+        assert results == [FAILED]
+        assert tracker.counters()["retries"] == 0
+    run(scenario)
+
+
+def test_late_puback_while_waiting_still_counts(run):
+    async def scenario(broker, expire, tracker, results):
+        tracker.send("ESP32_1", "t", "ON", b"ON")
+        await expire(command_tracker.PUBACK_TIMEOUT + 0.1)
+        broker.puback(1)
+        await asyncio.sleep(0)
+        assert results == [COMPLETED]
+        assert len(broker.published) == 1
+    run(scenario)
+
+
+def test_missing_device_ack_is_retried_then_failed(run):
+    async def scenario(broker, expire, tracker, results):
+        tracker.ack_devices.add("ESP32_1")
+        tracker.send("ESP32_1", "t", "2", b"2")
+        device_timeout = command_tracker.DEVICE_ACK_TIMEOUT + 2 * command_tracker.BLINK_SECONDS + 0.1
+        for attempt in range(1, 4):
+            broker.puback(attempt)
+            await asyncio.sleep(0)
+            await expire(device_timeout)
+        assert len(broker.published) == 3
+        assert results == [FAILED]
+        assert tracker.counters()["retries"] == 2
+    run(scenario)
+
+
+def test_failed_publish_is_retried(run):
+    async def scenario(broker, expire, tracker, results):
+        tracker.send("ESP32_1", "t", "ON", b"ON")
+        broker.futures[1].set_exception(RuntimeError("not connected"))
+        await asyncio.sleep(0)
+        await expire(command_tracker.PUBACK_TIMEOUT + 0.1)
+        assert len(broker.published) == 2
+        broker.puback(2)
+        await asyncio.sleep(0)
+        assert results == [COMPLETED]
+    run(scenario)
+
+
+def test_timeouts_wait_while_offline(run):
+    async def scenario(broker, expire, tracker, results):
+        online = False
+        tracker.can_send = lambda: online
+        tracker.send("ESP32_1", "t", "ON", b"ON")
+        for _ in range(5):
+            await expire(command_tracker.PUBACK_TIMEOUT + 0.1)
+        assert results == []
+        assert len(broker.published) == 1
+    run(scenario)
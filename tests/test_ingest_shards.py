@@ -0,0 +1,58 @@
+"""Shard coordinator: merging the aggregates several workers report for one device"""
+
+from types import SimpleNamespace
+import pytest
+from device_registry import DeviceRegistry
+from event_rates import EVENT_NAMES
+from ingest_shards import ShardCoordinator
+from metrics import Metrics
+from update_coalescer import UpdateCoalescer
+
+
+@pytest.fixture
+def coordinator():
+    core = SimpleNamespace(registry=DeviceRegistry(), coalescer=UpdateCoalescer(), metrics=Metrics(),
+                           devices_seen=lambda esp_names: None, broker="localhost", port=1883)
+    return ShardCoordinator(core, 2, "shared")
+
+
+def aggregate(data, count, received_ns, log_file, log_entries):
+    return ("ESP32_1", data, received_ns / 1e9, count, received_ns, log_file, log_entries)
+
+
+def test_message_counts_are_summed_over_workers(coordinator):
+    coordinator._apply_updates(0, [aggregate("a", 3, 100, "ESP32_1_w0.csv", 3)])
+    coordinator._apply_updates(1, [aggregate("b", 2, 200, "ESP32_1_w1.csv", 2)])
+    coordinator._apply_updates(0, [aggregate("c", 5, 300, "ESP32_1_w0.csv", 5)])
+    update = coordinator.core.coalescer.snapshot("ESP32_1")
+    assert update.message_count == 7
+    assert update.last_data == "c"
+    assert coordinator.log_status("ESP32_1") == ("ESP32_1_w0.csv, ESP32_1_w1.csv", 7)
+
+
+def test_older_message_from_another_worker_keeps_the_latest_value(coordinator):
+    coordinator._apply_updates(0, [aggregate("new", 1, 500, "ESP32_1_w0.csv", 1)])
+    coordinator._apply_updates(1, [aggregate("old", 1, 400, "ESP32_1_w1.csv", 1)])
+    update = coordinator.core.coalescer.snapshot("ESP32_1")
+    assert (update.last_data, update.message_count, update.received_ns) == ("new", 2, 500)
+
+
+def test_event_rates_are_summed_over_workers(coordinator):
+    zeros = (0.0,) * len(EVENT_NAMES)
+    assert coordinator.event_rates("ESP32_1") == zeros
+    rates = tuple(float(i + 1) for i in range(len(EVENT_NAMES)))
+    coordinator._apply_rates(0, {"ESP32_1": rates})
+    coordinator._apply_rates(1, {"ESP32_1": rates, "ESP32_2": rates})
+    assert coordinator.event_rates("ESP32_1") == tuple(2 * rate for rate in rates)
+    # A worker's next report replaces its previous one
+    coordinator._apply_rates(1, {"ESP32_2": rates})
+    assert coordinator.event_rates("ESP32_1") == rates
+    assert coordinator.event_rates("ESP32_3") == zeros
+
+
+def test_restarted_worker_counts_from_zero(coordinator):
+    coordinator._apply_updates(0, [aggregate("a", 4, 100, "ESP32_1_w0.csv", 4)])
+    # What _check_workers() forgets of a worker that died
+    del coordinator._message_counts[(0, "ESP32_1")]
+    coordinator._apply_updates(0, [aggregate("b", 1, 200, "ESP32_1_w0.csv", 1)])
+    assert coordinator.core.coalescer.snapshot("ESP32_1").message_count == 5
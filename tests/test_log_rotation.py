@@ -0,0 +1,33 @@
+"""Log rotation: segments of a device that has gone quiet are closed by age"""
+
+import os
+import time
+from log_rotation import CLOSED, COMPRESSED, RotatingSink, SegmentStore
+from log_sinks import LOG_FIELDS, TIMESTAMP_NS_FIELD
+from log_writer import LogWriter
+
+
+def entry(message):
+    row = dict.fromkeys(LOG_FIELDS, "")
+    row.update({"ESP32_Name": "ESP32_1", "Message": message, TIMESTAMP_NS_FIELD: time.time_ns()})
+    return row
+
+
+def test_idle_segment_is_closed_by_the_writer_tick(tmp_path):
+    store = SegmentStore(str(tmp_path), compression="none")
+    paths = iter(str(tmp_path / f"segment_{i}") for i in range(10))
+    sink = RotatingSink("ESP32_1", "csv", lambda: next(paths), store, rotate_bytes=0, rotate_seconds=0.2)
+    writer = LogWriter(flush_interval=0.05)
+    writer.start()
+    try:
+        writer.submit(sink, entry("L1"))
+        # No more entries: only the writer's flush tick can close the segment
+        deadline = time.monotonic() + 5
+        while sink.segments[0]["state"] not in (CLOSED, COMPRESSED) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert sink.segments[0]["state"] in (CLOSED, COMPRESSED)
+        assert sink.segments[0]["entries"] == 1
+        assert os.path.exists(sink.segment_paths()[0])
+    finally:
+        writer.stop()
+        store.stop()
@@ -0,0 +1,48 @@
+"""SQLite log store: failed transactions keep their rows, but not forever"""
+
+import time
+import pytest
+from log_sinks import LOG_FIELDS, TIMESTAMP_NS_FIELD
+from log_store import SqliteLogStore, read_entries
+
+
+def entry(message):
+    row = dict.fromkeys(LOG_FIELDS, "")
+    row.update({"ESP32_Name": "ESP32_1", "Direction": "Received", "Message_Type": "Data",
+                "Message": message, TIMESTAMP_NS_FIELD: time.time_ns()})
+    return row
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteLogStore(str(tmp_path / "session.sqlite"), max_failed_flushes=3)
+    sink = store.attach("ESP32_1")
+    yield store
+    sink.close()
+
+
+def test_rows_are_kept_for_the_next_flush_after_a_failure(store):
+    store.write(entry("L1"))
+    store._conn.execute("ALTER TABLE entries RENAME TO entries_away")
+    with pytest.raises(Exception):
+        store.flush()
+    store._conn.execute("ALTER TABLE entries_away RENAME TO entries")
+    store.flush()
+    assert [row["Message"] for row in read_entries(store.path)] == ["L1"]
+    assert (store.rows_written, store.rows_dropped, store.failed_flushes) == (1, 0, 0)
+
+
+def test_rows_are_dropped_after_repeated_failures(store):
+    store.write(entry("L1"))
+    store.write(entry("L2"))
+    store._conn.execute("ALTER TABLE entries RENAME TO entries_away")
+    for _ in range(3):
+        with pytest.raises(Exception):
+            store.flush()
+    assert store.rows_dropped == 2
+    assert not store._buffer
+    # Nothing left to retry: the next flush succeeds
+    store._conn.execute("ALTER TABLE entries_away RENAME TO entries")
+    store.write(entry("L3"))
+    store.flush()
+    assert [row["Message"] for row in read_entries(store.path)] == ["L3"]
@@ -0,0 +1,18 @@
+"""Prometheus text: label escaping and the device state gauge"""
+
+from metrics import Metrics, label_value
+
+
+def test_label_values_are_escaped():
+    assert label_value('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_device_states_have_their_own_gauge():
+    metrics = Metrics()
+    metrics.register_gauge("log_writer", lambda: 3)
+    metrics.register_device_states(lambda: {"online": 2, "stale": 1, "offline": 0})
+    lines = metrics.prometheus_text().splitlines()
+    assert 'mosquito_devices{state="online"} 2' in lines
+    assert 'mosquito_devices{state="stale"} 1' in lines
+    assert 'mosquito_queue_depth{queue="log_writer"} 3' in lines
+    assert not [line for line in lines if line.startswith("mosquito_queue_depth") and "devices" in line]
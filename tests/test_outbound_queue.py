@@ -0,0 +1,85 @@
+"""Offline outbound queue: order, bound, persistence across restarts and expiry"""
+
+import json
+import time
+from outbound_queue import OutboundQueue
+
+
+def commands(items):
+    return [(esp_name, command) for esp_name, command, _ in items]
+
+
+def test_drain_returns_commands_in_order(tmp_path):
+    queue = OutboundQueue(str(tmp_path / "queue.jsonl"))
+    queue.put("ESP32_1", 3)
+    queue.put("ESP32_2", "ON")
+    assert commands(queue.drain()) == [("ESP32_1", "3"), ("ESP32_2", "ON")]
+    assert queue.drain() == []
+    assert queue.counters()["drained"] == 2
+
+
+def test_queue_survives_a_restart(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = OutboundQueue(path)
+    queue.put("ESP32_1", 3)
+    queue.put("ESP32_2", 4)
+    restored = OutboundQueue(path)
+    assert commands(restored.drain()) == [("ESP32_1", "3"), ("ESP32_2", "4")]
+    # Draining empties the file too
+    assert len(OutboundQueue(path)) == 0
+
+
+def test_full_queue_drops_the_oldest(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    queue = OutboundQueue(path, maxlen=2)
+    for command in (1, 2, 3):
+        queue.put("ESP32_1", command)
+    assert queue.counters()["dropped"] == 1
+    assert commands(OutboundQueue(path, maxlen=2).drain()) == [("ESP32_1", "2"), ("ESP32_1", "3")]
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    OutboundQueue(str(path)).put("ESP32_1", 5)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"device": "ESP32_2", "comm')       # Interrupted write
+    assert commands(OutboundQueue(str(path)).drain()) == [("ESP32_1", "5")]
+
+
+def test_disabled_queue_refuses_commands(tmp_path):
+    queue = OutboundQueue(str(tmp_path / "queue.jsonl"), maxlen=0)
+    assert not queue.put("ESP32_1", 1)
+    assert len(queue) == 0
+
+
+def test_expired_commands_are_dropped_on_load(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    now = time.time()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"device": "ESP32_1", "command": "3", "queued_at": now - 86400}) + "\n")
+        f.write(json.dumps({"device": "ESP32_2", "command": "4", "queued_at": now}) + "\n")
+    queue = OutboundQueue(str(path), max_age=300)
+    assert queue.counters()["expired"] == 1
+    assert commands(queue.drain()) == [("ESP32_2", "4")]
+
+
+def test_expired_commands_are_reported_on_drain(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"device": "ESP32_1", "command": "3", "queued_at": time.time() - 600}) + "\n")
+    queue = OutboundQueue(str(path), max_age=0)
+    queue.put("ESP32_2", 4)
+    # The limit is applied again when the queue is drained
+    queue.max_age = 300
+    expired = []
+    queue.on_expired = lambda esp_name, command, age: expired.append((esp_name, command, age))
+    assert commands(queue.drain()) == [("ESP32_2", "4")]
+    assert [(name, command) for name, command, _ in expired] == [("ESP32_1", "3")]
+    assert expired[0][2] >= 600
+
+
+def test_no_max_age_keeps_old_commands(tmp_path):
+    path = tmp_path / "queue.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"device": "ESP32_1", "command": "3", "queued_at": 0}) + "\n")
+    assert commands(OutboundQueue(str(path), max_age=0).drain()) == [("ESP32_1", "3")]
@@ -0,0 +1,104 @@
+"""Duplicate suppression: duplicates, gaps, reordering, wrap-around and restarts"""
+
+from sequence_window import (DUPLICATE, NEW, REORDERED, RESTARTED, SEQUENCE_MODULO, DuplicateFilter,
+                             SequenceWindow)
+
+
+def test_in_order_sequence_is_new():
+    window = SequenceWindow()
+    assert [window.check(seq, seq) for seq in range(5)] == [(NEW, 0)] * 5
+
+
+def test_exact_copy_is_duplicate():
+    window = SequenceWindow()
+    for seq in range(5):
+        window.check(seq, 100 + seq)
+    assert window.check(4, 104) == (DUPLICATE, 0)
+    assert window.check(1, 101) == (DUPLICATE, 0)
+
+
+def test_gap_reports_skipped_numbers():
+    window = SequenceWindow()
+    window.check(10, 0)
+    assert window.check(14, 4) == (NEW, 3)
+
+
+def test_late_arrival_fills_gap_once():
+    window = SequenceWindow()
+    window.check(10, 0)
+    window.check(14, 4)
+    assert window.check(12, 2) == (REORDERED, 0)
+    assert window.check(12, 2) == (DUPLICATE, 0)
+    assert window.check(11, 1) == (REORDERED, 0)
+
+
+def test_wrap_around():
+    window = SequenceWindow()
+    last = SEQUENCE_MODULO - 1
+    window.check(last - 1, 0)
+    window.check(last, 1)
+    assert window.check(0, 2) == (NEW, 0)
+    assert window.check(1, 3) == (NEW, 0)
+    # Copies from before the wrap are still recognised
+    assert window.check(last, 1) == (DUPLICATE, 0)
+
+
+def test_gap_across_wrap():
+    window = SequenceWindow()
+    window.check(SEQUENCE_MODULO - 2, 0)
+    assert window.check(2, 4) == (NEW, 3)
+    assert window.check(SEQUENCE_MODULO - 1, 1) == (REORDERED, 0)
+
+
+def test_far_behind_window_after_reboot_is_restart():
+    window = SequenceWindow(window=64)
+    window.check(1000, 900_000, now_ms=50_000)
+    # Silent for 8 s, then frames with 5 s of uptime: it booted after its newest frame
+    assert window.check(0, 5000, now_ms=58_000) == (RESTARTED, 0)
+    assert window.check(1, 6000, now_ms=59_000) == (NEW, 0)
+
+
+def test_stale_redelivery_far_behind_window_is_duplicate():
+    window = SequenceWindow(window=64)
+    for seq in range(200):
+        window.check(seq, 10_000 + seq * 1000, now_ms=seq * 1000)
+    # Broker redelivers frame 10 (uptime from before the newest frame): not a restart
+    assert window.check(10, 20_000, now_ms=200_000) == (DUPLICATE, 0)
+    # The window is kept, so the frames already seen are still duplicates
+    assert window.check(199, 209_000, now_ms=200_100) == (DUPLICATE, 0)
+    assert window.check(200, 210_000, now_ms=200_500) == (NEW, 0)
+
+
+def test_known_number_with_other_timestamp_is_restart():
+    window = SequenceWindow()
+    for seq in range(3):
+        window.check(seq, 5000 + seq)
+    # Rebooted device counting from 0 again, with a new millis() value
+    assert window.check(1, 20) == (RESTARTED, 0)
+    assert window.check(2, 21) == (NEW, 0)
+
+
+def test_jump_larger_than_window():
+    window = SequenceWindow(window=8)
+    window.check(0, 0)
+    assert window.check(20, 20) == (NEW, 19)
+    assert window.check(19, 19) == (REORDERED, 0)
+    assert window.check(20, 20) == (DUPLICATE, 0)
+
+
+def test_filter_counts_per_device():
+    dedup = DuplicateFilter()
+    assert dedup.accept("ESP32_1", 0, 0)
+    assert dedup.accept("ESP32_1", 2, 2)
+    assert not dedup.accept("ESP32_1", 2, 2)
+    assert dedup.accept("ESP32_1", 1, 1)
+    # Same numbers from another device are not duplicates
+    assert dedup.accept("ESP32_2", 2, 2)
+    assert dedup.counters() == {"duplicates": 1, "gaps": 1, "reorders": 1, "restarts": 0}
+
+
+def test_text_payloads_are_always_accepted():
+    dedup = DuplicateFilter()
+    assert dedup.accept("ESP32_1", None)
+    assert dedup.accept("ESP32_1", None)
+    assert dedup.counters()["duplicates"] == 0
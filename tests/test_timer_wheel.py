@@ -0,0 +1,98 @@
+"""Timer wheel: deadlines, cancellation, long delays and failing callbacks"""
+
+import asyncio
+import time
+from timer_wheel import TimerWheel
+
+
+def make_wheel(slots=16):
+    wheel = TimerWheel(tick=0.01, slots=slots)
+    return wheel, time.monotonic()
+
+
+def test_fires_at_deadline_not_before():
+    wheel, start = make_wheel()
+    fired = []
+    wheel.schedule(0.1, fired.append, "a")
+    wheel.advance(start + 0.05)
+    assert fired == []
+    wheel.advance(start + 0.13)
+    assert fired == ["a"]
+    assert len(wheel) == 0
+
+
+def test_fires_in_deadline_order_across_ticks():
+    wheel, start = make_wheel()
+    fired = []
+    for delay in (0.05, 0.02, 0.08):
+        wheel.schedule(delay, fired.append, delay)
+    assert wheel.advance(start + 0.2) == 3
+    assert fired == [0.02, 0.05, 0.08]
+
+
+def test_cancelled_timer_does_not_fire():
+    wheel, start = make_wheel()
+    fired = []
+    timer = wheel.schedule(0.02, fired.append, "cancelled")
+    wheel.schedule(0.02, fired.append, "kept")
+    timer.cancel()
+    assert wheel.advance(start + 0.1) == 1
+    assert fired == ["kept"]
+
+
+def test_delay_longer_than_one_revolution():
+    wheel, start = make_wheel(slots=16)         # 16 x 10 ms = 0.16 s per revolution
+    fired = []
+    wheel.schedule(0.5, fired.append, "late")
+    wheel.advance(start + 0.3)
+    assert fired == []
+    assert len(wheel) == 1
+    wheel.advance(start + 0.52)
+    assert fired == ["late"]
+
+
+def test_zero_delay_fires_on_next_tick():
+    wheel, start = make_wheel()
+    fired = []
+    wheel.schedule(0, fired.append, "now")
+    wheel.advance(start + 0.02)
+    assert fired == ["now"]
+
+
+def test_callback_can_reschedule():
+    wheel, start = make_wheel()
+    fired = []
+
+    def periodic():
+        fired.append(len(fired))
+        wheel.schedule(0.02, periodic)
+    wheel.schedule(0.02, periodic)
+    wheel.advance(start + 0.105)
+    assert len(fired) >= 3
+
+
+def test_failing_callback_does_not_stop_the_others(capsys):
+    wheel, start = make_wheel()
+    fired = []
+
+    def broken():
+        raise RuntimeError("boom")
+    wheel.schedule(0.02, broken)
+    wheel.schedule(0.02, fired.append, "same tick")
+    wheel.schedule(0.05, fired.append, "later tick")
+    wheel.advance(start + 0.1)
+    assert fired == ["same tick", "later tick"]
+    assert "boom" in capsys.readouterr().out
+
+
+def test_run_keeps_ticking_after_a_failure(capsys):
+    async def scenario():
+        wheel = TimerWheel(tick=0.01)
+        fired = []
+        wheel.schedule(0.01, lambda: 1 / 0)
+        wheel.schedule(0.05, fired.append, "after")
+        runner = asyncio.create_task(wheel.run())
+        await asyncio.sleep(0.15)
+        runner.cancel()
+        return fired
+    assert asyncio.run(scenario()) == ["after"]
@@ -0,0 +1,80 @@
+"""Binary wire protocol: frame encoding/decoding and per-device negotiation"""
+
+import pytest
+from wire_protocol import (CMD_BLINK, EVENT_CODES, HEADER, HEADER_SIZE, WIRE_MAGIC, WireCodec, WireError,
+                           decode_payload, encode_frame, is_binary)
+
+
+@pytest.mark.parametrize("text", sorted(EVENT_CODES))
+def test_event_round_trip(text):
+    message = decode_payload(encode_frame(text, 7, 123456))
+    assert message == (text, 7, 123456, True)
+
+
+def test_blink_command_round_trip():
+    frame = encode_frame("12", 1, 2)
+    assert len(frame) == HEADER_SIZE + 1
+    assert frame[1] == CMD_BLINK
+    assert decode_payload(frame).text == "12"
+
+
+def test_encode_normalises_text_and_wraps_counters():
+    frame = encode_frame(" l1 ", 0x1FFFF, 0x1_0000_0005)
+    assert decode_payload(frame) == ("L1", 0xFFFF, 5, True)
+
+
+@pytest.mark.parametrize("text", ["hello", "0", "256", ""])
+def test_encode_without_binary_form(text):
+    assert encode_frame(text, 0, 0) is None
+
+
+def test_text_payload_passes_through():
+    assert decode_payload(b"L2") == ("L2", None, None, False)
+    assert not is_binary(b"")
+    assert not is_binary("FP".encode())
+
+
+def test_unsupported_version():
+    frame = bytes([0xA2]) + encode_frame("L1", 0, 0)[1:]
+    with pytest.raises(WireError, match="version"):
+        decode_payload(frame)
+
+
+def test_truncated_frame():
+    with pytest.raises(WireError, match="Truncated"):
+        decode_payload(encode_frame("L1", 0, 0)[:5])
+
+
+def test_blink_without_count():
+    with pytest.raises(WireError, match="count"):
+        decode_payload(HEADER.pack(WIRE_MAGIC, CMD_BLINK, 0, 0))
+
+
+def test_unknown_event_code():
+    with pytest.raises(WireError, match="Unknown event"):
+        decode_payload(HEADER.pack(WIRE_MAGIC, 0x3F, 0, 0))
+
+
+def test_codec_switches_device_to_binary():
+    codec = WireCodec()
+    assert codec.encode_command("ESP32_1", "ON") == "ON"
+    codec.decode("ESP32_1", encode_frame("L1", 0, 0))
+    first = codec.encode_command("ESP32_1", "ON")
+    second = codec.encode_command("ESP32_1", "ON")
+    assert decode_payload(first)[:2] == ("ON", 0)
+    assert decode_payload(second)[:2] == ("ON", 1)
+    # Other devices and commands without a binary form stay text
+    assert codec.encode_command("ESP32_2", "ON") == "ON"
+    assert codec.encode_command("ESP32_1", "RESET") == "RESET"
+
+
+def test_codec_counts_bad_frames(capsys):
+    codec = WireCodec()
+    assert codec.decode("ESP32_1", bytes([WIRE_MAGIC, 1])) is None
+    assert codec.errors == 1
+    assert "Bad frame from ESP32_1" in capsys.readouterr().out
+
+
+def test_codec_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        WireCodec("morse")
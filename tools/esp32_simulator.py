@@ -0,0 +1,240 @@
+"""
+ESP32 fleet simulator
+Reproduces the behaviour of the Wokwi sketches (wokwi/esp32_*/sketch.ino) for
+any number of virtual devices, so the Python side can be stress-tested far
+beyond 20 ESP32s without hardware or VS Code:
+
+    - publishes a random L1/L2/FP on mosquito/<id>/data every 500-1500 ms
+    - subscribes to mosquito/<id>/command and "blinks" N times for a command N
+      (no data is sent while blinking, as on the real board)
+    - acknowledges a finished blink on mosquito/<id>/ack
+    - connects with a Last Will ("offline", retained, on mosquito/<id>/status)
+      and publishes a retained "online", like the sketches
+    - sends compact binary frames, like the sketches with USE_BINARY_PROTOCOL
+      (snippets/step4/wire_protocol.py), so the PC can drop duplicates; with
+      --text, sends text like the sketches' default
+    - with --duplicate-rate, re-sends some frames as a lost PUBACK would, to
+      exercise duplicate suppression on the PC side
+
+All devices share one asyncio event loop; each has its own MQTT connection.
+
+Usage:
+    mosquitto -c mosquitto_lan.conf          (listens on port 1884)
+    python tools/esp32_simulator.py --devices 200 --port 1884
+    python tools/esp32_simulator.py --devices 50 --rate 10 --burst-interval 5 --burst-size 20
+    python tools/esp32_simulator.py --devices 200 --text
+    python tools/esp32_simulator.py --devices 20 --duplicate-rate 0.05
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+# The asyncio MQTT client lives with the Step 4 code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snippets", "step4"))
+from async_mqtt import AsyncMQTTClient, MQTTError  # noqa: E402
+from wire_protocol import WireError, decode_payload, encode_frame  # noqa: E402
+
+# Simulator Configuration (defaults mirror the Wokwi sketches)
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+TOPIC_PREFIX = "mosquito"
+DATA_STRINGS = ["L1", "L2", "FP"]
+SEND_INTERVAL_MS = (500, 1500)      # Random delay between two messages
+BLINK_INTERVAL_MS = 250             # LED toggles every 250 ms (one blink = on + off)
+MAX_BLINKS = 20
+MQTT_KEEPALIVE = 5                  # Seconds; the broker publishes the Last Will after 1.5 x this
+CONNECT_BATCH = 50                  # Devices connected at once when starting a large fleet
+STATS_INTERVAL = 5                  # Seconds between two printed stats lines
+
+
+class SimulatorStats:
+    """Counters shared by every virtual device"""
+
+    def __init__(self):
+        self.sent = 0
+        self.commands = 0
+        self.acks = 0
+        self.duplicates = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def line(self, devices):
+        elapsed = time.monotonic() - self.started
+        rate = self.sent / elapsed if elapsed else 0.0
+        return (f"[{elapsed:7.1f}s] {devices} devices, {self.sent} sent ({rate:.1f} msg/s), "
+                f"{self.commands} commands, {self.acks} acks, {self.duplicates} duplicates, "
+                f"{self.errors} errors")
+
+
+class VirtualESP32:
+    """One simulated ESP32 running the Wokwi sketch behaviour"""
+
+    def __init__(self, esp_name, stats, rate=1.0, ack=True, binary=False, duplicate_rate=0.0):
+        self.esp_name = esp_name
+        device_id = esp_name.lower()
+        self.data_topic = f"{TOPIC_PREFIX}/{device_id}/data"
+        self.command_topic = f"{TOPIC_PREFIX}/{device_id}/command"
+        self.ack_topic = f"{TOPIC_PREFIX}/{device_id}/ack"
+        self.status_topic = f"{TOPIC_PREFIX}/{device_id}/status"
+        self.stats = stats
+        self.rate = rate
+        self.ack = ack
+        self.binary = binary
+        self.duplicate_rate = duplicate_rate
+        self.seq = 0
+        self.started = time.monotonic()
+        self.blink_until = 0.0
+        self.client = AsyncMQTTClient(client_id=esp_name)
+        self.client.on_message = self.on_command
+        self.client.will_set(self.status_topic, "offline", qos=1, retain=True)
+
+    async def connect(self, host, port):
+        await self.client.connect(host, port, MQTT_KEEPALIVE)
+        await self.client.subscribe(self.command_topic, qos=1)
+        self.client.publish_nowait(self.status_topic, "online", qos=1, retain=True)
+
+    async def disconnect(self):
+        """Leave cleanly: a DISCONNECT does not trigger the Last Will, so say offline first"""
+        try:
+            await asyncio.wait_for(self.client.publish_nowait(self.status_topic, "offline", qos=1, retain=True), 1)
+        except (MQTTError, asyncio.TimeoutError):
+            pass
+        await self.client.disconnect()
+
+    def on_command(self, msg):
+        """Same parsing as the sketch: an integer 1..20 (text or binary) starts a blink sequence"""
+        try:
+            blinks = int(decode_payload(msg.payload).text.strip())
+        except (ValueError, WireError):
+            return
+        if 0 < blinks <= MAX_BLINKS:
+            self.stats.commands += 1
+            duration = blinks * 2 * BLINK_INTERVAL_MS / 1000.0
+            self.blink_until = time.monotonic() + duration
+            if self.ack:
+                asyncio.get_running_loop().call_later(duration, self.send_ack, str(blinks))
+
+    def send_ack(self, command):
+        if self.client.connected:
+            self.client.publish_nowait(self.ack_topic, command, qos=1)
+            self.stats.acks += 1
+
+    def publish(self):
+        if not self.client.connected:
+            return
+        payload = random.choice(DATA_STRINGS)
+        if self.binary:
+            device_ms = int((time.monotonic() - self.started) * 1000)
+            payload = encode_frame(payload, self.seq, device_ms)
+            self.seq = (self.seq + 1) & 0xFFFF
+        try:
+            self.client.publish_nowait(self.data_topic, payload, qos=1)
+            self.stats.sent += 1
+            if self.binary and random.random() < self.duplicate_rate:
+                self.client.publish_nowait(self.data_topic, payload, qos=1)
+                self.stats.duplicates += 1
+        except MQTTError:
+            self.stats.errors += 1
+
+    async def run(self):
+        """Publish at random intervals; nothing is sent while the LED blinks"""
+        low, high = SEND_INTERVAL_MS
+        # Spread the first messages so devices do not start in lockstep
+        await asyncio.sleep(random.uniform(0, high / 1000.0 / self.rate))
+        while True:
+            now = time.monotonic()
+            if now < self.blink_until:
+                await asyncio.sleep(self.blink_until - now)
+                continue
+            self.publish()
+            await asyncio.sleep(random.uniform(low, high) / 1000.0 / self.rate)
+
+    def burst(self, size):
+        """Send size messages back to back"""
+        for _ in range(size):
+            self.publish()
+
+
+async def run_bursts(devices, interval, size):
+    """Every interval seconds, make every device send a burst at the same moment"""
+    while True:
+        await asyncio.sleep(interval)
+        for device in devices:
+            device.burst(size)
+
+
+async def print_stats(stats, devices):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print(stats.line(len(devices)))
+
+
+async def simulate(args):
+    stats = SimulatorStats()
+    names = [f"{args.name_prefix}{args.first + i}" for i in range(args.devices)]
+    devices = [VirtualESP32(name, stats, args.rate, not args.no_ack, not args.text, args.duplicate_rate)
+               for name in names]
+
+    print(f"Connecting {len(devices)} virtual ESP32s to {args.broker}:{args.port}...")
+    for start in range(0, len(devices), CONNECT_BATCH):
+        batch = devices[start:start + CONNECT_BATCH]
+        results = await asyncio.gather(*(d.connect(args.broker, args.port) for d in batch),
+                                       return_exceptions=True)
+        for device, result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"{device.esp_name}: connection failed: {result}")
+                stats.errors += 1
+    connected = [d for d in devices if d.client.connected]
+    print(f"{len(connected)} devices connected, publishing...")
+
+    tasks = [asyncio.create_task(d.run()) for d in connected]
+    tasks.append(asyncio.create_task(print_stats(stats, connected)))
+    if args.burst_interval:
+        tasks.append(asyncio.create_task(run_bursts(connected, args.burst_interval, args.burst_size)))
+    try:
+        if args.duration:
+            await asyncio.sleep(args.duration)
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*(device.disconnect() for device in connected))
+        print(stats.line(len(connected)))
+
+
+def main():
+    """Main function to start the ESP32 fleet simulator"""
+    parser = argparse.ArgumentParser(description="Simulate many ESP32s publishing to MQTT")
+    parser.add_argument("--broker", default=MQTT_BROKER, help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=MQTT_PORT, help="MQTT broker port")
+    parser.add_argument("--devices", type=int, default=20, help="number of virtual ESP32s")
+    parser.add_argument("--first", type=int, default=1, help="number of the first device (ESP32_<first>)")
+    parser.add_argument("--name-prefix", default="ESP32_", help="device name prefix")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="rate multiplier (2 = messages twice as often as the sketch)")
+    parser.add_argument("--burst-interval", type=float, default=0,
+                        help="seconds between synchronized bursts from every device (0 = no bursts)")
+    parser.add_argument("--burst-size", type=int, default=10, help="messages per device in each burst")
+    parser.add_argument("--duration", type=float, default=0, help="stop after N seconds (0 = run until Ctrl+C)")
+    parser.add_argument("--text", action="store_true",
+                        help="send text payloads instead of binary frames (no duplicate suppression)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="fraction of binary frames sent twice (0.05 = 5%%)")
+    parser.add_argument("--no-ack", action="store_true", help="do not acknowledge finished blinks")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(simulate(args))
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Session replay
+Re-injects a recorded session into the broker, so an incident or a real
+traffic shape can be reproduced without the ESP32s or Wokwi:
+
+    - reads the logs written by the Logger (.csv, .jsonl, binary .mlog or the SQLite store,
+      and rotated segments compressed to .gz or .zst),
+      merging every device in time order
+    - republishes each Received data entry on mosquito/<id>/data (and, with
+      --acks, each Received ack on mosquito/<id>/ack)
+    - keeps the recorded inter-arrival times at --speed 1, divides them at
+      --speed 10, or publishes as fast as the broker accepts with --speed 0
+    - with --verify, listens on mosquito/+/command and compares the commands
+      the PC sends with the Sent commands of the recording
+
+The PC side (GUI, gateway or Step 2 client) runs as usual against the same
+broker, so the replay is a deterministic load source for profiling it.
+
+Usage:
+    python tools/session_replay.py logs/                                   (every log in the folder)
+    python tools/session_replay.py logs/mqtt_log_*_20250101_120000.csv --speed 10
+    python tools/session_replay.py logs/ --speed 0 --devices ESP32_1,ESP32_2 --from 60 --to 120
+    python tools/session_replay.py logs/ --verify --topic-prefix udem/pfh3221/mosquito
+
+Note: Uses QoS 1 because PubSubClient on ESP32 does not support QoS 2.
+"""
+
+import argparse
+import asyncio
+import glob
+import heapq
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+# The asyncio MQTT client and the log readers live with the Step 4 code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "snippets", "step4"))
+from async_mqtt import AsyncMQTTClient, MQTTError  # noqa: E402
+from log_sinks import BinaryLogSink, LOG_EXTENSIONS, read_log  # noqa: E402
+from wire_protocol import WireError, decode_payload, encode_frame  # noqa: E402
+
+# Replay Configuration
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+TOPIC_PREFIX = "mosquito"
+LOG_PATTERN = "mqtt_log_*"          # Log files picked up when a folder is given
+MAX_INFLIGHT = 1000                 # Publishes waiting for their PUBACK before the replay waits
+VERIFY_WAIT = 5.0                   # Seconds to wait for the PC's last commands after the replay
+VERIFY_TOLERANCE = 2.0              # Seconds a command may come earlier than recorded and still match
+STATS_INTERVAL = 5                  # Seconds between two printed progress lines
+
+
+def find_logs(paths):
+    """Log files among the given files and folders"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, LOG_PATTERN)))
+        else:
+            files.append(path)
+    return [f for f in files if f.endswith(LOG_EXTENSIONS)]
+
+
+def parse_timestamp_ns(text, _seconds_cache={}):
+    """Logger timestamp ("2025-01-01 12:00:00.123", local time) to epoch nanoseconds"""
+    seconds = _seconds_cache.get(text[:19])
+    if seconds is None:
+        seconds = int(datetime.strptime(text[:19], "%Y-%m-%d %H:%M:%S").timestamp())
+        _seconds_cache[text[:19]] = seconds
+    milliseconds = int(text[20:23]) if len(text) >= 23 else 0
+    return seconds * 1_000_000_000 + milliseconds * 1_000_000
+
+
+def iter_log(path):
+    """Yield (timestamp_ns, esp_name, direction, message_type, message) of a log, in file order"""
+    if path.endswith(BinaryLogSink.extension):
+        from session_log import DeviceLog
+        with DeviceLog(path) as log:
+            for timestamp_ns, direction, message_type, message, _ in log.entries():
+                yield timestamp_ns, log.esp_name, direction, message_type, message
+        return
+    for row in read_log(path):
+        yield (parse_timestamp_ns(row['Timestamp']), row['ESP32_Name'], row['Direction'],
+               row['Message_Type'], row['Message'])
+
+
+def session_entries(files, devices=None):
+    """Entries of every log merged in time order, optionally for some devices only"""
+    merged = heapq.merge(*(iter_log(path) for path in files), key=lambda entry: entry[0])
+    for entry in merged:
+        if devices is None or entry[1] in devices:
+            yield entry
+
+
+class CommandCheck:
+    """Compares the commands the PC sends with the Sent commands of the recording"""
+
+    def __init__(self):
+        self.expected = {}          # esp_name -> deque of (replay time offset, command)
+        self.received = 0
+        self.unexpected = []        # (esp_name, command, replay time offset)
+        self.lags = []              # Seconds between recorded and actual send time
+
+    def expect(self, esp_name, offset, command):
+        self.expected.setdefault(esp_name, deque()).append((offset, command))
+
+    def on_command(self, esp_name, offset, command):
+        """Match a command seen on the broker with the oldest recorded one of the device"""
+        self.received += 1
+        queue = self.expected.get(esp_name)
+        if queue:
+            for index, (expected_offset, expected_command) in enumerate(queue):
+                if expected_offset - VERIFY_TOLERANCE > offset:
+                    break
+                if expected_command == command:
+                    del queue[index]
+                    self.lags.append(offset - expected_offset)
+                    return
+        self.unexpected.append((esp_name, command, offset))
+
+    def report(self):
+        missing = [(name, command, offset) for name, queue in self.expected.items()
+                   for offset, command in queue]
+        lines = [f"Commands: {len(self.lags)} matched, {len(missing)} missing, "
+                 f"{len(self.unexpected)} unexpected ({self.received} received)"]
+        if self.lags:
+            lags = sorted(self.lags)
+            lines.append(f"Command lag vs recording: p50 {lags[len(lags) // 2] * 1000:.0f} ms, "
+                         f"max {lags[-1] * 1000:.0f} ms")
+        for esp_name, command, offset in missing[:10]:
+            lines.append(f"  missing    {esp_name} {command} at {offset:.3f} s")
+        for esp_name, command, offset in self.unexpected[:10]:
+            lines.append(f"  unexpected {esp_name} {command} at {offset:.3f} s")
+        return "\n".join(lines)
+
+
+class SessionReplay:
+    """Publishes recorded entries on one MQTT connection, on the recorded schedule"""
+
+    def __init__(self, args):
+        self.args = args
+        self.client = AsyncMQTTClient()
+        self.client.on_message = self.on_command
+        self.check = CommandCheck() if args.verify else None
+        self.sent = 0
+        self.errors = 0
+        self.max_lag = 0.0
+        self.started = time.monotonic()
+        self._seq = {}              # esp_name -> next binary frame sequence number
+        self._inflight = deque()
+
+    def topic(self, esp_name, suffix):
+        return f"{self.args.topic_prefix}/{esp_name.lower()}/{suffix}"
+
+    def on_command(self, msg):
+        parts = msg.topic.split("/")
+        try:
+            command = decode_payload(msg.payload).text.strip()
+        except WireError:
+            return
+        self.check.on_command(parts[-2].upper(), time.monotonic() - self.started, command)
+
+    def payload(self, esp_name, message, offset):
+        if not self.args.binary:
+            return message
+        seq = self._seq.get(esp_name, 0)
+        self._seq[esp_name] = (seq + 1) & 0xFFFF
+        return encode_frame(message, seq, int(offset * 1000))
+
+    async def publish(self, topic, payload):
+        self._inflight.append(self.client.publish_nowait(topic, payload, qos=1))
+        self.sent += 1
+        while len(self._inflight) > MAX_INFLIGHT or (self._inflight and self._inflight[0].done()):
+            await self._wait(self._inflight.popleft())
+
+    async def _wait(self, future):
+        try:
+            await future
+        except MQTTError:
+            self.errors += 1
+
+    async def run(self, entries):
+        args = self.args
+        speed = args.speed
+        first_ns = None
+        self.started = time.monotonic()
+        for timestamp_ns, esp_name, direction, message_type, message in entries:
+            if first_ns is None:
+                first_ns = timestamp_ns
+            recorded = (timestamp_ns - first_ns) / 1e9
+            if recorded < args.start:
+                continue
+            if args.end is not None and recorded > args.end:
+                break
+            # Replay time offset of this entry
+            offset = (recorded - args.start) / speed if speed else 0.0
+            if direction == 'Sent':
+                if self.check and message_type == 'Command':
+                    self.check.expect(esp_name, offset, str(message).strip())
+                continue
+            if message_type == 'Data':
+                topic = self.topic(esp_name, "data")
+            elif message_type == 'Ack' and args.acks:
+                topic = self.topic(esp_name, "ack")
+            else:
+                continue
+            if speed:
+                delay = self.started + offset - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            elif self.sent % 256 == 0:
+                await asyncio.sleep(0)  # Let the socket drain
+            await self.publish(topic, self.payload(esp_name, str(message), offset))
+        while self._inflight:
+            await self._wait(self._inflight.popleft())
+
+    def line(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.sent / elapsed if elapsed else 0.0
+        return (f"[{elapsed:7.1f}s] {self.sent} published ({rate:.1f} msg/s), "
+                f"max {self.max_lag * 1000:.0f} ms behind schedule, {self.errors} errors")
+
+
+async def print_stats(replay):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print(replay.line())
+
+
+async def replay_session(args):
+    files = find_logs(args.paths)
+    if not files:
+        print("No log files found")
+        return
+    devices = {name.strip().upper() for name in args.devices.split(",")} if args.devices else None
+    print(f"Replaying {len(files)} log file(s) at "
+          f"{'maximum speed' if not args.speed else f'{args.speed:g}x'} to {args.broker}:{args.port}...")
+
+    replay = SessionReplay(args)
+    await replay.client.connect(args.broker, args.port, 60)
+    if replay.check:
+        await replay.client.subscribe(f"{args.topic_prefix}/+/command", qos=1)
+    stats = asyncio.create_task(print_stats(replay))
+    try:
+        await replay.run(session_entries(files, devices))
+        if replay.check:
+            await asyncio.sleep(VERIFY_WAIT)
+    finally:
+        stats.cancel()
+        await replay.client.disconnect()
+    print(replay.line())
+    if replay.check:
+        print(replay.check.report())
+
+
+def main():
+    """Main function to start the session replay"""
+    parser = argparse.ArgumentParser(description="Republish recorded ESP32 sessions to MQTT")
+    parser.add_argument("paths", nargs="+", help="log files or folders (.csv, .jsonl, .mlog, .sqlite)")
+    parser.add_argument("--broker", default=MQTT_BROKER, help="MQTT broker address")
+    parser.add_argument("--port", type=int, default=MQTT_PORT, help="MQTT broker port")
+    parser.add_argument("--topic-prefix", default=TOPIC_PREFIX,
+                        help="topic prefix (udem/pfh3221/mosquito for the Step 1/2 scripts)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scale: 1 = as recorded, 10 = ten times faster, 0 = as fast as possible")
+    parser.add_argument("--devices", default="", help="comma-separated device names (default: all)")
+    parser.add_argument("--from", dest="start", type=float, default=0.0,
+                        help="start N seconds into the recording")
+    parser.add_argument("--to", dest="end", type=float, default=None,
+                        help="stop N seconds into the recording")
+    parser.add_argument("--binary", action="store_true", help="send binary wire protocol frames instead of text")
+    parser.add_argument("--acks", action="store_true", help="also replay the devices' blink acks")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare the commands sent by the PC with the recorded ones")
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error("--speed must be 0 or more")
+
+    try:
+        asyncio.run(replay_session(args))
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+
+
+if __name__ == "__main__":
+    main()
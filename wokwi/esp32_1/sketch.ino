@@ -25,11 +25,14 @@ const char* password = "";
 // at the gateway IP. Typically use your PC's local IP.
 const char* mqtt_server = "host.wokwi.internal";  // Wokwi gateway alias for host PC
 const int   mqtt_port   = 1883;
+const int   MQTT_KEEPALIVE = 5;   // seconds; the broker publishes the Last Will after 1.5 x this
 
 // ─── Device identity ─────────────────────────────────
 const String ESP32_NAME    = "ESP32_1";
 const String DATA_TOPIC    = "mosquito/esp32_1/data";
 const String COMMAND_TOPIC = "mosquito/esp32_1/command";
+const String ACK_TOPIC     = "mosquito/esp32_1/ack";      // blink count, sent when a blink sequence ends
+const String STATUS_TOPIC  = "mosquito/esp32_1/status";   // retained "online"; "offline" is the Last Will
 
 // LED pin (GPIO 2 = built-in LED on most devkit boards)
 const int LED_PIN = 2;
@@ -38,6 +41,19 @@ const int LED_PIN = 2;
 const String DATA_STRINGS[] = {"L1", "L2", "FP"};
 const int    NUM_STRINGS     = 3;
 
+// ─── Binary wire protocol (snippets/step4/wire_protocol.py) ───
+// Frame: magic/version, event code, uint16 sequence, uint32 millis(),
+// little-endian; blink commands carry the count in a 9th byte.
+// The PC replies in binary to devices that send binary.
+// Only binary frames carry the sequence number the PC needs to drop QoS 1
+// duplicates; text is kept as the default for the Step 3 interface.
+const bool    USE_BINARY_PROTOCOL = false;   // true = compact frames instead of text
+const uint8_t WIRE_MAGIC          = 0xA1;    // 0xA0 | version 1
+const uint8_t WIRE_HEADER_SIZE    = 8;
+const uint8_t DATA_EVENTS[]       = {0x01, 0x02, 0x03};   // L1, L2, FP
+const uint8_t CMD_BLINK           = 0x42;
+uint16_t      txSequence          = 0;
+
 // Timing
 unsigned long lastSendTime  = 0;
 unsigned long sendInterval  = 1000;
@@ -75,10 +91,28 @@ void ensure_wifi() {
   }
 }
 
+// ─── Binary frames ──────────────────────────────────
+bool publish_frame(uint8_t event) {
+  uint8_t  frame[WIRE_HEADER_SIZE];
+  uint32_t ms = millis();
+  frame[0] = WIRE_MAGIC;
+  frame[1] = event;
+  frame[2] = txSequence & 0xFF;
+  frame[3] = txSequence >> 8;
+  for (int i = 0; i < 4; i++) frame[4 + i] = (ms >> (8 * i)) & 0xFF;
+  txSequence++;
+  return client.publish(DATA_TOPIC.c_str(), frame, WIRE_HEADER_SIZE);
+}
+
 // ─── MQTT callback (commands from PC) ────────────────
 void callback(char* topic, byte* payload, unsigned int length) {
   String msg;
-  for (unsigned int i = 0; i < length; i++) msg += (char)payload[i];
+  if (length > 0 && payload[0] == WIRE_MAGIC) {
+    // Binary command: only blink counts are acted upon
+    if (length > WIRE_HEADER_SIZE && payload[1] == CMD_BLINK) msg = String(payload[WIRE_HEADER_SIZE]);
+  } else {
+    for (unsigned int i = 0; i < length; i++) msg += (char)payload[i];
+  }
   Serial.println("RX [" + String(topic) + "]: " + msg);
 
   if (String(topic) == COMMAND_TOPIC) {
@@ -99,9 +133,11 @@ void callback(char* topic, byte* payload, unsigned int length) {
 void reconnect() {
   if (!client.connected()) {
     Serial.print("MQTT connecting...");
-    if (client.connect(ESP32_NAME.c_str())) {
+    // Last Will: the broker publishes a retained "offline" if this device drops off
+    if (client.connect(ESP32_NAME.c_str(), STATUS_TOPIC.c_str(), 1, true, "offline")) {
       Serial.println("ok");
       client.subscribe(COMMAND_TOPIC.c_str(), 1);  // QoS 1 max
+      client.publish(STATUS_TOPIC.c_str(), "online", true);
     } else {
       Serial.println("fail rc=" + String(client.state()));
       delay(3000);
@@ -119,6 +155,7 @@ void setup() {
   setup_wifi();
 
   client.setServer(mqtt_server, mqtt_port);
+  client.setKeepAlive(MQTT_KEEPALIVE);
   client.setCallback(callback);
   randomSeed(analogRead(0));
 }
@@ -142,13 +179,17 @@ void loop() {
       isBlinking = false;
       digitalWrite(LED_PIN, LOW);
       Serial.println("Blink sequence done");
+      client.publish(ACK_TOPIC.c_str(), String(targetBlinks / 2).c_str());
     }
   }
 
   // Send random data at random intervals (~1 s ± 0.5 s)
   if (!isBlinking && (now - lastSendTime >= sendInterval)) {
-    String data = DATA_STRINGS[random(0, NUM_STRINGS)];
-    if (client.publish(DATA_TOPIC.c_str(), data.c_str())) {
+    int    index = random(0, NUM_STRINGS);
+    String data  = DATA_STRINGS[index];
+    bool   sent  = USE_BINARY_PROTOCOL ? publish_frame(DATA_EVENTS[index])
+                                       : client.publish(DATA_TOPIC.c_str(), data.c_str());
+    if (sent) {
       Serial.println("TX -> " + DATA_TOPIC + ": " + data);
     }
     lastSendTime = now;